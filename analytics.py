@@ -0,0 +1,402 @@
+"""
+analytics.py - Inspection Trends (time-series rollups)
+
+The dashboard counters (stats.py) only know all-time totals. To answer
+"what was the unsafe rate per hour at Gate 3 over the last month?" without
+scanning the whole inspections table, we keep pre-aggregated counts in the
+'inspection_rollups' table:
+
+- grain:    "minute", "hour" or "day"
+- bucket:   start of the minute/hour/day
+- location, camera, status
+- defect:   "" for the inspection itself, or a defect name (one extra row
+            per defect, so charts can count defects as well)
+- count
+
+Rollups are kept up to date the same way as the dashboard counters: a
+session hook handles ORM writes, and bulk writers (ingest.py, loadgen.py)
+call rollup_deltas() / apply_deltas() themselves.
+
+Minute buckets are only kept for ATIS_ROLLUP_MINUTE_DAYS days ('flask
+analytics prune' deletes older ones); hour and day buckets are kept forever.
+
+A trend query reads at most MAX_POINTS buckets of one grain, so its cost
+depends on the date range and the number of locations/cameras, not on how
+many inspections there are.
+
+    flask analytics backfill                     # rebuild everything (archives too)
+    flask analytics backfill --since 2026-02-01  # only recent days
+    flask analytics prune                        # drop old minute buckets
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import archive
+from models import db, Inspection, InspectionRollup, split_defects
+from queries import parse_inspection_filters
+from stats import old_values
+
+GRAINS = ("minute", "hour", "day")
+STEPS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+# Dimensions a trend can be split by
+GROUP_BY = ("status", "location", "camera", "defect")
+
+DEFAULT_DAYS = 30
+DEFAULT_MINUTE_DAYS = 7
+
+# Largest number of buckets one trend query may return
+MAX_POINTS = 1500
+
+# Largest number of series (locations, cameras...) returned, biggest first
+MAX_SERIES = 12
+
+# Inspections read per chunk by the backfill
+CHUNK_SIZE = 5000
+
+# Inspection columns that feed a rollup
+_INSPECTION_FIELDS = ("status", "location", "camera", "timestamp", "defects")
+
+_minute_days = [DEFAULT_MINUTE_DAYS]
+
+
+class TrendError(ValueError):
+    """The trend request has a bad parameter."""
+
+
+def truncate(timestamp, grain):
+    """Start of the minute/hour/day that contains 'timestamp'."""
+    if grain == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if grain == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def minute_cutoff():
+    """Minute buckets older than this are not kept."""
+    return truncate(datetime.utcnow() - timedelta(days=_minute_days[0]), "minute")
+
+
+# -------------------------------------------------------------------------
+# BUILDING AND WRITING DELTAS
+# -------------------------------------------------------------------------
+
+def rollup_deltas(deltas, values, sign=1, cutoff=None):
+    """
+    Add (sign=+1) or remove (sign=-1) one inspection's contribution to the
+    rollups. 'values' has status/location/camera/timestamp/defects keys.
+    Minute buckets before 'cutoff' (default: minute_cutoff()) are skipped.
+    """
+    timestamp = values.get("timestamp")
+    if timestamp is None:
+        return deltas
+    cutoff = cutoff or minute_cutoff()
+    names = list(dict.fromkeys(split_defects(values.get("defects"))))
+
+    for grain in GRAINS:
+        if grain == "minute" and timestamp < cutoff:
+            continue
+        key = (grain, truncate(timestamp, grain), values["location"], values.get("camera") or "", values["status"])
+        deltas[(*key, "")] += sign
+        for name in names:
+            deltas[(*key, name)] += sign
+    return deltas
+
+
+def apply_deltas(connection, deltas):
+    """
+    Add every non-zero delta to its rollup row in one batched statement,
+    on the caller's connection (same transaction as the inspections).
+    """
+    params = [
+        {"grain": grain, "bucket": bucket, "location": location, "camera": camera,
+         "status": status, "defect": defect, "count": delta}
+        for (grain, bucket, location, camera, status, defect), delta in deltas.items()
+        if delta
+    ]
+    if not params:
+        return
+
+    table = InspectionRollup.__table__
+    dialect = connection.dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={"count": table.c.count + stmt.excluded.count},
+        )
+        connection.execute(stmt, params)
+        return
+
+    # Other databases: update first, insert the rows that did not exist yet
+    keys = [c.name for c in table.primary_key.columns]
+    for p in params:
+        result = connection.execute(
+            table.update()
+            .where(*(table.c[k] == p[k] for k in keys))
+            .values(count=table.c.count + p["count"])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**p))
+
+
+def _collect_session_deltas(session, flush_context):
+    """Session hook: turn inserted, deleted and changed inspections into rollup deltas."""
+    deltas = Counter()
+    cutoff = minute_cutoff()
+
+    for obj in session.new:
+        if isinstance(obj, Inspection):
+            rollup_deltas(deltas, {f: getattr(obj, f) for f in _INSPECTION_FIELDS}, cutoff=cutoff)
+
+    for obj in session.deleted:
+        if isinstance(obj, Inspection):
+            old, _ = old_values(obj, _INSPECTION_FIELDS)
+            rollup_deltas(deltas, old, sign=-1, cutoff=cutoff)
+
+    for obj in session.dirty:
+        if isinstance(obj, Inspection):
+            old, changed = old_values(obj, _INSPECTION_FIELDS)
+            if changed:
+                rollup_deltas(deltas, old, sign=-1, cutoff=cutoff)
+                rollup_deltas(deltas, {f: getattr(obj, f) for f in _INSPECTION_FIELDS}, cutoff=cutoff)
+
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+# -------------------------------------------------------------------------
+# BACKFILL AND PRUNING
+# -------------------------------------------------------------------------
+
+def backfill(since=None):
+    """
+    Rebuild the rollups from the inspections table and the archived months
+    (see archive.py), in id order and in chunks. With 'since' only buckets
+    from that day on are rebuilt.
+    Runs in one transaction. Returns the number of inspections processed.
+    """
+    connection = db.session.connection()
+    table = InspectionRollup.__table__
+    stmt = delete(table)
+    if since is not None:
+        since = truncate(since, "day")
+        stmt = stmt.where(table.c.bucket >= since)
+    connection.execute(stmt)
+
+    cutoff = minute_cutoff()
+    processed = _roll_up(connection, connection, since, cutoff)
+    for archive_session in archive.archive_sessions(current_app._get_current_object(), since):
+        processed += _roll_up(archive_session.connection(), connection, since, cutoff)
+
+    db.session.commit()
+    return processed
+
+
+def _roll_up(source, target, since, cutoff):
+    """Add the inspections read from 'source' to the rollups. Returns how many."""
+    processed = 0
+    last_id = 0
+    while True:
+        query = (
+            select(Inspection.id, *(getattr(Inspection, f) for f in _INSPECTION_FIELDS))
+            .where(Inspection.id > last_id)
+            .order_by(Inspection.id)
+            .limit(CHUNK_SIZE)
+        )
+        if since is not None:
+            query = query.where(Inspection.timestamp >= since)
+        rows = source.execute(query).all()
+        if not rows:
+            break
+
+        deltas = Counter()
+        for row in rows:
+            rollup_deltas(deltas, row._mapping, cutoff=cutoff)
+        apply_deltas(target, deltas)
+        processed += len(rows)
+        last_id = rows[-1].id
+
+    return processed
+
+
+def prune():
+    """Delete minute buckets older than the retention, and empty rows. Returns rows deleted."""
+    table = InspectionRollup.__table__
+    result = db.session.execute(
+        delete(table).where(
+            ((table.c.grain == "minute") & (table.c.bucket < minute_cutoff())) | (table.c.count == 0)
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+# -------------------------------------------------------------------------
+# TREND QUERIES
+# -------------------------------------------------------------------------
+
+def _bucket_count(start, end, grain):
+    return int((end - start) / STEPS[grain])
+
+
+def parse_trend_params(args):
+    """
+    Read the trend parameters from a query string:
+    date_from / date_to (YYYY-MM-DD, inclusive; default the last 30 days),
+    grain (minute, hour, day or auto), group_by (status, location, camera,
+    defect) and the filters location, camera, status and defect.
+    Raises TrendError on bad values.
+    """
+    if args.get("plate"):
+        raise TrendError("Trends cannot be filtered by plate.")
+    try:
+        filters = parse_inspection_filters(args)
+    except ValueError as e:
+        raise TrendError(str(e))
+
+    end_day = filters.pop("date_to", None) or truncate(datetime.utcnow(), "day")
+    start = filters.pop("date_from", None) or end_day - timedelta(days=DEFAULT_DAYS - 1)
+    end = end_day + timedelta(days=1)
+    if start >= end:
+        raise TrendError("date_from must not be after date_to.")
+
+    grain = (args.get("grain") or "auto").strip().lower()
+    if grain == "auto":
+        grain = next(
+            g for g in GRAINS
+            if g == "day"
+            or (_bucket_count(start, end, g) <= MAX_POINTS and (g != "minute" or start >= minute_cutoff()))
+        )
+    elif grain not in GRAINS:
+        raise TrendError(f"grain must be one of: auto, {', '.join(GRAINS)}.")
+    elif grain == "minute" and start < truncate(minute_cutoff(), "day"):
+        raise TrendError(f"Minute buckets are only kept for the last {_minute_days[0]} days.")
+
+    if _bucket_count(start, end, grain) > MAX_POINTS:
+        raise TrendError(f"That range has more than {MAX_POINTS} {grain} buckets; use a coarser grain.")
+
+    group_by = (args.get("group_by") or "").strip().lower() or None
+    if group_by is not None and group_by not in GROUP_BY:
+        raise TrendError(f"group_by must be one of: {', '.join(GROUP_BY)}.")
+
+    return {"start": start, "end": end, "grain": grain, "group_by": group_by, "filters": filters}
+
+
+def rollup_query(params, dimension=None):
+    """SUM(count) per bucket (and dimension) and status, for one grain and range."""
+    r = InspectionRollup
+    filters = params["filters"]
+    columns = [r.bucket, r.status]
+    if dimension is not None and dimension != "status":
+        columns.insert(1, getattr(r, dimension))
+
+    query = (
+        db.session.query(*columns, func.sum(r.count))
+        .filter(r.grain == params["grain"], r.bucket >= params["start"], r.bucket < params["end"])
+    )
+    if dimension == "defect":
+        query = query.filter(r.defect == filters["defect"]) if "defect" in filters else query.filter(r.defect != "")
+    else:
+        query = query.filter(r.defect == filters.get("defect", ""))
+    for field in ("location", "camera", "status"):
+        if field in filters:
+            query = query.filter(getattr(r, field) == filters[field])
+    return query.group_by(*columns)
+
+
+def _series(length):
+    return {"total": [0] * length, "unsafe": [0] * length}
+
+
+def _with_rate(series):
+    series["unsafe_rate"] = [
+        round(unsafe / total * 100, 1) if total else None
+        for total, unsafe in zip(series["total"], series["unsafe"])
+    ]
+    return series
+
+
+def trend(params):
+    """
+    Inspection counts per bucket, zero-filled, for the parsed parameters.
+    Returns a JSON-ready dict: the buckets, the overall total / unsafe /
+    unsafe_rate per bucket and, with group_by, the same per series (the
+    MAX_SERIES biggest). Runs one query, or two with group_by.
+    """
+    grain, start = params["grain"], params["start"]
+    buckets = []
+    bucket = start
+    while bucket < params["end"]:
+        buckets.append(bucket)
+        bucket += STEPS[grain]
+    index = {b: i for i, b in enumerate(buckets)}
+
+    overall = _series(len(buckets))
+    for bucket, status, count in rollup_query(params):
+        overall["total"][index[bucket]] += count
+        if status == "unsafe":
+            overall["unsafe"][index[bucket]] += count
+
+    series = {}
+    group_by = params["group_by"]
+    if group_by is not None:
+        for row in rollup_query(params, group_by):
+            bucket, status, count = row[0], row[-2], row[-1]
+            key = status if group_by == "status" else (row[1] or "(none)")
+            entry = series.setdefault(key, _series(len(buckets)))
+            entry["total"][index[bucket]] += count
+            if status == "unsafe":
+                entry["unsafe"][index[bucket]] += count
+
+    ranked = sorted(series.items(), key=lambda item: (-sum(item[1]["total"]), item[0]))
+    return {
+        "grain": grain,
+        "date_from": start.isoformat(),
+        "date_to": params["end"].isoformat(),
+        "group_by": group_by,
+        "buckets": [b.isoformat() for b in buckets],
+        **_with_rate(overall),
+        "series": [{"key": key, **_with_rate(values)} for key, values in ranked[:MAX_SERIES]],
+        "truncated": len(ranked) > MAX_SERIES,
+    }
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+analytics_cli = click.Group("analytics", help="Maintain the inspection trend rollups.")
+
+
+@analytics_cli.command("backfill")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+              help="Only rebuild buckets from this day on (YYYY-MM-DD).")
+def backfill_command(since):
+    """Rebuild the rollups from the inspections table."""
+    processed = backfill(since)
+    click.echo(f"Rolled up {processed:,} inspections.")
+
+
+@analytics_cli.command("prune")
+def prune_command():
+    """Delete minute buckets older than ATIS_ROLLUP_MINUTE_DAYS."""
+    click.echo(f"Deleted {prune():,} rollup rows.")
+
+
+def init_app(app):
+    """Register the session hook and the 'flask analytics' commands."""
+    _minute_days[0] = app.config.get("ATIS_ROLLUP_MINUTE_DAYS", DEFAULT_MINUTE_DAYS)
+    if not event.contains(db.session, "after_flush", _collect_session_deltas):
+        event.listen(db.session, "after_flush", _collect_session_deltas)
+    app.cli.add_command(analytics_cli)
@@ -6,8 +6,42 @@ This file handles all the web routes, database connections, and logic for the ap
 It connects to the SQLite database and renders the HTML templates for the user.
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from models import db, User, Inspection, Alert
+import hmac
+import json
+import os
+
+from flask import (
+    Flask, render_template, request, redirect, url_for, session, jsonify, flash,
+    Response, stream_with_context, send_file, abort,
+)
+from models import db, Inspection, Alert, ReportJob, Artifact, Job
+import database
+import analytics
+import archive
+import artifacts
+import auth
+import benchmark
+import cache
+import defects
+import events
+import inference
+import ingest
+import instrumentation
+import jobs
+import loadgen
+import metrics
+import migrations
+import plates
+import reports as report_engine
+import stats
+import workflow
+from auth import login_required
+from instrumentation import query_budget
+from queries import (
+    parse_inspection_filters, filters_to_args, parse_page_size, decode_cursor,
+    recent_inspections_query, alerts_query, inspection_alerts_query,
+)
+from archive import paginate_inspections, iter_inspection_pages
 from datetime import datetime
 
 # Initialize the Flask application
@@ -18,12 +52,143 @@ app.secret_key = "atis-secret-key-change-in-production"
 
 # Database configuration
 # We are using SQLite for simplicity. The database file will be created in the 'instance' folder.
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///atis.db"
+# Every setting below can also be set with an environment variable of the same
+# name, e.g. ATIS_DATABASE_URL=postgresql+psycopg://... (see database.py)
+app.config["ATIS_DATABASE_URL"] = database.DEFAULT_DATABASE_URL
+app.config["ATIS_DATABASE_READ_URL"] = ""     # optional read replica for the read-only pages
+app.config["ATIS_DB_POOL_SIZE"] = database.DEFAULT_POOL_SIZE
+app.config["ATIS_DB_MAX_OVERFLOW"] = database.DEFAULT_MAX_OVERFLOW
+app.config["ATIS_DB_POOL_TIMEOUT"] = database.DEFAULT_POOL_TIMEOUT
+app.config["ATIS_DB_POOL_RECYCLE"] = database.DEFAULT_POOL_RECYCLE
+app.config["ATIS_DB_POOL_PRE_PING"] = database.DEFAULT_POOL_PRE_PING
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Logins (see auth.py): the password hash, how many password checks run at
+# once and how many logins may wait for one (more get "try again"), and how
+# many failed logins one IP address may make in the window (0 = no limit)
+app.config["ATIS_PASSWORD_METHOD"] = auth.DEFAULT_PASSWORD_METHOD
+app.config["ATIS_AUTH_KDF_WORKERS"] = auth.DEFAULT_KDF_WORKERS
+app.config["ATIS_AUTH_KDF_QUEUE"] = auth.DEFAULT_KDF_QUEUE
+app.config["ATIS_AUTH_KDF_TIMEOUT"] = auth.DEFAULT_KDF_TIMEOUT
+app.config["ATIS_LOGIN_RATE_LIMIT"] = auth.DEFAULT_LOGIN_RATE_LIMIT
+app.config["ATIS_LOGIN_RATE_WINDOW"] = auth.DEFAULT_LOGIN_RATE_WINDOW
+
+# Ingestion API settings. Edge boxes authenticate with an "X-API-Key" header
+# matching ATIS_INGEST_API_KEY (leave it empty to only allow logged-in users).
+app.config["ATIS_INGEST_API_KEY"] = ""
+app.config["ATIS_INGEST_MAX_BATCH"] = ingest.DEFAULT_MAX_BATCH
+app.config["ATIS_INGEST_MAX_BYTES"] = ingest.DEFAULT_MAX_BYTES
+
+# ML inference settings (see inference.py)
+app.config["ATIS_MODEL"] = inference.DEFAULT_MODEL
+app.config["ATIS_INFERENCE_MAX_BATCH"] = inference.DEFAULT_MAX_BATCH
+app.config["ATIS_INFERENCE_MAX_WAIT_MS"] = inference.DEFAULT_MAX_WAIT_MS
+app.config["ATIS_INFERENCE_WORKERS"] = inference.DEFAULT_WORKERS
+
+# Live dashboard updates (see events.py): how many events are kept for
+# reconnecting browsers, and how often idle streams send a keep-alive
+app.config["ATIS_EVENT_BUFFER"] = events.DEFAULT_BUFFER_SIZE
+app.config["ATIS_EVENT_KEEPALIVE"] = events.DEFAULT_KEEPALIVE
+
+# Request metrics (see metrics.py): statements slower than this are logged
+# to "atis.slow_sql"; /metrics needs "Authorization: Bearer <token>" when a
+# token is set; admins can profile a request with the "X-ATIS-Profile" header
+app.config["ATIS_SLOW_QUERY_MS"] = metrics.DEFAULT_SLOW_QUERY_MS
+app.config["ATIS_METRICS_TOKEN"] = ""
+app.config["ATIS_PROFILER_ENABLED"] = True
+
+# Page and fragment cache (see cache.py): "memory" (this process; writes by
+# other processes show up within ATIS_CACHE_TTL seconds), "sqlite" (shared
+# by all processes, in ATIS_CACHE_PATH) or "none". Use "sqlite" when
+# running more than one server worker process.
+app.config["ATIS_CACHE_BACKEND"] = cache.DEFAULT_BACKEND
+app.config["ATIS_CACHE_PATH"] = None
+app.config["ATIS_CACHE_MAX_ENTRIES"] = cache.DEFAULT_MAX_ENTRIES
+app.config["ATIS_CACHE_TTL"] = cache.DEFAULT_TTL
+
+# Trend rollups (see analytics.py): days of per-minute buckets to keep
+app.config["ATIS_ROLLUP_MINUTE_DAYS"] = analytics.DEFAULT_MINUTE_DAYS
+
+# Image and sensor file store (see artifacts.py): where files are kept, the
+# largest upload, how long links are kept (0 = forever) and a limit for the
+# whole store (0 = none). 'flask artifacts gc' applies the last two.
+app.config["ATIS_ARTIFACT_DIR"] = None     # default: instance/artifacts
+app.config["ATIS_ARTIFACT_MAX_BYTES"] = artifacts.DEFAULT_MAX_BYTES
+app.config["ATIS_ARTIFACT_RETENTION_DAYS"] = artifacts.DEFAULT_RETENTION_DAYS
+app.config["ATIS_ARTIFACT_MAX_TOTAL_BYTES"] = artifacts.DEFAULT_MAX_TOTAL_BYTES
+
+# Data retention (see archive.py): resolved inspections older than this many
+# days are moved to monthly archive files by 'flask archive run' (0 = never).
+# History, the API and reports still find them.
+app.config["ATIS_RETENTION_DAYS"] = archive.DEFAULT_RETENTION_DAYS
+app.config["ATIS_ARCHIVE_DIR"] = None      # default: instance/archive
+
+# Background jobs (see jobs.py): worker threads per server process (0 = run
+# 'flask jobs work' separately), how often idle workers look for new jobs,
+# and how long a job may go without a heartbeat before it is taken back.
+# Environment variables of the same names override these (database.ENV_SETTINGS).
+app.config["ATIS_JOB_WORKERS"] = jobs.DEFAULT_WORKERS
+app.config["ATIS_JOB_POLL_INTERVAL"] = jobs.DEFAULT_POLL_INTERVAL
+app.config["ATIS_JOB_LEASE"] = jobs.DEFAULT_LEASE
+
 # Initialize the database with the app
+database.configure(app)
 db.init_app(app)
 
+# Tune every SQLite connection (WAL, cache, mmap...) - see database.py
+database.init_app(app)
+
+# Count SQL queries per request and enforce per-view query budgets
+instrumentation.init_app(app)
+
+# Latency, SQL and template timings for /metrics, slow-query log, profiler
+metrics.init_app(app)
+
+# Keep the dashboard counters in sync with inspection/alert writes
+stats.init_app(app)
+
+# Keep the per-minute/hour/day trend rollups in sync with inspection writes
+analytics.init_app(app)
+
+# Keep the normalized defect table in sync with Inspection.defects
+defects.init_app(app)
+
+# Keep the plate search index in sync with Inspection.plate (see plates.py)
+plates.init_app(app)
+
+# Push new inspections and alert changes to open dashboards (see events.py)
+events.init_app(app)
+metrics.add_gauge("atis_db_connections_in_use", "Database connections checked out of the pools.",
+                  database.pool_checked_out)
+metrics.add_gauge("atis_event_stream_clients", "Open live-update streams.",
+                  lambda: events.get_broker().subscriber_count())
+
+# Run ingestion side effects and report exports in the background (see jobs.py)
+jobs.init_app(app)
+metrics.add_gauge("atis_jobs_waiting", "Background jobs due and waiting for a worker.", jobs.waiting_count)
+
+# Cache rendered fragments until an inspection or alert is written (see cache.py)
+cache.init_app(app)
+
+# Password hashing pool, login rate limit and 'flask auth' (see auth.py)
+auth.init_app(app)
+
+# Create missing tables and apply schema upgrades (see migrations.py)
+migrations.init_app(app)
+
+# Load the ML model once for this process and start the batching engine
+inference.init_app(app)
+
+# 'flask artifacts gc' / 'flask artifacts stats'
+artifacts.init_app(app)
+
+# 'flask archive run' / 'flask archive stats'
+archive.init_app(app)
+
+# Developer commands: 'flask loadgen' (synthetic data) and 'flask bench'
+loadgen.init_app(app)
+benchmark.init_app(app)
+
 
 # -------------------------------------------------------------------------
 # ROUTES
@@ -36,7 +201,7 @@ def index():
     If the user is logged in, send them to the dashboard.
     If not, send them to the login page.
     """
-    if "user" in session:
+    if auth.current_user():
         return redirect(url_for("dashboard"))
     
     return redirect(url_for("login"))
@@ -54,14 +219,19 @@ def login():
         email = request.form.get("email", "").strip()
         password = request.form.get("password", "")
 
-        # Check if user exists in the database
-        user = User.query.filter_by(email=email).first()
-
-        # Check password (in a real app, use hashing like bcrypt!)
-        if user and user.password == password:
+        # Check the password against its hash (on the KDF pool, see auth.py)
+        try:
+            user = auth.authenticate(email, password, client=request.remote_addr)
+        except auth.LoginThrottled as e:
+            flash(str(e), "error")
+            return render_template("login.html"), 429, {"Retry-After": str(e.retry_after)}
+        except auth.LoginBusy as e:
+            flash(str(e), "error")
+            return render_template("login.html"), 503, {"Retry-After": "5"}
+
+        if user:
             # Login successful: store user in session
-            session["user"] = user.email
-            session["role"] = user.role
+            auth.log_in(user)
             return redirect(url_for("dashboard"))
         else:
             # Login failed
@@ -72,76 +242,70 @@ def login():
 
 
 @app.route("/dashboard")
+@login_required
+@database.read_replica
+@query_budget(3)
+@cache.conditional("inspections", "alerts", vary=lambda: events.get_broker().run)
 def dashboard():
     """
     Dashboard Route.
     Shows the main overview: inspection stats, recent inspections, and alerts.
-    """
-    # Security check: must be logged in
-    if "user" not in session:
-        return redirect(url_for("login"))
 
-    # Fetch the 10 most recent inspections for the table
-    inspections = Inspection.query.order_by(Inspection.timestamp.desc()).limit(10).all()
-
-    # Calculate statistics for the top cards
-    total = Inspection.query.count()
-    safe = Inspection.query.filter_by(status="safe").count()
-    unsafe = Inspection.query.filter_by(status="unsafe").count()
-    pending_alerts = Alert.query.filter_by(status="pending").count()
-    
-    # Avoid division by zero
-    pass_rate = 0
-    if total > 0:
-        pass_rate = round((safe / total * 100), 1)
-
-    # Package stats into a dictionary
-    stats = {
-        "total": total,
-        "safe": safe,
-        "unsafe": unsafe,
-        "pending_alerts": pending_alerts,
-        "pass_rate": pass_rate,
+    The three parts of the page are rendered from partial templates and
+    cached until an inspection or alert is written (cache.py), so most
+    views run no queries at all.
+    """
+    # Statistics for the top cards come from the pre-computed counters (stats.py)
+    stats_cards = cache.cached_value("dashboard:stats", ("inspections", "alerts"), stats.dashboard_stats)
+
+    def render_notifications():
+        # Recent alerts for the notification dropdown (limit 5).
+        # The inspection of each alert is loaded in the same query (no N+1).
+        recent_alerts = alerts_query().limit(5).all()
+        return render_template("partials/notifications.html", stats=stats_cards, recent_alerts=recent_alerts)
+
+    fragments = {
+        "stats_cards": cache.fragment(
+            "dashboard:stats_cards", ("inspections", "alerts"),
+            lambda: render_template("partials/dashboard_stats.html", stats=stats_cards),
+        ),
+        # The 10 most recent inspections for the table
+        "recent_inspections": cache.fragment(
+            "dashboard:recent_inspections", ("inspections",),
+            lambda: render_template("partials/recent_inspections.html",
+                                    inspections=recent_inspections_query().all()),
+        ),
+        "notifications": cache.fragment("dashboard:notifications", ("inspections", "alerts"), render_notifications),
     }
 
-    # Fetch recent alerts for the notification dropdown (limit 5)
-    recent_alerts = (
-        Alert.query
-        .join(Inspection)
-        .order_by(Alert.created_at.desc())
-        .limit(5)
-        .all()
-    )
-
     return render_template(
         "index.html",
         user=session["user"],
         role=session["role"],
-        inspections=inspections,
-        stats=stats,
-        recent_alerts=recent_alerts,
+        stats=stats_cards,
+        fragments=fragments,
+        # Live updates continue from here, so nothing between render and connect is missed
+        last_event_id=events.get_broker().last_event_id(),
     )
 
 
 @app.route("/alerts")
+@login_required
+@database.read_replica
+@query_budget(2)
+@cache.conditional("inspections", "alerts")
 def alerts():
     """
     Alerts Page.
     Displays all alerts and allows filtering by status (Pending, Resolved, etc).
     """
-    if "user" not in session:
-        return redirect(url_for("login"))
-
     # Get all alerts, joined with inspection data to show plate numbers, etc.
-    alert_rows = (
-        Alert.query
-        .join(Inspection)
-        .order_by(Alert.created_at.desc())
-        .all()
-    )
+    # The inspection of each alert comes from the same JOIN, so the template
+    # does not fire one extra SELECT per alert row.
+    alert_rows = alerts_query().all()
     
-    # Count how many are pending (for the badge)
-    pending_count = Alert.query.filter_by(status="pending").count()
+    # Count how many are pending (for the badge), from the counters table
+    pending_count = stats.pending_alert_count()
 
     return render_template(
         "alerts.html",
@@ -153,53 +317,355 @@ def alerts():
 
 
 @app.route("/history")
+@login_required
+@database.read_replica
+@query_budget(3)
+@cache.conditional("inspections")
 def history():
     """
     History Page.
-    Shows a complete log of all inspections stored in the system.
-    """
-    if "user" not in session:
-        return redirect(url_for("login"))
+    Shows the log of inspections, one page at a time, newest first.
 
-    # Fetch all inspections, newest first
-    inspections = Inspection.query.order_by(Inspection.timestamp.desc()).all()
-    total_count = len(inspections)
+    Filtering (plate prefix, status, location, camera, defect type, date range)
+    happens in the database, and pages are fetched with a cursor so every page is equally fast.
+    Each rendered page of results is cached until an inspection is written.
+    Pages reaching back past the hot window also read the archive files (see archive.py).
+    """
+    # Bad filter values are ignored on the HTML page instead of failing
+    filters = parse_inspection_filters(request.args, strict=False)
+    page_size = parse_page_size(request.args.get("limit"))
+    cursor = request.args.get("cursor")
+
+    def render_results():
+        inspections, next_cursor = paginate_inspections(filters, cursor=cursor, limit=page_size)
+        return render_template(
+            "partials/history_results.html",
+            inspections=inspections,
+            filters=filters_to_args(filters),
+            next_cursor=next_cursor,
+            is_first_page=not cursor,
+        )
+
+    try:
+        results = cache.fragment(
+            "history:results", ("inspections",), render_results,
+            params=[filters_to_args(filters), cursor, page_size],
+        )
+    except ValueError:
+        # A broken cursor just sends the user back to the first page
+        return redirect(url_for("history", **filters_to_args(filters)))
 
     return render_template(
         "history.html",
         user=session["user"],
         role=session["role"],
-        inspections=inspections,
-        total_count=total_count,
+        results=results,
+        filters=filters_to_args(filters),
+        defect_types=cache.cached_value("defect_types", ("inspections",), defects.defect_type_names),
+    )
+
+
+@app.route("/api/inspections")
+@login_required(api=True)
+@query_budget(2)
+def api_inspections():
+    """
+    Inspections JSON API.
+    Accepts the same filters as the History page and returns one page at a time.
+
+    - Default: a JSON object with "items" and "next_cursor".
+      Pass next_cursor back as ?cursor=... to get the following page.
+    - ?format=ndjson: streams every matching inspection as JSON lines,
+      walking the pages on the server so memory use stays flat.
+    """
+    try:
+        filters = parse_inspection_filters(request.args)
+        page_size = parse_page_size(request.args.get("limit"))
+        cursor = request.args.get("cursor")
+        if cursor:
+            # Validate the cursor up front so streaming never fails half-way
+            decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    if request.args.get("format") == "ndjson":
+        def generate():
+            for rows, _ in iter_inspection_pages(filters, cursor=cursor):
+                for row in rows:
+                    yield json.dumps(row.to_dict()) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    rows, next_cursor = paginate_inspections(filters, cursor=cursor, limit=page_size)
+    return jsonify({
+        "success": True,
+        "items": [row.to_dict() for row in rows],
+        "next_cursor": next_cursor,
+        "limit": page_size,
+    })
+
+
+@app.route("/api/plates/search")
+@login_required(api=True)
+@database.read_replica
+@query_budget(2)
+def api_plate_search():
+    """
+    Plate Search API.
+    Finds plates that look like ?q= across all inspections, archived ones
+    included, tolerating case, punctuation and OCR mix-ups (0/O, 8/B, ...).
+    Returns the best matches first (?limit=, at most 50), each with its
+    spellings, number of inspections and a link to them on the History page.
+    """
+    query = (request.args.get("q") or "").strip()
+    if plates.normalize(query) is None:
+        return jsonify({"success": False, "message": "q must contain letters or digits of a plate."}), 400
+    limit = max(1, min(request.args.get("limit", plates.DEFAULT_LIMIT, type=int), plates.MAX_LIMIT))
+
+    matches = plates.search(query, limit=limit)
+    for match in matches:
+        match["history_url"] = url_for("history", plate=match["plate"])
+    return jsonify({"success": True, "query": query, "key": plates.normalize(query), "items": matches})
+
+
+@app.route("/api/defects")
+@login_required(api=True)
+def api_defects():
+    """
+    Defect Analytics API.
+    Counts inspections per defect type, most common first. Accepts the same
+    filters as /api/inspections, e.g. ?location=...&date_from=2026-02-01.
+    """
+    try:
+        filters = parse_inspection_filters(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify({"success": True, "defects": defects.defect_counts(filters)})
+
+
+@app.route("/api/trends")
+@login_required(api=True)
+@query_budget(2)
+def api_trends():
+    """
+    Inspection Trends API.
+    Inspection and unsafe counts (and the unsafe rate) per minute, hour or
+    day, read from the rollups (analytics.py), e.g.
+    ?date_from=2026-02-01&grain=hour&group_by=location&camera=CAM-004
+    """
+    try:
+        params = analytics.parse_trend_params(request.args)
+    except analytics.TrendError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    result = cache.cached_value(
+        "trends", ("inspections",), lambda: analytics.trend(params),
+        params=params,
+    )
+    return jsonify({"success": True, **result})
+
+
+@app.route("/api/alerts/<int:alert_id>/transition", methods=["POST"])
+@login_required(api=True)
+def api_alert_transition(alert_id):
+    """
+    Change the status of one alert.
+    JSON body: {"status": "acknowledged", "version": 3, "response": "optional note"}
+
+    "version" must be the version the operator saw. If someone else changed
+    the alert since, nothing is written and we answer 409 with the current
+    alert so the screen can be refreshed.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object."}), 400
+    try:
+        target, response = workflow.parse_target(data)
+        items = workflow.parse_items([{"id": alert_id, "version": data.get("version")}])
+    except workflow.WorkflowError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    result = workflow.transition_alerts(items, target, response)["results"][0]
+    outcome = result.pop("result")
+    if outcome == "updated":
+        return jsonify({"success": True, "alert": result})
+    if outcome == "not_found":
+        return jsonify({"success": False, "message": "Alert not found."}), 404
+
+    # The alert may have been archived or deleted since
+    current = db.session.get(Alert, alert_id)
+    if current is None:
+        return jsonify({"success": False, "message": "Alert not found."}), 404
+    if outcome == "conflict":
+        message = "This alert was changed by someone else. Reload and try again."
+        return jsonify({"success": False, "message": message, "alert": current.to_dict()}), 409
+    return jsonify({"success": False, "message": result["message"], "alert": current.to_dict()}), 422
+
+
+@app.route("/api/alerts/bulk", methods=["POST"])
+@login_required(api=True)
+def api_alerts_bulk():
+    """
+    Change the status of many alerts at once.
+    JSON body: {"status": "resolved", "response": "optional note",
+                "alerts": [{"id": 1, "version": 2}, ...]}
+
+    Alerts are updated one batch (one SQL UPDATE) at a time, all in a single
+    transaction. Each alert gets its own result: "updated", "conflict",
+    "invalid_transition" or "not_found".
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object."}), 400
+    try:
+        target, response = workflow.parse_target(data)
+        items = workflow.parse_items(data.get("alerts"))
+    except workflow.WorkflowError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify(workflow.transition_alerts(items, target, response))
+
+
+@app.route("/api/events")
+@login_required(api=True)
+def api_events():
+    """
+    Live Event Stream (Server-Sent Events).
+    Pushes inspection.created, alert.created and alert.updated events to the
+    dashboard as they are committed. Browsers resume after a disconnect by
+    sending the "Last-Event-ID" header (or ?last_event_id=...).
+    An open stream runs no database queries at all.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    generate = events.stream(
+        events.get_broker(),
+        last_event_id=last_event_id,
+        keepalive=app.config["ATIS_EVENT_KEEPALIVE"],
+    )
+    return Response(
+        generate,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
 @app.route("/reports")
+@login_required
+@database.read_replica
 def reports():
     """
     Reports Page.
-    (Placeholder) Future feature for generating PDF/Excel reports.
+    Charts, plus the export form and the user's recent background exports.
     """
-    if "user" not in session:
-        return redirect(url_for("login"))
-        
-    return render_template("reports.html", user=session["user"], role=session["role"])
+    jobs = (
+        ReportJob.query.filter_by(created_by=session["user"])
+        .order_by(ReportJob.id.desc())
+        .limit(10)
+        .all()
+    )
+    return render_template(
+        "reports.html",
+        user=session["user"],
+        role=session["role"],
+        jobs=jobs,
+        datasets=report_engine.DATASETS,
+        formats=report_engine.JOB_FORMATS,
+    )
+
+
+@app.route("/reports/export")
+@login_required(api=True)
+def reports_export():
+    """
+    Streamed Report Download.
+    ?dataset=inspections|alerts&format=csv|jsonl plus the filters
+    (date_from, date_to, location, camera, status). Rows are read with a
+    server-side cursor and sent chunk by chunk, so memory use stays flat.
+    """
+    try:
+        dataset, fmt, filters = report_engine.parse_report_params(request.args)
+    except report_engine.ReportError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    filename = report_engine.download_name(dataset, fmt)
+    return Response(
+        stream_with_context(report_engine.stream_report(dataset, fmt, filters)),
+        mimetype=report_engine.MIMETYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.route("/api/reports/jobs", methods=["POST"])
+@login_required(api=True)
+def api_report_jobs():
+    """
+    Start a Background Export.
+    Takes the same parameters as /reports/export (form or JSON body) and also
+    accepts format=xlsx. Returns 202 with the job; poll it until "done".
+    """
+    params = request.get_json(silent=True) or request.form.to_dict()
+    if not isinstance(params, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object."}), 400
+    params = {k: str(v) for k, v in params.items() if v not in (None, "")}
+    try:
+        dataset, fmt, _ = report_engine.parse_report_params(params, formats=report_engine.JOB_FORMATS)
+    except report_engine.ReportError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    filters_args = {k: v for k, v in params.items() if k not in ("dataset", "format")}
+    job = report_engine.create_job(dataset, fmt, filters_args, session["user"])
+    return jsonify({"success": True, "job": job.to_dict()}), 202
+
+
+@app.route("/api/reports/jobs/<int:job_id>")
+@login_required(api=True)
+def api_report_job(job_id):
+    """Status of one background export."""
+    job = db.session.get(ReportJob, job_id)
+    if job is None or job.created_by != session["user"]:
+        return jsonify({"success": False, "message": "Report job not found."}), 404
+
+    data = job.to_dict()
+    if job.status == "done":
+        data["download_url"] = url_for("report_job_download", job_id=job.id)
+    return jsonify({"success": True, "job": data})
+
+
+@app.route("/reports/jobs/<int:job_id>/download")
+@login_required
+def report_job_download(job_id):
+    """Download the file of a finished background export."""
+    job = db.session.get(ReportJob, job_id)
+    if job is None or job.created_by != session["user"] or job.status != "done":
+        abort(404)
+
+    return send_file(
+        job.path,
+        mimetype=report_engine.MIMETYPES[job.format],
+        as_attachment=True,
+        download_name=report_engine.download_name(job.dataset, job.format),
+    )
 
 
 @app.route("/inspection/<int:inspection_id>")
+@login_required
+@query_budget(3)
 def inspection_detail(inspection_id):
     """
     Inspection Detail Page.
     Shows full details for a specific inspection ID.
     """
-    if "user" not in session:
-        return redirect(url_for("login"))
-
-    # Get the inspection or show 404 if not found
-    insp = Inspection.query.get_or_404(inspection_id)
-    
-    # Also get any alerts related to this inspection
-    related_alerts = Alert.query.filter_by(inspection_id=insp.id).order_by(Alert.created_at.desc()).all()
+    # Get the inspection (from the archive if it was moved there) or show 404
+    insp = db.session.get(Inspection, inspection_id)
+    if insp is not None:
+        # Also get any alerts related to this inspection, and its images and sensor files
+        related_alerts = inspection_alerts_query(insp.id).all()
+        files = artifacts.inspection_artifacts(insp.id)
+    else:
+        insp, related_alerts, files = archive.find_inspection(app, inspection_id)
+        if insp is None:
+            abort(404)
 
     return render_template(
         "inspection.html",
@@ -207,9 +673,102 @@ def inspection_detail(inspection_id):
         role=session["role"],
         inspection=insp,
         alerts=related_alerts,
+        files=files,
+        thumbnails=artifacts.Image is not None,
     )
 
 
+@app.route("/api/inspections/<int:inspection_id>/artifacts", methods=["POST"])
+@login_required(api=True, api_key=True)
+def api_upload_artifact(inspection_id):
+    """
+    Artifact Upload API.
+    Attaches an image or sensor file to an inspection. Send the file either
+    as the raw request body or as the "file" field of a multipart form;
+    "?kind=image|sensor|other" and "?filename=" say what it is.
+    The file is streamed to disk, never held in memory (see artifacts.py).
+    Same authentication as /api/ingest.
+    """
+    max_bytes = app.config["ATIS_ARTIFACT_MAX_BYTES"]
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({"success": False, "message": f"File too large (max {max_bytes:,} bytes)."}), 413
+
+    insp = db.session.get(Inspection, inspection_id)
+    if insp is None:
+        return jsonify({"success": False, "message": "Inspection not found."}), 404
+
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"success": False, "message": "Missing the 'file' field."}), 400
+        stream, filename, declared_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, declared_type = request.stream, None, request.mimetype
+
+    try:
+        link, created = artifacts.attach(
+            app, insp, stream,
+            kind=request.args.get("kind", "image"),
+            filename=request.args.get("filename") or filename,
+            declared_type=declared_type,
+            max_bytes=max_bytes,
+        )
+    except artifacts.ArtifactTooLarge as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+    except artifacts.ArtifactError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify({
+        "success": True,
+        "created": created,
+        "artifact": link.to_dict(),
+        "url": url_for("artifact_file", sha256=link.artifact.sha256),
+    }), 201 if created else 200
+
+
+def _find_artifact(sha256):
+    """The artifact with this hash, or a 404."""
+    if not artifacts.is_sha256(sha256):
+        abort(404)
+    return Artifact.query.filter_by(sha256=sha256).first_or_404()
+
+
+@app.route("/artifacts/<sha256>")
+@login_required
+@query_budget(1)
+def artifact_file(sha256):
+    """
+    Download an artifact. Supports Range requests (resume, seeking) and
+    conditional requests; the browser may keep it for a year because the
+    content of a hash never changes.
+    """
+    artifact = _find_artifact(sha256)
+    if not os.path.exists(artifacts.object_path(app, sha256)):
+        abort(404)
+    return artifacts.send_artifact(app, artifact, download_name=request.args.get("name") or None)
+
+
+@app.route("/artifacts/<sha256>/thumb")
+@login_required
+@query_budget(1)
+def artifact_thumbnail(sha256):
+    """
+    A JPEG thumbnail of an image artifact (?size=128, 256 or 512), made on
+    the first request and then served from disk.
+    """
+    artifact = _find_artifact(sha256)
+    try:
+        path = artifacts.thumbnail(app, artifact, request.args.get("size", artifacts.DEFAULT_THUMB_SIZE, type=int))
+    except artifacts.ThumbnailUnavailable as e:
+        return jsonify({"success": False, "message": str(e)}), 501
+    except artifacts.ArtifactError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    response = send_file(path, mimetype="image/jpeg", conditional=True, max_age=365 * 24 * 3600)
+    response.cache_control.private = True
+    return response
+
+
 @app.route("/logout")
 def logout():
     """
@@ -220,25 +779,133 @@ def logout():
 
 
 @app.route("/predict", methods=["POST"])
+@login_required(api=True)
 def predict():
     """
     Prediction API Endpoint.
-    This route receives data (image or sensor) and would run the ML model.
-    Currently returns a dummy success response.
+    Receives sensor data and returns the model's prediction.
+
+    The model runs in the inference engine (inference.py), which batches
+    concurrent requests together. Send either:
+    - {"features": [0.2, 0.4, ...]} for one prediction, or
+    - {"inputs": [[...], [...]]} for several at once (at most
+      inference.MAX_INPUTS).
+    Form posts may send "features" as a comma-separated string.
     """
-    if "user" not in session:
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-
     # Get JSON data or form data
-    data = request.get_json() if request.is_json else request.form.to_dict()
-    
-    # TODO: Connect actual ML model here!
-    result = {
+    data = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Expected a JSON object."}), 400
+
+    engine = inference.get_engine(app)
+    try:
+        if "inputs" in data:
+            results = engine.predict_many(data["inputs"])
+            return jsonify({"success": True, "results": results})
+
+        features = data.get("features")
+        if isinstance(features, str):
+            try:
+                features = [float(v) for v in features.split(",") if v.strip()]
+            except ValueError:
+                raise inference.InferenceError("features must be a list of numbers.")
+        result = engine.predict(features)
+    except inference.InferenceError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify({"success": True, **result})
+
+
+@app.route("/api/ingest", methods=["POST"])
+@login_required(api=True, api_key=True)
+def api_ingest():
+    """
+    Batch Ingestion API.
+    Receives a batch of inspection results from the edge boxes (JSON array or
+    JSON lines), stores the new ones in a single transaction, and reports the
+    outcome of each item. Alerts for unsafe results, counters and live
+    updates follow a moment later from a background job ("job_id").
+
+    Every item needs a unique "event_id". Sending the same batch again
+    (e.g. after a timeout) reports the items as "duplicate" instead of
+    creating them twice.
+    """
+    # The body is read into memory: refuse big ones before reading them, and
+    # stop reading a body sent without a length (chunked) after the limit
+    max_bytes = app.config["ATIS_INGEST_MAX_BYTES"]
+    too_large = f"Request body too large (max {max_bytes:,} bytes)."
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({"success": False, "message": too_large}), 413
+    body = request.stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        return jsonify({"success": False, "message": too_large}), 413
+
+    try:
+        items = ingest.parse_batch(body, request.content_type or "")
+    except ingest.BatchError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    max_batch = app.config["ATIS_INGEST_MAX_BATCH"]
+    if len(items) > max_batch:
+        return jsonify({"success": False, "message": f"Batch too large (max {max_batch} items)."}), 413
+
+    return jsonify(ingest.ingest_batch(items))
+
+
+@app.route("/api/jobs")
+@login_required(api=True, roles=("Admin",))
+@query_budget(2)
+def api_jobs():
+    """
+    Background Jobs API (admins only: jobs belong to everyone and their
+    payloads are internal).
+    Number of jobs per status, and the latest jobs (?status=, ?kind= and
+    ?limit= narrow the list).
+    """
+    query = Job.query.order_by(Job.id.desc())
+    status = request.args.get("status")
+    if status:
+        if status not in jobs.STATUSES:
+            return jsonify({"success": False, "message": f"Unknown status '{status}'."}), 400
+        query = query.filter(Job.status == status)
+    if request.args.get("kind"):
+        query = query.filter(Job.kind == request.args["kind"])
+    limit = max(1, min(request.args.get("limit", 50, type=int), 200))
+
+    return jsonify({
         "success": True,
-        "prediction": None,
-        "message": "Prediction endpoint ready -- connect your ML model here.",
-    }
-    return jsonify(result)
+        "counts": jobs.status_counts(),
+        "items": [job.to_dict() for job in query.limit(limit)],
+    })
+
+
+@app.route("/api/jobs/<int:job_id>")
+@login_required(api=True, api_key=True, roles=("Admin",))
+@query_budget(1)
+def api_job(job_id):
+    """
+    Status of one background job (e.g. the "job_id" returned by /api/ingest),
+    for the edge boxes (X-API-Key) and admins.
+    """
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Metrics for Prometheus (text exposition format): request latency,
+    SQL counts and durations, and template render times, per route.
+    """
+    token = app.config["ATIS_METRICS_TOKEN"]
+    if token:
+        sent = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(sent, f"Bearer {token}"):
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 # -------------------------------------------------------------------------
@@ -0,0 +1,485 @@
+"""
+archive.py - Data Retention and Archives
+
+The inspections and alerts tables only ever grew, so every count, sort and
+join got a little slower each day. Old, finished data is now moved out of
+the main database into one archive file per month:
+
+    instance/archive/inspections-2025-03.db
+
+An inspection is archived when it is older than the hot window
+(ATIS_RETENTION_DAYS, default 365 days) and all of its alerts are resolved;
+its alerts, defect links and file links (artifacts.py) move with it.
+Unresolved work always stays in the main database, however old it is.
+
+Each archive file is a small SQLite database with the same tables and
+indexes as the main one (inspections, alerts, inspection_defects,
+defect_types, inspection_artifacts), so the normal query builders
+(queries.py, reports.py) run on it unchanged. The stored files and their
+artifacts rows stay in the main database: 'flask artifacts gc' counts the
+links in the archives as live. Files are only ever added to: rows are copied into the month
+file first and deleted from the main database afterwards, and the
+archive_months table (updated in the same transaction as the delete) says
+which months hold data. A crash in between leaves the rows in both places;
+readers skip the duplicates and the next run finishes the move.
+
+Searches that reach past the hot window read the archives transparently:
+- History pages and /api/inspections: paginate_inspections() below merges
+  archived rows into a page only when the page reaches back that far, and
+  only opens the months inside the date range.
+- Report exports: reports.iter_rows() merges the archive months in order.
+- The inspection detail page finds archived inspections (with their files) by id.
+
+Dashboard counters (stats.py) and trend rollups (analytics.py) keep
+counting archived inspections: they still happened. 'flask stats rebuild'
+and 'flask analytics backfill' read the archives too.
+
+Run 'flask archive run' daily (e.g. from cron); 'flask archive stats' shows
+what is where.
+"""
+
+import heapq
+import os
+import threading
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, create_engine, delete, exists, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, lazyload
+from sqlalchemy.orm.attributes import set_committed_value
+
+import cache
+import instrumentation
+from models import (
+    db, Alert, ArchiveMonth, Artifact, DefectType, Inspection, InspectionArtifact, inspection_defects,
+)
+from queries import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, build_page_query, decode_cursor, split_page
+
+DEFAULT_RETENTION_DAYS = 365    # 0 = never archive
+BATCH_SIZE = 1000               # inspections moved per transaction
+
+# The tables every archive file has (same columns and indexes as the main database)
+ARCHIVE_TABLES = (
+    DefectType.__table__, Inspection.__table__, Alert.__table__, inspection_defects,
+    InspectionArtifact.__table__,
+)
+
+
+# -------------------------------------------------------------------------
+# ARCHIVE FILES
+# -------------------------------------------------------------------------
+
+def archive_dir(app):
+    """Folder of the archive files (ATIS_ARCHIVE_DIR, default instance/archive)."""
+    return app.config.get("ATIS_ARCHIVE_DIR") or os.path.join(app.instance_path, "archive")
+
+
+def month_key(timestamp):
+    """Archive month of a timestamp, e.g. '2025-03'."""
+    return timestamp.strftime("%Y-%m")
+
+
+def month_path(app, month):
+    return os.path.join(archive_dir(app), f"inspections-{month}.db")
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def month_engine(app, month, create=False):
+    """
+    The engine of one month's archive file (one per file and process).
+    With create=True a missing file is created with the archive tables.
+    Files written by an older version get the tables added since then.
+    """
+    path = month_path(app, month)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            if not create and not os.path.exists(path):
+                raise FileNotFoundError(f"Archive file {path} is missing.")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine = create_engine(f"sqlite:///{path}")
+            db.metadata.create_all(engine, tables=ARCHIVE_TABLES)
+            _engines[path] = engine
+    return engine
+
+
+def dispose_engines():
+    """Close every archive connection (e.g. before moving the files)."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+# -------------------------------------------------------------------------
+# WHICH MONTHS TO READ
+# -------------------------------------------------------------------------
+
+def archived_months():
+    """
+    Every archived month, newest first, as ArchiveMonth rows. Read on every
+    search (one small query) rather than cached: a stale list would make
+    freshly archived inspections disappear from the results.
+    """
+    return ArchiveMonth.query.order_by(ArchiveMonth.month.desc()).all()
+
+
+def months_for(filters, before=None):
+    """
+    The archived months that can hold inspections matching the date range
+    of 'filters' (and older than 'before', if given), newest first.
+    """
+    start = filters.get("date_from")
+    end = filters["date_to"] + timedelta(days=1) if "date_to" in filters else None
+    return [
+        m for m in archived_months()
+        if (start is None or m.last_timestamp >= start)
+        and (end is None or m.first_timestamp < end)
+        and (before is None or m.first_timestamp <= before)
+    ]
+
+
+# -------------------------------------------------------------------------
+# READING
+# -------------------------------------------------------------------------
+
+def _newest_first(row):
+    return (row.timestamp, row.id)
+
+
+def paginate_inspections(filters, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    queries.paginate_inspections() across the main database and the
+    archives. Archive months are only opened when the page reaches back
+    past the newest archived inspection. Returns (rows, next_cursor).
+    """
+    app = current_app._get_current_object()
+
+    rows = build_page_query(filters, cursor=cursor, limit=limit).all()
+    before = decode_cursor(cursor)[0] if cursor else None
+
+    for month in months_for(filters, before):
+        # A full page newer than everything in this month (and in the older ones): done
+        if len(rows) > limit and rows[limit].timestamp > month.last_timestamp:
+            break
+        instrumentation.allow_queries(1)
+        with Session(month_engine(app, month.month)) as archive_session:
+            query = archive_session.query(Inspection)
+            found = build_page_query(filters, cursor=cursor, limit=limit, query=query).all()
+        # Main database rows come first, so a row found in both places keeps that version
+        rows = _unique_by_id(sorted(rows + found, key=_newest_first, reverse=True))[:limit + 1]
+
+    return split_page(rows, limit)
+
+
+def _unique_by_id(rows):
+    seen = set()
+    unique = []
+    for row in rows:
+        if row.id not in seen:
+            seen.add(row.id)
+            unique.append(row)
+    return unique
+
+
+def iter_inspection_pages(filters, cursor=None, limit=MAX_PAGE_SIZE):
+    """queries.iter_inspection_pages() across the main database and the archives."""
+    while True:
+        rows, cursor = paginate_inspections(filters, cursor=cursor, limit=limit)
+        if rows:
+            yield rows, cursor
+        if not cursor:
+            return
+
+
+def iter_merged(app, read, filters, primary, key):
+    """
+    Rows from the main database and from every archive month in the date
+    range of 'filters', merged into one stream ordered by key(row).
+    read(connection) returns the (sorted) rows of one source; 'primary' is
+    the main database session or connection. Rows found in two places
+    (see the top of this file) are returned once.
+    """
+    months = months_for(filters)
+    if not months:
+        yield from read(primary)
+        return
+
+    with ExitStack() as stack:
+        sources = [read(primary)]
+        for month in months:
+            connection = stack.enter_context(month_engine(app, month.month).connect())
+            sources.append(read(connection))
+
+        last = None
+        for row in heapq.merge(*sources, key=key):
+            if last is not None and key(row) == last:
+                continue
+            last = key(row)
+            yield row
+
+
+def find_inspection(app, inspection_id):
+    """
+    An archived inspection, its alerts and its file links, or
+    (None, [], []) if no archive has it. The objects are detached: read
+    them, but do not change them. Links whose file was deleted since
+    ('flask artifacts gc') are left out.
+    """
+    for month in archived_months():
+        if not month.first_id <= inspection_id <= month.last_id:
+            continue
+        instrumentation.allow_queries(3)
+        with Session(month_engine(app, month.month)) as archive_session:
+            inspection = archive_session.get(Inspection, inspection_id)
+            if inspection is not None:
+                alerts = (
+                    archive_session.query(Alert)
+                    .filter(Alert.inspection_id == inspection_id)
+                    .order_by(Alert.created_at.desc())
+                    .all()
+                )
+                # The artifacts rows are in the main database, not in the archive file
+                links = (
+                    archive_session.query(InspectionArtifact)
+                    .options(lazyload(InspectionArtifact.artifact))
+                    .filter(InspectionArtifact.inspection_id == inspection_id)
+                    .order_by(InspectionArtifact.created_at, InspectionArtifact.id)
+                    .all()
+                )
+                return inspection, alerts, _with_artifacts(links)
+    return None, [], []
+
+
+def _with_artifacts(links):
+    """Attach the main database's Artifact to each archived link; drop links without one."""
+    if not links:
+        return []
+    found = {
+        artifact.id: artifact
+        for artifact in Artifact.query.filter(Artifact.id.in_({link.artifact_id for link in links}))
+    }
+    kept = []
+    for link in links:
+        if link.artifact_id in found:
+            set_committed_value(link, "artifact", found[link.artifact_id])
+            kept.append(link)
+    return kept
+
+
+def linked_artifact_ids(app, since=None):
+    """
+    Ids of the artifacts linked from any archive file (links created
+    from 'since' on, if given), for 'flask artifacts gc'.
+    """
+    ids = set()
+    table = InspectionArtifact.__table__
+    query = select(table.c.artifact_id).distinct()
+    if since is not None:
+        query = query.where(table.c.created_at >= since)
+    for month in archived_months():
+        with month_engine(app, month.month).connect() as connection:
+            ids.update(connection.execute(query).scalars())
+    return ids
+
+
+def archive_sessions(app, since=None):
+    """
+    Yield a session on each archive file (holding data from 'since' on),
+    for maintenance code that recomputes totals from all the data.
+    """
+    for month in ArchiveMonth.query.order_by(ArchiveMonth.month):
+        if since is not None and month.last_timestamp < since:
+            continue
+        with Session(month_engine(app, month.month)) as archive_session:
+            yield archive_session
+
+
+# -------------------------------------------------------------------------
+# ARCHIVING
+# -------------------------------------------------------------------------
+
+def _archivable(cutoff):
+    """Inspections older than the cutoff whose alerts are all resolved."""
+    open_alert = exists().where(Alert.inspection_id == Inspection.id, Alert.status != "resolved")
+    return and_(Inspection.timestamp < cutoff, ~open_alert)
+
+
+def _rows(connection, table, column, ids):
+    return [dict(row) for row in connection.execute(select(table).where(column.in_(ids))).mappings()]
+
+
+def _copy_to_archive(app, month, inspections, alerts, links, files, defect_types):
+    """Insert one month's rows into its archive file (rows already there are skipped)."""
+    engine = month_engine(app, month, create=True)
+    with engine.begin() as connection:
+        for table, rows in (
+            (DefectType.__table__, defect_types),
+            (Inspection.__table__, inspections),
+            (Alert.__table__, alerts),
+            (inspection_defects, links),
+            (InspectionArtifact.__table__, files),
+        ):
+            if rows:
+                connection.execute(sqlite_insert(table).on_conflict_do_nothing(), rows)
+
+
+def _record_month(month, inspections, alert_count):
+    """Add a batch to the month's archive_months row."""
+    row = db.session.get(ArchiveMonth, month)
+    first = min(inspections, key=lambda r: (r["timestamp"], r["id"]))
+    last = max(inspections, key=lambda r: (r["timestamp"], r["id"]))
+    ids = [r["id"] for r in inspections]
+    if row is None:
+        row = ArchiveMonth(
+            month=month, inspections=0, alerts=0,
+            first_timestamp=first["timestamp"], last_timestamp=last["timestamp"],
+            first_id=min(ids), last_id=max(ids),
+        )
+        db.session.add(row)
+    row.inspections += len(inspections)
+    row.alerts += alert_count
+    row.first_timestamp = min(row.first_timestamp, first["timestamp"])
+    row.last_timestamp = max(row.last_timestamp, last["timestamp"])
+    row.first_id = min(row.first_id, min(ids))
+    row.last_id = max(row.last_id, max(ids))
+
+
+def archive_batch(app, ids):
+    """
+    Move these inspections (with their alerts, defect links and file links)
+    to the archive files of their months. Returns (inspections, alerts) moved.
+    """
+    connection = db.session.connection()
+    inspections = _rows(connection, Inspection.__table__, Inspection.id, ids)
+    alerts = _rows(connection, Alert.__table__, Alert.inspection_id, ids)
+    links = _rows(connection, inspection_defects, inspection_defects.c.inspection_id, ids)
+    type_ids = {link["defect_type_id"] for link in links}
+    defect_types = _rows(connection, DefectType.__table__, DefectType.id, type_ids) if type_ids else []
+    files = _rows(connection, InspectionArtifact.__table__, InspectionArtifact.inspection_id, ids)
+
+    # 1. Copy, month by month (committed in the archive files)
+    month_of = {row["id"]: month_key(row["timestamp"]) for row in inspections}
+    by_month = defaultdict(lambda: {"inspections": [], "alerts": [], "links": [], "files": []})
+    for row in inspections:
+        by_month[month_of[row["id"]]]["inspections"].append(row)
+    for row in alerts:
+        by_month[month_of[row["inspection_id"]]]["alerts"].append(row)
+    for row in links:
+        by_month[month_of[row["inspection_id"]]]["links"].append(row)
+    for row in files:
+        by_month[month_of[row["inspection_id"]]]["files"].append(row)
+    for month, rows in by_month.items():
+        _copy_to_archive(app, month, rows["inspections"], rows["alerts"], rows["links"], rows["files"],
+                         defect_types)
+
+    # 2. Delete from the main database and record the months, in one transaction.
+    # These are plain table deletes: the dashboard counters and trend rollups
+    # keep counting the archived inspections.
+    for table, column in (
+        (inspection_defects, inspection_defects.c.inspection_id),
+        (InspectionArtifact.__table__, InspectionArtifact.inspection_id),
+        (Alert.__table__, Alert.inspection_id),
+        (Inspection.__table__, Inspection.id),
+    ):
+        connection.execute(delete(table).where(column.in_(ids)))
+    for month, rows in by_month.items():
+        _record_month(month, rows["inspections"], len(rows["alerts"]))
+    cache.mark_changed(db.session, "inspections", "alerts")
+    db.session.commit()
+    return len(inspections), len(alerts)
+
+
+def run(app, retention_days=DEFAULT_RETENTION_DAYS, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Archive every inspection older than the hot window whose alerts are all
+    resolved, oldest first, batch_size per transaction.
+    Returns {"inspections": n, "alerts": n, "cutoff": datetime}.
+    """
+    summary = {"inspections": 0, "alerts": 0, "cutoff": None}
+    if not retention_days:
+        return summary
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    summary["cutoff"] = cutoff
+
+    last_ts, last_id = datetime.min, 0
+    while True:
+        batch = db.session.execute(
+            select(Inspection.id, Inspection.timestamp)
+            .where(
+                _archivable(cutoff),
+                or_(
+                    Inspection.timestamp > last_ts,
+                    and_(Inspection.timestamp == last_ts, Inspection.id > last_id),
+                ),
+            )
+            .order_by(Inspection.timestamp, Inspection.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_ts, last_id = batch[-1].timestamp, batch[-1].id
+
+        if dry_run:
+            summary["inspections"] += len(batch)
+            continue
+        moved, alerts = archive_batch(app, [row.id for row in batch])
+        summary["inspections"] += moved
+        summary["alerts"] += alerts
+
+    db.session.rollback()
+    return summary
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+archive_cli = click.Group("archive", help="Move old inspections to the monthly archive files.")
+
+
+@archive_cli.command("run")
+@click.option("--days", type=int, default=None, help="Override ATIS_RETENTION_DAYS (0 = archive nothing).")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True, help="Inspections moved per transaction.")
+@click.option("--dry-run", is_flag=True, help="Only count what would be archived.")
+def run_command(days, batch_size, dry_run):
+    """Archive resolved inspections older than the hot window."""
+    app = current_app._get_current_object()
+    if days is None:
+        days = app.config.get("ATIS_RETENTION_DAYS", DEFAULT_RETENTION_DAYS)
+
+    summary = run(app, days, batch_size, dry_run)
+    if summary["cutoff"] is None:
+        click.echo("Retention is off (0 days); nothing archived.")
+    elif dry_run:
+        click.echo(f"{summary['inspections']:,} inspections before {summary['cutoff']:%Y-%m-%d} would be archived.")
+    else:
+        click.echo(
+            f"Archived {summary['inspections']:,} inspections and {summary['alerts']:,} alerts "
+            f"from before {summary['cutoff']:%Y-%m-%d}."
+        )
+
+
+@archive_cli.command("stats")
+def stats_command():
+    """List the archived months."""
+    app = current_app._get_current_object()
+    months = ArchiveMonth.query.order_by(ArchiveMonth.month).all()
+    if not months:
+        click.echo("Nothing archived yet.")
+    for m in months:
+        path = month_path(app, m.month)
+        size = os.path.getsize(path) / 1024 / 1024 if os.path.exists(path) else 0
+        click.echo(f"{m.month}  {m.inspections:>10,} inspections  {m.alerts:>9,} alerts  {size:8.1f} MiB")
+
+
+def init_app(app):
+    """Register 'flask archive'."""
+    app.cli.add_command(archive_cli)
@@ -0,0 +1,523 @@
+"""
+artifacts.py - Image and Sensor File Store
+
+Edge boxes can upload the tire images and sensor traces of an inspection.
+Files are kept on disk, not in the database (blobs would make every query
+on the database file slower), in a content-addressed layout:
+
+    instance/artifacts/objects/ab/cd/abcd1234...   (the SHA-256 of the content)
+    instance/artifacts/thumbs/abcd1234...-256.jpg  (thumbnails, made on first request)
+    instance/artifacts/tmp/                        (uploads in progress)
+
+- The same file uploaded twice (or for two inspections) is stored once.
+- Uploads are streamed to a temporary file in CHUNK_SIZE pieces while the
+  hash is computed, then renamed into place, so a large upload never sits
+  in memory and a half-written file is never visible.
+- Downloads use send_file(conditional=True): the file is handed to the
+  server's sendfile support, with ETag and HTTP Range requests (resumable
+  downloads, seeking in large traces). Set USE_X_SENDFILE = True when a
+  front server (nginx, Apache) should send the files instead.
+- Thumbnails need Pillow ('pip install Pillow'); without it the thumbnail
+  URL answers 501 and the page links the full image instead.
+
+Disk use is kept bounded by 'flask artifacts gc', to run from cron:
+1. links older than ATIS_ARTIFACT_RETENTION_DAYS are removed
+2. files no inspection links to any more are deleted (links of archived
+   inspections, in the archive files, count too; see archive.py)
+3. if the store is still above ATIS_ARTIFACT_MAX_TOTAL_BYTES, the least
+   recently used files are deleted until it fits
+4. leftovers are compacted away: files without a database row, thumbnails
+   of deleted files, abandoned uploads and empty folders
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import send_file
+from sqlalchemy import exists, func
+from sqlalchemy.exc import IntegrityError
+
+import archive
+from models import db, Artifact, InspectionArtifact
+
+try:
+    from PIL import Image
+except ImportError:     # thumbnails are optional
+    Image = None
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024        # largest single upload
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_MAX_TOTAL_BYTES = 0                 # 0 = no limit on the whole store
+
+KINDS = ("image", "sensor", "other")
+
+THUMB_SIZES = (128, 256, 512)
+DEFAULT_THUMB_SIZE = 256
+MAX_IMAGE_PIXELS = 64_000_000               # refuse "decompression bombs"
+
+# Files younger than this are never collected (an upload may be linking them right now)
+GC_GRACE = timedelta(hours=1)
+
+# The first bytes of the image formats we show inline
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# Types a sensor trace may be declared as; anything else is stored as binary
+DATA_TYPES = ("text/csv", "application/json", "application/x-ndjson", "text/plain")
+
+
+class ArtifactError(ValueError):
+    """The upload or request is invalid."""
+
+
+class ArtifactTooLarge(ArtifactError):
+    """The upload is bigger than ATIS_ARTIFACT_MAX_BYTES."""
+
+
+class ThumbnailUnavailable(ArtifactError):
+    """Pillow is not installed, or the file is not an image."""
+
+
+# -------------------------------------------------------------------------
+# PATHS
+# -------------------------------------------------------------------------
+
+def storage_dir(app):
+    """Root folder of the store (ATIS_ARTIFACT_DIR, default instance/artifacts)."""
+    return app.config.get("ATIS_ARTIFACT_DIR") or os.path.join(app.instance_path, "artifacts")
+
+
+def object_path(app, sha256):
+    """Where the file with this hash lives: objects/ab/cd/<hash>."""
+    return os.path.join(storage_dir(app), "objects", sha256[:2], sha256[2:4], sha256)
+
+
+def thumb_path(app, sha256, size):
+    return os.path.join(storage_dir(app), "thumbs", f"{sha256}-{size}.jpg")
+
+
+def _folder(app, name):
+    path = os.path.join(storage_dir(app), name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_sha256(value):
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+# -------------------------------------------------------------------------
+# STORING
+# -------------------------------------------------------------------------
+
+def sniff_content_type(head, declared):
+    """
+    The type we store: recognised image formats by their first bytes,
+    a declared data type (CSV, JSON...) if it is one we know, else binary.
+    """
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    declared = (declared or "").split(";")[0].strip().lower()
+    return declared if declared in DATA_TYPES else "application/octet-stream"
+
+
+def store_stream(app, stream, declared_type=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Copy a file-like object into the store, hashing it on the way.
+    Returns (sha256, size, content_type). Raises ArtifactTooLarge.
+    """
+    temp_path, sha256, size, content_type = _receive(app, stream, declared_type, max_bytes)
+    _place(app, temp_path, sha256)
+    return sha256, size, content_type
+
+
+def _receive(app, stream, declared_type, max_bytes):
+    """
+    Write the upload to a temporary file, hashing it on the way.
+    Returns (temp_path, sha256, size, content_type); the caller moves the
+    file into place with _place() (or deletes it).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    fd, temp_path = _mkstemp(app)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ArtifactTooLarge(f"File too large (max {max_bytes:,} bytes).")
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if size == 0:
+            raise ArtifactError("The file is empty.")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size, sniff_content_type(head, declared_type)
+
+
+def _place(app, temp_path, sha256):
+    """
+    Move a received file to its place in the store. A file with the same
+    hash already there is simply replaced by the new copy (the content is
+    the same), so afterwards the file exists and is new, even if 'gc' was
+    deleting the old copy at that moment.
+    """
+    final_path = object_path(app, sha256)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path)
+
+
+def _mkstemp(app):
+    return tempfile.mkstemp(dir=_folder(app, "tmp"), suffix=".part")
+
+
+def attach(app, inspection, stream, kind="image", filename=None, declared_type=None,
+           max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Store an uploaded file and link it to an inspection, in one transaction.
+    Uploading the same file to the same inspection again returns the
+    existing link. Returns (link, created).
+
+    The file is moved into the store only after the link is committed: a
+    'gc' running at the same time either sees the new last_used_at and
+    keeps the file, or has already deleted it and the upload puts it back.
+    """
+    if kind not in KINDS:
+        raise ArtifactError(f"kind must be one of: {', '.join(KINDS)}.")
+    filename = os.path.basename(filename or "")[:200] or None
+
+    temp_path, sha256, size, content_type = _receive(app, stream, declared_type, max_bytes)
+    try:
+        link, created = _link(inspection, sha256, size, content_type, kind, filename)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    _place(app, temp_path, sha256)
+    return link, created
+
+
+def _link(inspection, sha256, size, content_type, kind, filename):
+    """The database half of attach(): the artifact row and the link."""
+    now = datetime.utcnow()
+
+    artifact = Artifact.query.filter_by(sha256=sha256).first()
+    if artifact is not None:
+        # Mark it as used. No row updated: 'gc' deleted it since we read it
+        used = Artifact.query.filter_by(id=artifact.id).update({"last_used_at": now}, synchronize_session=False)
+        if not used:
+            db.session.expunge(artifact)
+            artifact = None
+    if artifact is None:
+        artifact = Artifact(sha256=sha256, size=size, content_type=content_type, created_at=now)
+        db.session.add(artifact)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Someone stored the same file at the same moment
+            db.session.rollback()
+            artifact = Artifact.query.filter_by(sha256=sha256).one()
+            artifact.last_used_at = now
+
+    link = InspectionArtifact.query.filter_by(inspection_id=inspection.id, artifact_id=artifact.id).first()
+    created = link is None
+    if created:
+        link = InspectionArtifact(inspection_id=inspection.id, artifact=artifact, kind=kind, filename=filename)
+        db.session.add(link)
+    db.session.commit()
+    return link, created
+
+
+def inspection_artifacts(inspection_id):
+    """The files of one inspection, oldest first (one query)."""
+    return (
+        InspectionArtifact.query
+        .filter(InspectionArtifact.inspection_id == inspection_id)
+        .order_by(InspectionArtifact.created_at, InspectionArtifact.id)
+        .all()
+    )
+
+
+# -------------------------------------------------------------------------
+# SERVING
+# -------------------------------------------------------------------------
+
+def send_artifact(app, artifact, download_name=None):
+    """
+    The file as a response: sendfile, ETag, Range requests and a long
+    browser cache (the content of a hash never changes). Only images are
+    shown inline; anything else is a download, so an uploaded HTML file can
+    never run as a page of this site.
+    """
+    inline = artifact.content_type.startswith("image/")
+    response = send_file(
+        object_path(app, artifact.sha256),
+        mimetype=artifact.content_type,
+        as_attachment=not inline,
+        download_name=download_name or f"{artifact.sha256[:12]}{_extension(artifact.content_type)}",
+        conditional=True,
+        etag=artifact.sha256,
+        max_age=365 * 24 * 3600,
+    )
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Content-Security-Policy"] = "default-src 'none'; sandbox"
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _extension(content_type):
+    return {
+        "image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp",
+        "text/csv": ".csv", "application/json": ".json", "application/x-ndjson": ".jsonl",
+        "text/plain": ".txt",
+    }.get(content_type, ".bin")
+
+
+_thumb_locks = {}
+_thumb_locks_guard = threading.Lock()
+
+
+def thumbnail(app, artifact, size=DEFAULT_THUMB_SIZE):
+    """
+    Path of a JPEG thumbnail (at most size x size), made on the first
+    request and kept on disk. Concurrent first requests make it only once.
+    """
+    if Image is None:
+        raise ThumbnailUnavailable("Thumbnails need Pillow (pip install Pillow).")
+    if not artifact.content_type.startswith("image/"):
+        raise ThumbnailUnavailable("Only images have thumbnails.")
+    if size not in THUMB_SIZES:
+        raise ArtifactError(f"size must be one of: {', '.join(map(str, THUMB_SIZES))}.")
+
+    path = thumb_path(app, artifact.sha256, size)
+    if os.path.exists(path):
+        return path
+
+    with _thumb_locks_guard:
+        lock = _thumb_locks.setdefault(path, threading.Lock())
+    with lock:
+        if not os.path.exists(path):
+            _make_thumbnail(app, object_path(app, artifact.sha256), path, size)
+    with _thumb_locks_guard:
+        _thumb_locks.pop(path, None)
+    return path
+
+
+def _make_thumbnail(app, source, path, size):
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    _folder(app, "thumbs")
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with Image.open(source) as image:
+            image.draft("RGB", (size, size))    # JPEG: decode at a smaller scale, much faster
+            image.thumbnail((size, size))
+            image.convert("RGB").save(temp_path, "JPEG", quality=85, optimize=True)
+        os.replace(temp_path, path)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ThumbnailUnavailable(f"Could not read the image: {e}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# -------------------------------------------------------------------------
+# RETENTION AND COMPACTION
+# -------------------------------------------------------------------------
+
+def _delete_file(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _delete_artifacts(app, artifacts, grace, unlinked=False):
+    """
+    Delete artifact rows (with their links) and their files.
+    Returns (files deleted, bytes freed).
+
+    An upload may be using a file while we delete it (see attach()). So a
+    row is only deleted if it was still not used within 'grace' (and, with
+    'unlinked', still has no links) when the DELETE runs, and a file only
+    if it is older than 'grace': one an upload just put back stays.
+    """
+    used_before = datetime.utcnow() - grace
+    files = freed = 0
+    # Read before the first commit expires them
+    targets = [(artifact.id, artifact.sha256) for artifact in artifacts]
+    for artifact_id, sha256 in targets:
+        if not unlinked:
+            InspectionArtifact.query.filter_by(artifact_id=artifact_id).delete(synchronize_session=False)
+        query = Artifact.query.filter(Artifact.id == artifact_id, Artifact.last_used_at < used_before)
+        if unlinked:
+            query = query.filter(~exists().where(InspectionArtifact.artifact_id == Artifact.id))
+        if not query.delete():
+            db.session.rollback()
+            continue
+        db.session.commit()
+        files += 1
+        freed += _delete_object(app, sha256, grace)
+        for size in THUMB_SIZES:
+            _delete_file(thumb_path(app, sha256, size))
+    return files, freed
+
+
+def _delete_object(app, sha256, grace):
+    """
+    Delete a stored file unless it is younger than 'grace'. It is first
+    renamed away, so an upload putting it back at the same moment (a new
+    file) is either moved back or not touched at all.
+    """
+    path = object_path(app, sha256)
+    doomed = f"{path}.{os.getpid()}.{threading.get_ident()}.gc"
+    try:
+        os.replace(path, doomed)
+    except FileNotFoundError:
+        return 0
+    if os.path.getmtime(doomed) > time.time() - grace.total_seconds():
+        os.replace(doomed, path)
+        return 0
+    return _delete_file(doomed)
+
+
+def collect_garbage(app, retention_days=DEFAULT_RETENTION_DAYS, max_total_bytes=DEFAULT_MAX_TOTAL_BYTES,
+                    grace=GC_GRACE):
+    """
+    Apply the retention rules (see the top of this file).
+    Returns a dict with what was removed.
+    """
+    now = datetime.utcnow()
+    summary = {"links": 0, "files": 0, "bytes": 0, "leftovers": 0}
+
+    # 1. Links past the retention period
+    cutoff = now - timedelta(days=retention_days) if retention_days else None
+    if cutoff:
+        summary["links"] = InspectionArtifact.query.filter(
+            InspectionArtifact.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    # 2. Files nothing links to any more, in the main database or the archive
+    # files (archived links past the retention period do not count)
+    unlinked = ~exists().where(InspectionArtifact.artifact_id == Artifact.id)
+    orphans = Artifact.query.filter(unlinked, Artifact.last_used_at < now - grace).all()
+    if orphans:
+        archived = archive.linked_artifact_ids(app, since=cutoff)
+        orphans = [artifact for artifact in orphans if artifact.id not in archived]
+    files, freed = _delete_artifacts(app, orphans, grace, unlinked=True)
+    summary["files"] += files
+    summary["bytes"] += freed
+
+    # 3. Least recently used files while the store is over its limit
+    if max_total_bytes:
+        total = db.session.query(func.coalesce(func.sum(Artifact.size), 0)).scalar()
+        victims = []
+        query = (
+            Artifact.query
+            .filter(Artifact.last_used_at < now - grace)
+            .order_by(Artifact.last_used_at, Artifact.id)
+        )
+        for artifact in query.yield_per(500):
+            if total <= max_total_bytes:
+                break
+            victims.append(artifact)
+            total -= artifact.size
+        files, freed = _delete_artifacts(app, victims, grace)
+        summary["files"] += files
+        summary["bytes"] += freed
+
+    summary["leftovers"] = compact(app, grace)
+    return summary
+
+
+def compact(app, grace=GC_GRACE):
+    """
+    Remove what no database row points to: stored files without an
+    artifact row (a crashed upload), thumbnails of deleted files, abandoned
+    temporary files and empty folders. Returns the number of files removed.
+    """
+    root = storage_dir(app)
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - grace.total_seconds()
+    known = {sha for (sha,) in db.session.query(Artifact.sha256)}
+    removed = 0
+
+    for folder, _, files in os.walk(root, topdown=False):
+        for name in files:
+            path = os.path.join(folder, name)
+            if os.path.getmtime(path) > cutoff:
+                continue
+            section = os.path.relpath(path, root).split(os.sep)[0]
+            sha256 = name.split("-")[0]
+            if section == "tmp" or (section in ("objects", "thumbs") and sha256 not in known):
+                _delete_file(path)
+                removed += 1
+        if folder != root and not os.listdir(folder) and os.path.relpath(folder, root) not in ("objects", "thumbs", "tmp"):
+            os.rmdir(folder)
+    return removed
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+artifacts_cli = click.Group("artifacts", help="Maintain the image and sensor file store.")
+
+
+@artifacts_cli.command("gc")
+@click.option("--retention-days", type=int, default=None, help="Override ATIS_ARTIFACT_RETENTION_DAYS (0 = keep).")
+@click.option("--max-total-bytes", type=int, default=None, help="Override ATIS_ARTIFACT_MAX_TOTAL_BYTES (0 = no limit).")
+def gc_command(retention_days, max_total_bytes):
+    """Apply retention, delete unused files and compact the store."""
+    from flask import current_app
+    app = current_app._get_current_object()
+    if retention_days is None:
+        retention_days = app.config.get("ATIS_ARTIFACT_RETENTION_DAYS", DEFAULT_RETENTION_DAYS)
+    if max_total_bytes is None:
+        max_total_bytes = app.config.get("ATIS_ARTIFACT_MAX_TOTAL_BYTES", DEFAULT_MAX_TOTAL_BYTES)
+
+    summary = collect_garbage(app, retention_days, max_total_bytes)
+    click.echo(
+        f"Removed {summary['links']:,} expired links and {summary['files']:,} files "
+        f"({summary['bytes'] / 1024 / 1024:,.1f} MiB), and {summary['leftovers']:,} leftover files."
+    )
+
+
+@artifacts_cli.command("stats")
+def stats_command():
+    """Show how many files the store holds and their total size."""
+    count, total = db.session.query(func.count(Artifact.id), func.coalesce(func.sum(Artifact.size), 0)).one()
+    links = db.session.query(func.count(InspectionArtifact.id)).scalar()
+    click.echo(f"{count:,} files, {total / 1024 / 1024:,.1f} MiB, linked {links:,} times.")
+    click.echo(f"Thumbnails: {'enabled' if Image is not None else 'disabled (install Pillow)'}.")
+
+
+def init_app(app):
+    """Register 'flask artifacts'."""
+    app.cli.add_command(artifacts_cli)
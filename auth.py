@@ -0,0 +1,431 @@
+"""
+auth.py - Logins, Password Hashing and Protected Views
+
+Passwords are stored as salted hashes (werkzeug's scrypt by default), never
+as plain text. Old databases had a plaintext 'password' column: migration 8
+hashes those into 'password_hash' and empties the old column, and a user
+that still has a plaintext password (e.g. added by hand) gets a hash the
+first time they log in.
+
+A good password hash is slow on purpose: scrypt takes tens of milliseconds
+and 32 MB of memory per check. At shift change many people log in at once,
+and running every check on its own request thread would let the logins eat
+all the CPU and memory the other pages need. So the checks run on a small
+pool of KDF threads (ATIS_AUTH_KDF_WORKERS). Logins wait for a free thread,
+and once ATIS_AUTH_KDF_QUEUE logins are already waiting, new ones get
+"503 try again" straight away instead of piling up.
+
+Repeated failed logins from one IP address (ATIS_LOGIN_RATE_LIMIT failures
+in ATIS_LOGIN_RATE_WINDOW seconds) get "429 Too Many Requests" until the
+window has passed, without any password check at all.
+
+Protected views use the @login_required decorator. It reads the logged-in
+user again on every request, so a deleted user is logged out on their next
+request and a changed role applies right away. With the shared "sqlite"
+cache backend (cache.py) the user comes from the cache, which is
+invalidated whenever a User row is written, and checking a login costs no
+query. With the default in-process "memory" backend every request runs one
+query on the users table instead, because that cache would not see a User
+changed by another worker or by the CLI.
+
+    flask auth set-password EMAIL    set (or reset) a user's password
+"""
+
+import atexit
+import functools
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import click
+from flask import abort, current_app, g, jsonify, redirect, request, session, url_for
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import cache
+import instrumentation
+import metrics
+from models import db, User
+
+DEFAULT_PASSWORD_METHOD = "scrypt"
+DEFAULT_KDF_WORKERS = 2
+DEFAULT_KDF_QUEUE = 32          # logins allowed to wait for a KDF thread
+DEFAULT_KDF_TIMEOUT = 10        # seconds a login waits for its check
+DEFAULT_LOGIN_RATE_LIMIT = 10   # failed logins per IP address...
+DEFAULT_LOGIN_RATE_WINDOW = 300  # ...in this many seconds
+
+# IP addresses the rate limiter remembers at most (oldest are dropped)
+MAX_TRACKED_CLIENTS = 10000
+
+login_attempts = metrics.registry.add(metrics.Counter(
+    "atis_logins_total", "Login attempts, by outcome (success/failure/throttled/busy).",
+    labels=("outcome",),
+))
+kdf_duration = metrics.registry.add(metrics.Histogram(
+    "atis_password_kdf_seconds", "Time to hash or check one password on the KDF pool.",
+))
+
+
+class LoginBusy(Exception):
+    """Too many logins are being checked at once; try again shortly."""
+
+
+class LoginThrottled(Exception):
+    """This client failed to log in too often; 'retry_after' is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed logins. Try again in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+# -------------------------------------------------------------------------
+# PASSWORD HASHING (on a bounded thread pool)
+# -------------------------------------------------------------------------
+
+class KdfPool:
+    """
+    Runs password hashing and checking on a few worker threads, with a cap on
+    how many requests may wait for them. Threads start on first use, and
+    restart after a fork (e.g. gunicorn --preload), like inference.py.
+    """
+
+    def __init__(self, method=DEFAULT_PASSWORD_METHOD, workers=DEFAULT_KDF_WORKERS,
+                 max_waiting=DEFAULT_KDF_QUEUE, timeout=DEFAULT_KDF_TIMEOUT):
+        self.method = method
+        self.workers = max(1, workers)
+        self.max_waiting = max(0, max_waiting)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._slots = None
+        self._dummy_hash = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="atis-kdf")
+            # One slot per running or waiting check
+            self._slots = threading.BoundedSemaphore(self.workers + self.max_waiting)
+            self._pid = os.getpid()
+
+    def shutdown(self):
+        """Wait for running checks to finish and stop the threads."""
+        if self._pid != os.getpid():
+            return
+        self._pool.shutdown(wait=True)
+        self._pid = None
+
+    def run(self, fn, *args):
+        """Run fn(*args) on the pool and return its result (raises LoginBusy when full)."""
+        self._ensure_started()
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy("Too many people are logging in right now. Try again in a moment.")
+        try:
+            future = self._pool.submit(self._timed, fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the check ends, even if we stopped waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise LoginBusy("Logins are taking too long right now. Try again in a moment.")
+
+    @staticmethod
+    def _timed(fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            kdf_duration.observe(time.perf_counter() - started)
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def dummy_hash(self):
+        """
+        A hash of a random password, made once per process. Checking unknown
+        emails against it costs the same time as a real check, so response
+        times do not tell which emails have an account.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(secrets.token_urlsafe(16))
+        return self._dummy_hash
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with other settings than the current ones."""
+        return password_hash.split("$", 1)[0] != self.dummy_hash().split("$", 1)[0]
+
+
+def get_pool(app=None):
+    """Return the KDF pool created by init_app()."""
+    return (app or current_app).extensions["atis_auth"]["pool"]
+
+
+def hash_password(password):
+    """The hash to store for a new password (runs on the KDF pool)."""
+    return get_pool().hash(password)
+
+
+def hash_plaintext_passwords():
+    """
+    Hash every password still stored as plain text and empty the old
+    column. Used by migration 8. Returns the number of users updated.
+    """
+    pool = get_pool()
+    users = User.query.filter(User.password_hash.is_(None), User.password != "").all()
+    for user in users:
+        user.password_hash = pool.hash(user.password)
+        user.password = ""
+    db.session.commit()
+    return len(users)
+
+
+# -------------------------------------------------------------------------
+# RATE LIMITING
+# -------------------------------------------------------------------------
+
+class LoginLimiter:
+    """
+    Remembers the failed logins of each client IP address in a sliding
+    window (in this process). A successful login clears the client's count.
+    """
+
+    def __init__(self, limit=DEFAULT_LOGIN_RATE_LIMIT, window=DEFAULT_LOGIN_RATE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._failures = {}     # client -> deque of failure times, oldest first
+        self._lock = threading.Lock()
+
+    def _prune(self, client, now):
+        failures = self._failures.get(client)
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if failures is not None and not failures:
+            del self._failures[client]
+
+    def retry_after(self, client):
+        """Seconds until 'client' may try again (0 if it may try now)."""
+        if not self.limit:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            self._prune(client, now)
+            failures = self._failures.get(client)
+            if not failures or len(failures) < self.limit:
+                return 0
+            return max(1, int(failures[0] + self.window - now + 1))
+
+    def failed(self, client):
+        now = time.monotonic()
+        with self._lock:
+            self._failures.setdefault(client, deque()).append(now)
+            if len(self._failures) > MAX_TRACKED_CLIENTS:
+                for stale in list(self._failures)[:len(self._failures) // 10 or 1]:
+                    del self._failures[stale]
+
+    def succeeded(self, client):
+        with self._lock:
+            self._failures.pop(client, None)
+
+
+def get_limiter(app=None):
+    """Return the login rate limiter created by init_app()."""
+    return (app or current_app).extensions["atis_auth"]["limiter"]
+
+
+# -------------------------------------------------------------------------
+# LOGGING IN
+# -------------------------------------------------------------------------
+
+def authenticate(email, password, client=None):
+    """
+    Check an email and password. Returns the User, or None if they do not
+    match. Raises LoginThrottled if 'client' (an IP address) failed too
+    often lately, and LoginBusy if the KDF pool is full.
+    """
+    limiter = get_limiter()
+    wait = limiter.retry_after(client)
+    if wait:
+        login_attempts.inc("throttled")
+        raise LoginThrottled(wait)
+
+    pool = get_pool()
+    user = User.query.filter_by(email=email).first()
+    try:
+        if user is None:
+            pool.check(pool.dummy_hash(), password)
+            ok = False
+        elif user.password_hash:
+            ok = pool.check(user.password_hash, password)
+        else:
+            # Not hashed yet: compare in constant time, then store a hash below
+            ok = bool(user.password) and hmac.compare_digest(user.password.encode(), password.encode())
+    except LoginBusy:
+        login_attempts.inc("busy")
+        raise
+
+    if not ok:
+        limiter.failed(client)
+        login_attempts.inc("failure")
+        return None
+
+    limiter.succeeded(client)
+    login_attempts.inc("success")
+    if not user.password_hash or pool.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = pool.hash(password)
+            user.password = ""
+            db.session.commit()
+        except LoginBusy:
+            # The login itself succeeded; upgrade the hash next time
+            db.session.rollback()
+    return user
+
+
+def log_in(user):
+    """Start a fresh session for 'user' (a new session on every login)."""
+    session.clear()
+    session["user"] = user.email
+    session["role"] = user.role
+
+
+# -------------------------------------------------------------------------
+# PROTECTED VIEWS
+# -------------------------------------------------------------------------
+
+def load_user(email):
+    """
+    The id, email and role of a user as a dict, or None.
+
+    With a cache backend shared by all processes ("sqlite") the answer is
+    cached until a User row is written, so most requests do not query the
+    users table. The in-process "memory" backend does not see writes made by
+    other processes (a role change or deletion in another worker or by the
+    CLI), so with it every request reads the user from the database.
+    """
+    def build():
+        # One query, on top of the view's own budget
+        instrumentation.allow_queries(1)
+        user = User.query.filter_by(email=email).first()
+        return {"id": user.id, "email": user.email, "role": user.role} if user else {}
+
+    if not cache.get_backend().shared:
+        return build() or None
+    return cache.cached_value("auth:user", ("users",), build, params=email) or None
+
+
+def current_user():
+    """
+    The logged-in user (see load_user()), or None. A session whose user no
+    longer exists is ended, and a changed role is copied into the session.
+    """
+    if "atis_user" in g:
+        return g.atis_user
+
+    email = session.get("user")
+    user = load_user(email) if email else None
+    if email and user is None:
+        session.clear()
+    elif user and session.get("role") != user["role"]:
+        session["role"] = user["role"]
+    g.atis_user = user
+    return user
+
+
+def api_key_ok():
+    """True if the request carries the edge boxes' "X-API-Key"."""
+    api_key = current_app.config["ATIS_INGEST_API_KEY"]
+    sent_key = request.headers.get("X-API-Key", "")
+    return bool(api_key) and hmac.compare_digest(sent_key, api_key)
+
+
+def login_required(view=None, *, api=False, api_key=False, roles=None):
+    """
+    Decorator for views that need a logged-in user. Page views send
+    visitors to the login page; with api=True they get a 401 JSON error
+    instead. With api_key=True a valid X-API-Key is accepted too (edge boxes).
+    With roles=("Admin",) other users get a 403 (the API key still counts).
+
+        @app.route("/history")
+        @login_required
+        def history(): ...
+
+        @app.route("/api/ingest", methods=["POST"])
+        @login_required(api=True, api_key=True)
+        def api_ingest(): ...
+
+    Put it right below @app.route, above the other decorators, so nothing
+    else runs for anonymous requests.
+    """
+    if view is None:
+        return functools.partial(login_required, api=api, api_key=api_key, roles=roles)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if api_key and api_key_ok():
+            return view(*args, **kwargs)
+        user = current_user()
+        if user is None:
+            if api:
+                return jsonify({"success": False, "message": "Unauthorized"}), 401
+            return redirect(url_for("login"))
+        if roles and user["role"] not in roles:
+            if api:
+                return jsonify({"success": False, "message": "Forbidden"}), 403
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+auth_cli = click.Group("auth", help="Manage user logins.")
+
+
+@auth_cli.command("set-password")
+@click.argument("email")
+@click.password_option()
+def set_password_command(email, password):
+    """Set a new password for the user with this EMAIL."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    user.password_hash = hash_password(password)
+    user.password = ""
+    db.session.commit()
+    click.echo(f"Password of {email} changed.")
+
+
+def init_app(app):
+    """
+    Create the KDF pool and the login rate limiter, and add 'flask auth'.
+    """
+    config = app.config
+    pool = KdfPool(
+        method=config.get("ATIS_PASSWORD_METHOD", DEFAULT_PASSWORD_METHOD),
+        workers=config.get("ATIS_AUTH_KDF_WORKERS", DEFAULT_KDF_WORKERS),
+        max_waiting=config.get("ATIS_AUTH_KDF_QUEUE", DEFAULT_KDF_QUEUE),
+        timeout=config.get("ATIS_AUTH_KDF_TIMEOUT", DEFAULT_KDF_TIMEOUT),
+    )
+    limiter = LoginLimiter(
+        limit=config.get("ATIS_LOGIN_RATE_LIMIT", DEFAULT_LOGIN_RATE_LIMIT),
+        window=config.get("ATIS_LOGIN_RATE_WINDOW", DEFAULT_LOGIN_RATE_WINDOW),
+    )
+    app.extensions["atis_auth"] = {"pool": pool, "limiter": limiter}
+    atexit.register(pool.shutdown)
+    app.cli.add_command(auth_cli)
+    return pool
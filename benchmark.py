@@ -0,0 +1,296 @@
+"""
+benchmark.py - Route Benchmarks
+
+Drives every page and API route through the Flask test client and reports,
+per route:
+
+- p50 / p95 / p99 latency (milliseconds)
+- SQL queries per request
+- peak Python memory while handling one request (tracemalloc)
+
+Results can be saved as a named baseline and later compared against it,
+so a change that makes a page slower or adds queries is easy to spot:
+
+    flask loadgen --count 1000000           # a realistic amount of data first
+    flask bench --save before
+    ... change some code ...
+    flask bench --compare before            # exit code 1 on a regression
+
+Baselines are JSON files in instance/benchmarks, kept out of git: they
+only mean something on the machine and data they were measured with.
+Run benchmarks on a copy of the database: a few routes are POSTs, but
+none of them write.
+"""
+
+import json
+import math
+import os
+import time
+import tracemalloc
+from datetime import datetime
+
+import click
+from sqlalchemy import func
+
+import jobs
+from instrumentation import count_queries
+from models import db, Inspection, Alert, User
+
+DEFAULT_ITERATIONS = 50
+DEFAULT_WARMUP = 3
+
+# A route is slower than its baseline if p95 grew by more than this share
+# and by more than MIN_SLOWDOWN_MS (sub-millisecond jitter is just noise)
+DEFAULT_TOLERANCE = 0.2
+MIN_SLOWDOWN_MS = 1.0
+
+
+# -------------------------------------------------------------------------
+# ROUTES
+# -------------------------------------------------------------------------
+
+class Scenario:
+    """One benchmarked request. 'make' returns (method, url, json body)."""
+
+    def __init__(self, name, make):
+        self.name = name
+        self.make = make
+
+
+def _get(url):
+    return lambda ctx: ("GET", url.format(**ctx), None)
+
+
+def build_scenarios(ctx):
+    """
+    The requests to benchmark. 'ctx' holds values taken from the database
+    (a real inspection id, a cursor, a recent date...) so the URLs hit data.
+    """
+    return [
+        Scenario("dashboard", _get("/dashboard")),
+        Scenario("alerts", _get("/alerts")),
+        Scenario("history", _get("/history")),
+        Scenario("history: page 2", _get("/history?cursor={cursor}")),
+        Scenario("history: unsafe + defect", _get("/history?status=unsafe&defect={defect}")),
+        Scenario("history: plate search", _get("/history?plate={plate_prefix}")),
+        Scenario("inspection detail", _get("/inspection/{inspection_id}")),
+        Scenario("api: inspections page", _get("/api/inspections?limit=50")),
+        Scenario("api: defect counts", _get("/api/defects")),
+        Scenario("api: defect counts (filtered)", _get("/api/defects?date_from={recent_day}")),
+        Scenario("api: trends (30 days, hourly)", _get("/api/trends")),
+        Scenario("api: trends by location", _get("/api/trends?grain=day&group_by=location")),
+        Scenario("reports page", _get("/reports")),
+        Scenario("reports: export one day", _get("/reports/export?format=csv&date_from={recent_day}")),
+        Scenario("predict", lambda ctx: ("POST", "/predict", {"features": [0.5] * 16})),
+    ]
+
+
+def benchmark_context(client):
+    """Look up the ids and values the scenarios need."""
+    latest = db.session.query(func.max(Inspection.timestamp)).scalar() or datetime.utcnow()
+    inspection_id = (
+        db.session.query(Inspection.id).join(Alert, Alert.inspection_id == Inspection.id).limit(1).scalar()
+        or db.session.query(func.max(Inspection.id)).scalar()
+        or 1
+    )
+    plate = db.session.query(Inspection.plate).filter(Inspection.plate.isnot(None)).limit(1).scalar() or "A"
+    cursor = client.get("/api/inspections?limit=50").get_json().get("next_cursor") or ""
+    return {
+        "inspection_id": inspection_id,
+        "cursor": cursor,
+        "defect": "Bulge",
+        "plate_prefix": plate[:2],
+        "recent_day": latest.strftime("%Y-%m-%d"),
+    }
+
+
+# -------------------------------------------------------------------------
+# MEASURING
+# -------------------------------------------------------------------------
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _request(client, method, url, body):
+    response = client.open(url, method=method, json=body)
+    response.get_data()    # read streamed bodies to the end
+    if response.status_code >= 400:
+        raise click.ClickException(f"{method} {url} returned {response.status_code}")
+    return response
+
+
+def measure(client, scenario, ctx, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP):
+    """Run one scenario and return its statistics."""
+    method, url, body = scenario.make(ctx)
+    for _ in range(warmup):
+        _request(client, method, url, body)
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            _request(client, method, url, body)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+
+    # Memory is measured on a separate request: tracemalloc slows Python down
+    tracemalloc.start()
+    try:
+        _request(client, method, url, body)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "url": url,
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "queries": max(queries),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run(app, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP, only=None):
+    """
+    Benchmark every scenario (or those whose name contains 'only').
+    Returns a results dict, ready to print or save.
+    """
+    client = app.test_client()
+    with app.app_context():
+        user = User.query.order_by(User.id).first()
+        if user is None:
+            raise click.ClickException("No users in the database; run seed.py first.")
+        with client.session_transaction() as sess:
+            sess["user"] = user.email
+            sess["role"] = user.role
+
+        ctx = benchmark_context(client)
+        rows = db.session.query(func.count(Inspection.id)).scalar()
+        scenarios = build_scenarios(ctx)
+        db.session.remove()
+
+    # No background job threads while measuring: they would poll the
+    # database next to the requests being timed
+    runner = jobs.get_runner(app)
+    workers, runner.workers = runner.workers, 0
+    routes = {}
+    try:
+        for scenario in scenarios:
+            if only and only not in scenario.name:
+                continue
+            routes[scenario.name] = measure(client, scenario, ctx, iterations, warmup)
+    finally:
+        runner.workers = workers
+
+    return {
+        "created": datetime.utcnow().isoformat(timespec="seconds"),
+        "inspections": rows,
+        "iterations": iterations,
+        "routes": routes,
+    }
+
+
+# -------------------------------------------------------------------------
+# BASELINES
+# -------------------------------------------------------------------------
+
+def baseline_path(app, name):
+    folder = os.path.join(app.instance_path, "benchmarks")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{name}.json")
+
+
+def save_baseline(app, name, results):
+    with open(baseline_path(app, name), "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_baseline(app, name):
+    path = baseline_path(app, name)
+    if not os.path.exists(path):
+        raise click.ClickException(f"No baseline named '{name}' ({path}).")
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare results with a baseline. Returns a list of
+    (route, field, old, new, is_regression) for every route in both.
+    A regression is p95 latency up by more than 'tolerance' (and more than
+    MIN_SLOWDOWN_MS), or more queries per request.
+    """
+    changes = []
+    for name, new in results["routes"].items():
+        old = baseline["routes"].get(name)
+        if old is None:
+            continue
+        for field in ("p50_ms", "p95_ms", "p99_ms", "queries", "peak_kib"):
+            if field == "p95_ms":
+                slower = new[field] - old[field]
+                regression = new[field] > old[field] * (1 + tolerance) and slower > MIN_SLOWDOWN_MS
+            elif field == "queries":
+                regression = new[field] > old[field]
+            else:
+                regression = False
+            changes.append((name, field, old[field], new[field], regression))
+    return changes
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+def _print_results(results):
+    click.echo(f"{results['inspections']:,} inspections, {results['iterations']} requests per route\n")
+    click.echo(f"{'route':34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>10}")
+    for name, r in results["routes"].items():
+        click.echo(
+            f"{name:34} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+            f"{r['queries']:8d} {r['peak_kib']:10.1f}"
+        )
+
+
+def _print_comparison(changes):
+    click.echo(f"\n{'route':34} {'metric':9} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, field, old, new, regression in changes:
+        change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+        flag = "  REGRESSION" if regression else ""
+        click.echo(f"{name:34} {field:9} {old:10} {new:10} {change:>8}{flag}")
+
+
+@click.command("bench")
+@click.option("--iterations", default=DEFAULT_ITERATIONS, show_default=True, help="Timed requests per route.")
+@click.option("--warmup", default=DEFAULT_WARMUP, show_default=True, help="Untimed requests per route first.")
+@click.option("--only", default=None, help="Only routes whose name contains this text.")
+@click.option("--save", "save_as", default=None, help="Save the results as a named baseline.")
+@click.option("--compare", "compare_to", default=None, help="Compare with a saved baseline.")
+@click.option("--tolerance", default=DEFAULT_TOLERANCE, show_default=True, help="Allowed p95 slowdown (0.2 = 20%).")
+def bench_command(iterations, warmup, only, save_as, compare_to, tolerance):
+    """Benchmark every route: latency percentiles, queries and peak memory."""
+    from flask import current_app
+    app = current_app._get_current_object()
+
+    results = run(app, iterations=iterations, warmup=warmup, only=only)
+    _print_results(results)
+
+    if save_as:
+        save_baseline(app, save_as, results)
+        click.echo(f"\nSaved baseline '{save_as}'.")
+
+    if compare_to:
+        changes = compare(results, load_baseline(app, compare_to), tolerance)
+        _print_comparison(changes)
+        if any(regression for *_, regression in changes):
+            raise SystemExit(1)
+
+
+def init_app(app):
+    """Register 'flask bench'."""
+    app.cli.add_command(bench_command)
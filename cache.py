@@ -0,0 +1,484 @@
+"""
+cache.py - Page and Fragment Cache
+
+Most page views show data that has not changed since the last view: the
+dashboard cards, the recent-inspections table, the notification dropdown
+and the history pages are rebuilt from the database every time, although
+inspections and alerts only change when something is written.
+
+This file keeps rendered pieces of pages ("fragments") and small computed
+values in a cache, and tells browsers when a page has not changed at all.
+
+Generations (how invalidation works):
+- Every kind of data ("inspections", "alerts", "users") has a generation number.
+- A committed write to an Inspection, Alert or User bumps its generation (a
+  session hook does this for ORM writes; bulk writers call mark_changed()).
+- Cache keys contain the generations the fragment depends on, so after a
+  write the next view simply misses and rebuilds. Old entries are never
+  read again and fall out through LRU/TTL eviction.
+
+Generations are microsecond timestamps (always increasing), so the newest
+one is also the page's Last-Modified time. Pages get an ETag built from the
+generations, the URL and the user, and a browser that already has the
+current version receives "304 Not Modified" without any database work.
+
+Backends (ATIS_CACHE_BACKEND):
+- "memory"  in this process only: fast, but every server process has its
+            own copy and its own generations. Writes made by another
+            process (another server worker, a CLI command such as
+            'flask archive run' or loadgen) cannot bump them, so each
+            generation is renewed ATIS_CACHE_TTL seconds after it was set:
+            such writes show up at most that long later
+- "sqlite"  a small SQLite file shared by every process on the machine
+            (ATIS_CACHE_PATH, default instance/atis-cache.db)
+- "none"    nothing is cached; ETags and 304s still work
+
+The default is "memory", which suits a single server process ('flask run',
+or gunicorn with one worker). With several worker processes it is only
+eventually consistent: an alert acknowledged through one worker can still
+show as pending on pages served by the others for up to ATIS_CACHE_TTL
+seconds, and a browser may get a 304 for the stale page in that time. So
+set ATIS_CACHE_BACKEND = "sqlite" whenever you run more than one worker
+process on a machine (or "none" across machines).
+
+'flask cache clear' empties the cache and bumps every generation.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import click
+from flask import make_response, request, session
+from markupsafe import Markup
+from sqlalchemy import event
+
+import metrics
+from models import db, Inspection, Alert, User
+
+DEFAULT_BACKEND = "memory"
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_TTL = 300            # seconds
+
+# The kinds of data a fragment can depend on, and the models behind them
+DOMAINS = ("inspections", "alerts", "users")
+_MODEL_DOMAINS = ((Inspection, "inspections"), (Alert, "alerts"), (User, "users"))
+
+_SESSION_KEY = "atis_cache_changes"
+
+cache_requests = metrics.registry.add(metrics.Counter(
+    "atis_cache_requests_total", "Cache lookups, by fragment and result (hit/miss).",
+    labels=("fragment", "result"),
+))
+
+
+def _now_us():
+    return int(time.time() * 1_000_000)
+
+
+# -------------------------------------------------------------------------
+# BACKENDS
+# -------------------------------------------------------------------------
+
+class MemoryBackend:
+    """
+    An LRU cache in this process: at most 'max_entries' entries, each kept
+    for at most 'ttl' seconds. Values are stored as they are (not copied),
+    so callers must not change a value they got from the cache.
+
+    Generations only see this process's writes, so they are renewed after
+    'ttl' seconds too: entries and ETags built on an old generation are then
+    dropped, and a write from another process is picked up.
+    """
+
+    # Generations are not shared with other processes (see load_user in auth.py)
+    shared = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()    # key -> (expires, value)
+        self._generations = {}           # name -> (renew at, generation)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def generations(self, names):
+        """Current generation of each name (a new one at "now" once 'ttl' has passed)."""
+        now = time.monotonic()
+        with self._lock:
+            current = []
+            for name in names:
+                entry = self._generations.get(name)
+                if entry is None or entry[0] < now:
+                    entry = self._new_generation(name, now)
+                current.append(entry[1])
+            return current
+
+    def bump(self, names):
+        now = time.monotonic()
+        with self._lock:
+            for name in names:
+                self._new_generation(name, now)
+
+    def _new_generation(self, name, now):
+        # Always newer than the last one, even if the clock went back
+        old = self._generations.get(name, (0, 0))[1]
+        entry = (now + self.ttl, max(old + 1, _now_us()))
+        self._generations[name] = entry
+        return entry
+
+    def size(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    The same cache in a SQLite file, shared by all processes on one machine.
+    Each thread uses its own connection. Eviction runs every PRUNE_EVERY
+    writes: expired entries go first, then the least recently used.
+    """
+
+    PRUNE_EVERY = 100
+    shared = True
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires REAL NOT NULL, used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_used ON cache_entries (used)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_generations ("
+                " name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE cache_entries SET used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires, used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the least recently used beyond max_entries."""
+        conn = self._connect()
+        conn.execute("DELETE FROM cache_entries WHERE expires < ?", (time.time(),))
+        extra = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+        if extra > 0:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                "(SELECT key FROM cache_entries ORDER BY used LIMIT ?)",
+                (extra,),
+            )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache_entries")
+
+    def generations(self, names):
+        conn = self._connect()
+        query = f"SELECT name, value FROM cache_generations WHERE name IN ({','.join('?' * len(names))})"
+        current = dict(conn.execute(query, list(names)))
+        missing = [name for name in names if name not in current]
+        if missing:
+            now = _now_us()
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_generations (name, value) VALUES (?, ?)",
+                [(name, now) for name in missing],
+            )
+            current = dict(conn.execute(query, list(names)))
+        return [current[name] for name in names]
+
+    def bump(self, names):
+        # One atomic statement per name, so two processes bumping at once
+        # still both end up with a newer generation than before
+        now = _now_us()
+        self._connect().executemany(
+            "INSERT INTO cache_generations (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value + 1, excluded.value)",
+            [(name, now) for name in names],
+        )
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+
+def create_backend(app):
+    """The backend chosen by ATIS_CACHE_BACKEND."""
+    kind = app.config.get("ATIS_CACHE_BACKEND", DEFAULT_BACKEND)
+    max_entries = app.config.get("ATIS_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+    ttl = app.config.get("ATIS_CACHE_TTL", DEFAULT_TTL)
+
+    if kind == "memory":
+        return MemoryBackend(max_entries, ttl)
+    if kind == "sqlite":
+        path = app.config.get("ATIS_CACHE_PATH") or os.path.join(app.instance_path, "atis-cache.db")
+        return SQLiteBackend(path, max_entries, ttl)
+    if kind == "none":
+        return MemoryBackend(0, ttl)
+    raise ValueError(f"Unknown ATIS_CACHE_BACKEND '{kind}' (use memory, sqlite or none).")
+
+
+# -------------------------------------------------------------------------
+# INVALIDATION
+# -------------------------------------------------------------------------
+
+def mark_changed(session, *domains):
+    """
+    Bump the generations of 'domains' once the session's transaction
+    commits. Bulk writers that skip the ORM (ingest, workflow, loadgen)
+    call this themselves.
+    """
+    session.info.setdefault(_SESSION_KEY, set()).update(domains)
+
+
+def _collect_session_changes(session, flush_context):
+    """Session hook: note which kinds of data this flush wrote."""
+    for objects in (session.new, session.dirty, session.deleted):
+        for obj in objects:
+            for model, domain in _MODEL_DOMAINS:
+                if isinstance(obj, model):
+                    mark_changed(session, domain)
+
+
+def _bump_session_changes(session):
+    """Session hook: the transaction committed, invalidate what it wrote."""
+    changed = session.info.pop(_SESSION_KEY, None)
+    if changed and _backend is not None:
+        _backend.bump(sorted(changed))
+
+
+def _discard_session_changes(session):
+    """Session hook: the transaction rolled back, nothing changed."""
+    session.info.pop(_SESSION_KEY, None)
+
+
+# -------------------------------------------------------------------------
+# FRAGMENTS
+# -------------------------------------------------------------------------
+
+def _key(name, depends, params):
+    generations = get_backend().generations(depends)
+    parts = [_release, name, *map(str, generations)]
+    if params:
+        parts.append(json.dumps(params, sort_keys=True, default=str))
+    return ":".join(parts)
+
+
+def cached_value(name, depends, build, params=None):
+    """
+    Return the cached result of build(), or build and store it.
+    'depends' names the data it is computed from (see DOMAINS); 'params'
+    (anything JSON-encodable) tells apart variants such as page filters.
+    The value must be JSON-encodable (for the shared backend).
+    """
+    backend = get_backend()
+    key = _key(name, depends, params)
+    value = backend.get(key)
+    if value is not None:
+        cache_requests.inc(name, "hit")
+        return value
+
+    cache_requests.inc(name, "miss")
+    value = build()
+    backend.set(key, value)
+    return value
+
+
+def fragment(name, depends, render, params=None):
+    """
+    Like cached_value() for a piece of HTML: render() returns the rendered
+    partial template, and the result can be placed in a page as it is.
+    """
+    return Markup(cached_value(name, depends, lambda: str(render()).strip(), params))
+
+
+# -------------------------------------------------------------------------
+# CONDITIONAL REQUESTS (ETag / Last-Modified)
+# -------------------------------------------------------------------------
+
+def conditional(*depends, vary=None):
+    """
+    Decorator for page views: answer "304 Not Modified" when the browser
+    already has the current version of the page, without running the view.
+
+    The version is made of the generations in 'depends', the URL, the
+    logged-in user and, if given, the string returned by vary() (for
+    anything else the page shows). Pages for anonymous users are left alone.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if "user" not in session:
+                return view(*args, **kwargs)
+
+            generations = get_backend().generations(depends)
+            parts = [_release, request.full_path, session["user"], session.get("role", ""), *map(str, generations)]
+            if vary is not None:
+                parts.append(str(vary()))
+            etag = hashlib.sha1("\0".join(parts).encode()).hexdigest()[:20]
+            last_modified = datetime.fromtimestamp(max(generations) // 1_000_000, timezone.utc)
+
+            if _not_modified(etag, last_modified):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # The browser may keep the page, but must ask us before showing it again
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    # Only for clients without the ETag: Last-Modified has whole seconds
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+_backend = None
+_release = "0"
+
+
+def get_backend():
+    """The cache backend of this process (memory until init_app runs)."""
+    global _backend
+    if _backend is None:
+        _backend = MemoryBackend()
+    return _backend
+
+
+def release_token(app):
+    """
+    A short hash of the templates, so cached HTML and ETags from before a
+    deploy are never reused with new templates. ATIS_CACHE_RELEASE overrides it.
+    """
+    if app.config.get("ATIS_CACHE_RELEASE"):
+        return str(app.config["ATIS_CACHE_RELEASE"])
+    digest = hashlib.sha1()
+    folder = os.path.join(app.root_path, app.template_folder or "templates")
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, folder)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:8]
+
+
+@click.group("cache")
+def cache_cli():
+    """Inspect or clear the page cache."""
+
+
+@cache_cli.command("clear")
+def clear_command():
+    """Drop every cached fragment and bump every generation."""
+    backend = get_backend()
+    backend.clear()
+    backend.bump(DOMAINS)
+    click.echo("Cache cleared.")
+
+
+@cache_cli.command("stats")
+def stats_command():
+    """Show the backend, its size and the current generations."""
+    backend = get_backend()
+    click.echo(f"backend: {type(backend).__name__}, {backend.size()} entries "
+               f"(max {backend.max_entries}, ttl {backend.ttl}s)")
+    for name, value in zip(DOMAINS, backend.generations(DOMAINS)):
+        changed = datetime.fromtimestamp(value / 1_000_000, timezone.utc)
+        click.echo(f"{name}: generation {value} (changed {changed:%Y-%m-%d %H:%M:%S} UTC)")
+
+
+def init_app(app):
+    """Create the backend, register the session hooks and 'flask cache'."""
+    global _backend, _release
+    _backend = create_backend(app)
+    _release = release_token(app)
+    app.extensions["atis_cache"] = _backend
+
+    hooks = (
+        ("after_flush", _collect_session_changes),
+        ("after_commit", _bump_session_changes),
+        ("after_rollback", _discard_session_changes),
+    )
+    for name, hook in hooks:
+        if not event.contains(db.session, name, hook):
+            event.listen(db.session, name, hook)
+
+    app.cli.add_command(cache_cli)
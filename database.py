@@ -0,0 +1,342 @@
+"""
+database.py - Database Settings, Connection Tuning and Query Plan Checks
+
+Which database to use, and how many connections to keep, comes from
+app.config; an environment variable with the same name wins, so each
+deployment can choose without code changes:
+
+- ATIS_DATABASE_URL        the primary database (default: SQLite in the
+                           'instance' folder), e.g.
+                           postgresql+psycopg://atis:secret@db/atis
+                           (install the driver too, e.g. 'pip install psycopg')
+- ATIS_DATABASE_READ_URL   optional read replica: the SELECTs of views marked
+                           with @read_replica (dashboard, history, alerts,
+                           reports) go there, all writes go to the primary
+- ATIS_DB_POOL_SIZE        connections kept open per process
+- ATIS_DB_MAX_OVERFLOW     extra connections allowed at peaks
+- ATIS_DB_POOL_TIMEOUT     seconds to wait for a free connection
+- ATIS_DB_POOL_RECYCLE     seconds before a connection is replaced (servers
+                           close idle connections; set below their timeout)
+- ATIS_DB_POOL_PRE_PING    test each connection before use (survives
+                           database restarts and failovers)
+
+Every server process (e.g. each gunicorn worker) has its own pool, so the
+database must accept workers x (pool size + overflow) connections.
+
+Only SQLite and PostgreSQL are supported (SUPPORTED_DATABASES). A few
+queries are written for each of the two: the hourly counts in
+stats.count_rows(), the upserts in stats.py and analytics.py, and the NOCASE
+plate index in migration 3. configure() refuses any other database URL
+instead of failing later in one of those queries.
+
+A replica is usually a little behind the primary. A page read from it right
+after a write may miss that write, and can then stay in the page cache
+(cache.py) until the next write or ATIS_CACHE_TTL.
+
+SQLite's defaults are tuned for safety on old hardware, not for a web app
+with many readers and a steady stream of writes. Every new SQLite connection
+gets these settings (override with app.config["ATIS_SQLITE_PRAGMAS"]):
+
+- journal_mode=WAL    readers no longer block the writer (and vice versa)
+- synchronous=NORMAL  safe with WAL, and much faster than FULL
+- cache_size          page cache per connection (negative = KiB)
+- mmap_size           read the file through memory mapping
+- busy_timeout        wait for a lock instead of failing at once
+
+'flask check-query-plans' runs EXPLAIN QUERY PLAN on every query the views
+use and fails if any of them may scan a whole table or index (a walk along
+an index is only accepted when the query's LIMIT ends it, or when it is
+listed in ALLOWED_INDEX_WALKS with the reason). tests/test_query_plans.py
+runs the same check.
+"""
+
+import functools
+import os
+
+import click
+from flask import g
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+from models import db, READER_BIND
+
+DEFAULT_DATABASE_URL = "sqlite:///atis.db"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30       # seconds
+DEFAULT_POOL_RECYCLE = 1800     # seconds
+DEFAULT_POOL_PRE_PING = True
+
+# Databases whose SQL the app knows (see the module docstring)
+SUPPORTED_DATABASES = ("sqlite", "postgresql")
+
+# Settings that environment variables may override, with their types
+ENV_SETTINGS = {
+    "ATIS_DATABASE_URL": str,
+    "ATIS_DATABASE_READ_URL": str,
+    "ATIS_DB_POOL_SIZE": int,
+    "ATIS_DB_MAX_OVERFLOW": int,
+    "ATIS_DB_POOL_TIMEOUT": int,
+    "ATIS_DB_POOL_RECYCLE": int,
+    "ATIS_DB_POOL_PRE_PING": lambda value: value.strip().lower() in ("1", "true", "yes", "on"),
+    # Background job workers (see jobs.py), e.g. ATIS_JOB_WORKERS=0 for web
+    # processes when 'flask jobs work' runs separately
+    "ATIS_JOB_WORKERS": int,
+    "ATIS_JOB_POLL_INTERVAL": float,
+    "ATIS_JOB_LEASE": int,
+}
+
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,       # 64 MB
+    "mmap_size": 268435456,     # 256 MB
+    "busy_timeout": 5000,       # milliseconds
+    "temp_store": "MEMORY",
+}
+
+
+# -------------------------------------------------------------------------
+# DATABASE SETTINGS
+# -------------------------------------------------------------------------
+
+def load_settings(app):
+    """Copy the ENV_SETTINGS found in the environment into app.config."""
+    for name, convert in ENV_SETTINGS.items():
+        value = os.environ.get(name)
+        if value is not None:
+            try:
+                app.config[name] = convert(value)
+            except ValueError:
+                raise ValueError(f"Environment variable {name} has an invalid value: {value!r}")
+
+
+def check_supported(url):
+    """Raise ValueError unless the URL points to a supported database."""
+    backend = make_url(url).get_backend_name()
+    if backend not in SUPPORTED_DATABASES:
+        raise ValueError(
+            f"Unsupported database {backend!r}: use one of {', '.join(SUPPORTED_DATABASES)}."
+        )
+
+
+def engine_options(app, url):
+    """Pool settings for one engine (none for an in-memory SQLite database)."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": app.config.get("ATIS_DB_POOL_SIZE", DEFAULT_POOL_SIZE),
+        "max_overflow": app.config.get("ATIS_DB_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW),
+        "pool_timeout": app.config.get("ATIS_DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT),
+        "pool_recycle": app.config.get("ATIS_DB_POOL_RECYCLE", DEFAULT_POOL_RECYCLE),
+        "pool_pre_ping": app.config.get("ATIS_DB_POOL_PRE_PING", DEFAULT_POOL_PRE_PING),
+    }
+
+
+def configure(app):
+    """
+    Turn the ATIS_DATABASE_* / ATIS_DB_* settings (and environment variables)
+    into Flask-SQLAlchemy's config. Call this before db.init_app(app).
+    """
+    load_settings(app)
+    url = app.config.get("ATIS_DATABASE_URL") or DEFAULT_DATABASE_URL
+    check_supported(url)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(app, url),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    }
+
+    read_url = app.config.get("ATIS_DATABASE_READ_URL")
+    if read_url:
+        check_supported(read_url)
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds[READER_BIND] = {"url": read_url, **engine_options(app, read_url)}
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+
+def read_replica(view):
+    """
+    Decorator for views that only read: their SELECTs may go to the read
+    replica (ATIS_DATABASE_READ_URL). Without a replica it changes nothing.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.atis_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def pool_checked_out():
+    """Connections currently in use, over every engine of this process."""
+    return sum(
+        engine.pool.checkedout()
+        for engine in db.engines.values()
+        if hasattr(engine.pool, "checkedout")
+    )
+
+
+# -------------------------------------------------------------------------
+# CONNECTION TUNING
+# -------------------------------------------------------------------------
+
+def _pragma_listener(pragmas):
+    """Build a 'connect' hook that applies the pragmas to each new connection."""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """
+    Apply the SQLite pragmas to every engine of the app and register
+    'flask check-query-plans'. Call this before anything opens a connection.
+    """
+    pragmas = {**DEFAULT_SQLITE_PRAGMAS, **app.config.get("ATIS_SQLITE_PRAGMAS", {})}
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _pragma_listener(pragmas))
+    app.cli.add_command(check_query_plans_command)
+
+
+# -------------------------------------------------------------------------
+# QUERY PLAN CHECKS
+# -------------------------------------------------------------------------
+
+def route_queries():
+    """
+    The queries run by the views, as (label, SQLAlchemy query) pairs.
+    Each history filter is checked on its own and with a cursor.
+    """
+    from datetime import datetime
+
+    from queries import (
+        alerts_query, build_page_query, encode_cursor,
+        inspection_alerts_query, recent_inspections_query,
+    )
+
+    cursor = encode_cursor(datetime(2026, 1, 1), 1000)
+    history_filters = {
+        "none": {},
+        "plate": {"plate": "AB"},
+        "status": {"status": "unsafe"},
+        "location": {"location": "Highway 101 - Toll Plaza"},
+        "camera": {"camera": "CAM-004"},
+        "defect": {"defect": "Bulge"},
+        "dates": {"date_from": datetime(2026, 1, 1), "date_to": datetime(2026, 1, 31)},
+    }
+
+    checks = [
+        ("dashboard: recent inspections", recent_inspections_query()),
+        ("dashboard: recent alerts", alerts_query().limit(5)),
+        ("alerts: alert list", alerts_query()),
+        ("inspection: related alerts", inspection_alerts_query(1)),
+    ]
+    for name, filters in history_filters.items():
+        checks.append((f"history: filter={name}", build_page_query(filters)))
+        checks.append((f"history: filter={name} + cursor", build_page_query(filters, cursor=cursor)))
+
+    import analytics
+    trend = analytics.parse_trend_params({"date_from": "2026-01-01", "date_to": "2026-01-31"})
+    checks.append(("trends: overall", analytics.rollup_query(trend)))
+    checks.append(("trends: by location", analytics.rollup_query(trend, "location")))
+
+    import plates
+    checks.append(("plate search: trigrams", plates.candidate_query(plates.normalize("HST-1181"))))
+    checks.append(("plate search: short prefix", plates.candidate_query(plates.normalize("HS"))))
+    return checks
+
+
+def explain(query):
+    """Return the EXPLAIN QUERY PLAN lines for a query (SQLite only)."""
+    statement = query.statement.compile(
+        dialect=db.session.get_bind().dialect,
+        compile_kwargs={"literal_binds": True},
+    )
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {statement}"))
+    return [row[-1] for row in rows]
+
+
+# View queries that walk a whole index on purpose, with the reason. Every
+# other SCAN must be bounded (see plan_problems()).
+ALLOWED_INDEX_WALKS = {
+    "alerts: alert list": "the Alerts page lists every alert; resolved ones leave with the archive",
+    "history: filter=defect": "walks the timestamp index newest first until a page of matches is "
+                              "found; a rare defect can read far back (the + cursor variant too)",
+}
+
+
+def full_scans(plan):
+    """
+    The plan lines that read a whole table without an index,
+    e.g. "SCAN inspections" (but not "SCAN inspections USING INDEX ...").
+    """
+    return [line for line in plan if line.startswith("SCAN ") and " USING " not in line]
+
+
+def plan_problems(query, plan):
+    """
+    The plan lines that may read a whole table or index:
+    - a SCAN without an index
+    - a SCAN along an index, unless the query has a LIMIT, no WHERE clause
+      and the index gives the ORDER BY: then SQLite stops after LIMIT rows.
+      With a WHERE clause the walk goes on until LIMIT rows match, which
+      can be the whole index.
+    SEARCH lines (an index range or lookup) are fine.
+    """
+    statement = query.statement
+    bounded = (
+        statement._limit_clause is not None
+        and statement.whereclause is None
+        and not any("TEMP B-TREE FOR ORDER BY" in line for line in plan)
+    )
+    return [
+        line for line in plan
+        if line.startswith("SCAN ") and (" USING " not in line or not bounded)
+    ]
+
+
+def check_query_plans():
+    """
+    Explain every view query. Returns a list of (label, plan, problems);
+    the index walks in ALLOWED_INDEX_WALKS are not counted as problems.
+    """
+    results = []
+    for label, query in route_queries():
+        plan = explain(query)
+        problems = plan_problems(query, plan)
+        if label in ALLOWED_INDEX_WALKS:
+            problems = full_scans(plan)
+        results.append((label, plan, problems))
+    return results
+
+
+@click.command("check-query-plans")
+@click.option("--verbose", is_flag=True, help="Print every plan, not just failures.")
+def check_query_plans_command(verbose):
+    """Fail (exit code 1) if any view query may scan a whole table or index."""
+    if db.session.get_bind().dialect.name != "sqlite":
+        raise click.ClickException("EXPLAIN QUERY PLAN checks only run on SQLite.")
+
+    failed = 0
+    for label, plan, problems in check_query_plans():
+        if problems or verbose:
+            status = "FULL SCAN" if problems else "ok"
+            click.echo(f"[{status}] {label}")
+            for line in plan:
+                click.echo(f"    {line}")
+        failed += bool(problems)
+    for label, reason in ALLOWED_INDEX_WALKS.items():
+        click.echo(f"[allowed index walk] {label}: {reason}")
+
+    if failed:
+        click.echo(f"{failed} queries may scan a whole table or index.")
+        raise SystemExit(1)
+    click.echo("All other view queries search an index or stop after their LIMIT.")
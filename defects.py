@@ -0,0 +1,272 @@
+"""
+defects.py - Normalized Defect Storage
+
+Inspection.defects is a comma-separated string ("Tread Wear,Bulge"), which is
+easy to display but impossible to index. This file keeps a normalized copy:
+
+- defect_types        one row per defect name
+- inspection_defects  one row per (inspection, defect), with an index on
+                      (defect_type_id, inspection_id)
+
+so questions like "all inspections with a Bulge at Checkpoint B" or
+"how many Punctures this week" use indexes instead of string matching.
+
+The string column is still what the app writes. A session hook copies every
+ORM change into the link table, and bulk writers (ingest.py) call
+write_links() themselves. Existing rows are backfilled by migration 4.
+"""
+
+import threading
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, inspect as sa_inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, DefectType, Inspection, inspection_defects, split_defects
+
+# Rows handled per statement when deleting links or backfilling
+CHUNK_SIZE = 500
+
+# Defect name -> id, per database. Names are interned once per process, so
+# writing links normally needs no lookup at all.
+_id_cache = {}
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    """Forget the cached defect type IDs (e.g. after the table was rebuilt)."""
+    with _cache_lock:
+        _id_cache.clear()
+
+
+def unique_names(raw):
+    """The defect names of a defects string, without duplicates, in order."""
+    return list(dict.fromkeys(split_defects(raw)))
+
+
+# -------------------------------------------------------------------------
+# WRITING
+# -------------------------------------------------------------------------
+
+def resolve_defect_ids(connection, names):
+    """
+    Return {name: defect_type_id}, creating any defect types that do not
+    exist yet. Runs on the caller's connection (inside its transaction).
+    """
+    table = DefectType.__table__
+    with _cache_lock:
+        cache = _id_cache.setdefault(str(connection.engine.url), {})
+        known = {n: cache[n] for n in names if n in cache}
+
+    missing = [n for n in set(names) if n not in known]
+    if not missing:
+        return known
+
+    found = dict(connection.execute(select(table.c.name, table.c.id).where(table.c.name.in_(missing))).all())
+    with _cache_lock:
+        # Only names that already existed are cached: a name we insert below
+        # could still be rolled back with the caller's transaction.
+        cache.update(found)
+    known.update(found)
+
+    new = [n for n in missing if n not in found]
+    if new:
+        dialect = connection.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+            stmt = insert_fn(table).on_conflict_do_nothing(index_elements=[table.c.name])
+        else:
+            stmt = insert(table)
+        connection.execute(stmt, [{"name": n} for n in new])
+        known.update(connection.execute(select(table.c.name, table.c.id).where(table.c.name.in_(new))).all())
+
+    return known
+
+
+def delete_links(connection, inspection_ids):
+    """Remove the defect links of these inspections."""
+    inspection_ids = list(inspection_ids)
+    for start in range(0, len(inspection_ids), CHUNK_SIZE):
+        chunk = inspection_ids[start:start + CHUNK_SIZE]
+        connection.execute(delete(inspection_defects).where(inspection_defects.c.inspection_id.in_(chunk)))
+
+
+def write_links(connection, defects_by_inspection, replace=False):
+    """
+    Store the defects of several inspections in one INSERT.
+    'defects_by_inspection' maps inspection_id -> defects string.
+    With replace=True the old links of those inspections are removed first.
+    """
+    if replace:
+        delete_links(connection, defects_by_inspection.keys())
+
+    names_by_inspection = {
+        inspection_id: unique_names(raw)
+        for inspection_id, raw in defects_by_inspection.items()
+    }
+    all_names = {n for names in names_by_inspection.values() for n in names}
+    if not all_names:
+        return
+
+    ids = resolve_defect_ids(connection, all_names)
+    rows = [
+        {"inspection_id": inspection_id, "defect_type_id": ids[name], "position": position}
+        for inspection_id, names in names_by_inspection.items()
+        for position, name in enumerate(names)
+    ]
+    connection.execute(insert(inspection_defects), rows)
+
+
+def _sync_session_links(session, flush_context):
+    """
+    Session hook: after each flush, copy new or changed 'defects' strings
+    into the link table and drop the links of deleted inspections.
+    """
+    added = {}
+    replaced = {}
+    removed = []
+
+    for obj in session.new:
+        if isinstance(obj, Inspection) and obj.defects:
+            added[obj.id] = obj.defects
+
+    for obj in session.dirty:
+        if isinstance(obj, Inspection) and sa_inspect(obj).attrs.defects.history.has_changes():
+            replaced[obj.id] = obj.defects
+
+    for obj in session.deleted:
+        if isinstance(obj, Inspection):
+            removed.append(obj.id)
+
+    if not (added or replaced or removed):
+        return
+
+    connection = session.connection()
+    if removed:
+        delete_links(connection, removed)
+    if added:
+        write_links(connection, added)
+    if replaced:
+        write_links(connection, replaced, replace=True)
+
+
+# -------------------------------------------------------------------------
+# BACKFILL
+# -------------------------------------------------------------------------
+
+def backfill():
+    """
+    Rebuild the link table from the defects strings, in id order and in
+    chunks, so memory use does not grow with the table.
+    Returns the number of inspections processed.
+    """
+    connection = db.session.connection()
+    connection.execute(delete(inspection_defects))
+    clear_cache()
+
+    processed = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(Inspection.id, Inspection.defects)
+            .where(Inspection.id > last_id, Inspection.defects.isnot(None))
+            .order_by(Inspection.id)
+            .limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        write_links(connection, {row.id: row.defects for row in rows})
+        processed += len(rows)
+        last_id = rows[-1].id
+
+    db.session.commit()
+    return processed
+
+
+# -------------------------------------------------------------------------
+# QUERIES
+# -------------------------------------------------------------------------
+
+def has_defect(name):
+    """
+    SQL condition: the inspection has a defect with this name.
+    Use with query.filter(has_defect("Bulge")).
+
+    The subquery uses its own aliases and only correlates to inspections, so
+    it also works in queries that already join the link or defect type table.
+    """
+    link = inspection_defects.alias("has_defect_link")
+    defect_type = DefectType.__table__.alias("has_defect_type")
+    type_id = select(defect_type.c.id).where(defect_type.c.name == name).scalar_subquery()
+    return (
+        select(link.c.inspection_id)
+        .where(
+            link.c.inspection_id == Inspection.id,
+            link.c.defect_type_id == type_id,
+        )
+        .correlate(Inspection)
+        .exists()
+    )
+
+
+def defect_type_names():
+    """All known defect names, alphabetically (for filter dropdowns)."""
+    return [name for (name,) in db.session.query(DefectType.name).order_by(DefectType.name)]
+
+
+def defect_count_query(session, filters):
+    """
+    Inspections per defect name matching 'filters', counted from the link
+    table joined to inspections, in one database (main or archive).
+    """
+    from queries import apply_inspection_filters
+
+    count = func.count(inspection_defects.c.inspection_id)
+    query = (
+        session.query(DefectType.name, count)
+        .join(inspection_defects, inspection_defects.c.defect_type_id == DefectType.id)
+    )
+    query = query.join(Inspection, Inspection.id == inspection_defects.c.inspection_id)
+    query = apply_inspection_filters(query, filters)
+    return query.group_by(DefectType.name)
+
+
+def defect_counts(filters=None):
+    """
+    Count inspections per defect type, most common first.
+    Optional 'filters' are the same as for the History page (queries.py).
+    Returns a list of {"name", "count"} dicts.
+
+    Without filters the answer comes straight from the dashboard counters
+    (which include archived inspections); with filters we count the link
+    table of the main database and of the archived months in the date range.
+    """
+    if not filters:
+        import stats
+        counts = stats.read_counters("inspection_defect")["inspection_defect"]
+        ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [{"name": name, "count": value} for name, value in ranked if value]
+
+    import archive
+    from sqlalchemy.orm import Session
+
+    app = current_app._get_current_object()
+    totals = Counter(dict(defect_count_query(db.session, filters).all()))
+    for month in archive.months_for(filters):
+        with Session(archive.month_engine(app, month.month)) as archive_session:
+            totals.update(dict(defect_count_query(archive_session, filters).all()))
+
+    ranked = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))
+    return [{"name": name, "count": value} for name, value in ranked if value]
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+def init_app(app):
+    """Register the session hook that keeps the link table in sync."""
+    if not event.contains(db.session, "after_flush", _sync_session_links):
+        event.listen(db.session, "after_flush", _sync_session_links)
@@ -0,0 +1,261 @@
+"""
+events.py - Live Updates with Server-Sent Events
+
+The dashboard used to refresh by reloading the whole page, which re-runs
+every dashboard query for every screen. Instead, browsers now keep one
+connection open to /api/events and the server pushes small messages when
+something happens:
+
+- inspection.created   a new inspection was stored
+- alert.created        a new alert was raised
+- alert.updated        an alert changed status
+
+How it works:
+1. Code that writes inspections/alerts queues events on the session (a
+   session hook does this for ORM writes; bulk writers call queue_event()).
+2. When the transaction COMMITS, the queued events go to the broker
+   (rolled-back work is never announced).
+3. The broker numbers each event, keeps the last few hundred in memory and
+   copies it to the queue of every connected browser.
+
+Every event has an ID. A browser that reconnects sends the last ID it saw
+(the "Last-Event-ID" header) and receives everything it missed. If that is
+too old (or from before a server restart) it gets a "reset" event and
+reloads the page.
+
+The broker lives in this process, so with several server processes each one
+only announces its own writes. Streams need a threaded (or async) server,
+since every open stream holds one worker.
+"""
+
+import itertools
+import json
+import os
+import queue
+import threading
+from collections import deque
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, Inspection, Alert
+
+# Events kept in memory for reconnecting clients
+DEFAULT_BUFFER_SIZE = 500
+
+# Events waiting per client before we give up on it (it will reconnect)
+CLIENT_QUEUE_SIZE = 200
+
+# Seconds between keep-alive comments on an idle stream
+DEFAULT_KEEPALIVE = 15
+
+# Milliseconds a browser waits before reconnecting
+RETRY_MS = 3000
+
+_SESSION_KEY = "atis_pending_events"
+
+
+# -------------------------------------------------------------------------
+# BROKER
+# -------------------------------------------------------------------------
+
+class Subscriber:
+    """One connected browser: a bounded queue of events to send."""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = False
+
+
+class EventBroker:
+    """
+    In-process publisher. Numbers events, keeps a replay buffer and fans
+    every event out to all subscribers.
+
+    Event IDs look like "<run>-<number>"; 'run' changes when the process
+    restarts, so a client can tell that its last ID is from an old run.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.run = f"{os.getpid():x}{id(self) & 0xffff:x}"
+        self._counter = itertools.count(1)
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last = 0
+
+    def last_event_id(self):
+        """ID of the newest event (what a freshly rendered page has seen)."""
+        return f"{self.run}-{self._last}"
+
+    def publish(self, event_type, data):
+        """Number an event, remember it and send it to every subscriber."""
+        with self._lock:
+            number = next(self._counter)
+            self._last = number
+            item = (number, event_type, data)
+            self._buffer.append(item)
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.queue.put_nowait(item)
+                except queue.Full:
+                    # Too slow: disconnect it; it will reconnect and replay
+                    subscriber.dropped = True
+                    self._subscribers.discard(subscriber)
+        return number
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a new client. Returns (subscriber, backlog) where backlog is
+        the list of events it missed since 'last_event_id', or None when
+        they cannot be replayed (the client must reload).
+        """
+        subscriber = Subscriber()
+        with self._lock:
+            backlog = self._replay(last_event_id)
+            self._subscribers.add(subscriber)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _replay(self, last_event_id):
+        """Events after 'last_event_id' (call with the lock held)."""
+        if not last_event_id:
+            return []
+        run, _, number = last_event_id.rpartition("-")
+        if run != self.run or not number.isdigit():
+            return None
+        number = int(number)
+        if number >= self._last:
+            return []
+        oldest = self._buffer[0][0] if self._buffer else self._last + 1
+        if number < oldest - 1:
+            return None
+        return [item for item in self._buffer if item[0] > number]
+
+
+# -------------------------------------------------------------------------
+# QUEUEING EVENTS ON A TRANSACTION
+# -------------------------------------------------------------------------
+
+def queue_event(session, event_type, data):
+    """
+    Announce an event once the session's transaction commits.
+    Bulk writers that skip the ORM (e.g. ingest.py) call this themselves.
+    """
+    session.info.setdefault(_SESSION_KEY, []).append((event_type, data))
+
+
+def _alert_data(alert):
+    data = alert.to_dict()
+    inspection = alert.__dict__.get("inspection")    # only if already loaded
+    if inspection is not None:
+        data["plate"] = inspection.plate
+        data["location"] = inspection.location
+    return data
+
+
+def _collect_session_events(session, flush_context):
+    """Session hook: queue events for new inspections/alerts and alert status changes."""
+    for obj in session.new:
+        if isinstance(obj, Inspection):
+            queue_event(session, "inspection.created", obj.to_dict())
+        elif isinstance(obj, Alert):
+            queue_event(session, "alert.created", _alert_data(obj))
+
+    for obj in session.dirty:
+        if isinstance(obj, Alert):
+            history = sa_inspect(obj).attrs.status.history
+            if history.deleted:
+                data = _alert_data(obj)
+                data["previous_status"] = history.deleted[0]
+                queue_event(session, "alert.updated", data)
+
+
+def _publish_session_events(session):
+    """Session hook: the transaction committed, publish its events."""
+    pending = session.info.pop(_SESSION_KEY, None)
+    if pending:
+        broker = get_broker()
+        for event_type, data in pending:
+            broker.publish(event_type, data)
+
+
+def _discard_session_events(session):
+    """Session hook: the transaction rolled back, forget its events."""
+    session.info.pop(_SESSION_KEY, None)
+
+
+# -------------------------------------------------------------------------
+# STREAMING
+# -------------------------------------------------------------------------
+
+def format_event(number, event_type, data, run):
+    """One event in the text/event-stream wire format."""
+    return f"id: {run}-{number}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(broker, last_event_id=None, keepalive=DEFAULT_KEEPALIVE):
+    """
+    Generator for one client: the missed events first, then live events as
+    they arrive, with a keep-alive comment whenever the stream is idle.
+    Uses no database connection at all.
+    """
+    subscriber, backlog = broker.subscribe(last_event_id)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if backlog is None:
+            yield f"id: {broker.last_event_id()}\nevent: reset\ndata: {{}}\n\n"
+        else:
+            for item in backlog:
+                yield format_event(*item, broker.run)
+
+        while not subscriber.dropped:
+            try:
+                item = subscriber.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(*item, broker.run)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+_broker = None
+
+
+def get_broker():
+    """The process-wide broker (created on first use)."""
+    global _broker
+    if _broker is None:
+        _broker = EventBroker()
+    return _broker
+
+
+def init_app(app):
+    """
+    Create the broker and register the session hooks that queue and
+    publish events.
+    """
+    global _broker
+    if _broker is None:
+        _broker = EventBroker(app.config.get("ATIS_EVENT_BUFFER", DEFAULT_BUFFER_SIZE))
+    app.extensions["atis_events"] = _broker
+
+    hooks = (
+        ("after_flush", _collect_session_events),
+        ("after_commit", _publish_session_events),
+        ("after_rollback", _discard_session_events),
+    )
+    for name, hook in hooks:
+        if not event.contains(db.session, name, hook):
+            event.listen(db.session, name, hook)
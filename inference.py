@@ -0,0 +1,308 @@
+"""
+inference.py - Batched Model Inference
+
+This file runs the ML model behind the /predict endpoint. It has three parts:
+
+1. Model registry - models are registered by name and loaded ONCE per process
+   (at app startup), not once per request.
+2. Micro-batching queue - concurrent requests are collected into one batch,
+   up to ATIS_INFERENCE_MAX_BATCH items or ATIS_INFERENCE_MAX_WAIT_MS
+   milliseconds, whichever comes first.
+3. Worker pool - a small pool of threads runs the batched forward pass.
+   NumPy releases the GIL during the heavy maths, so threads work well here.
+
+A model is any object with a 'version' string and a
+'predict_batch(features_list)' method that returns one result dict per input.
+DummyTireModel is a small NumPy reference model used until the real ML
+pipeline is connected (and in tests).
+"""
+
+import atexit
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+
+# Defaults for the app config
+DEFAULT_MODEL = "dummy"
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 10.0
+
+# Longest feature vector we accept per request
+MAX_FEATURES = 4096
+
+# Most inputs one request may send to predict_many()
+MAX_INPUTS = 256
+
+
+class InferenceError(Exception):
+    """The engine could not produce a prediction (bad input, timeout, model error)."""
+
+
+# -------------------------------------------------------------------------
+# REFERENCE MODEL
+# -------------------------------------------------------------------------
+
+class DummyTireModel:
+    """
+    Reference model for development and tests.
+
+    Input: a list of tread-wear readings between 0 (new) and 1 (worn out),
+    e.g. from the depth sensor. The whole batch is processed as one NumPy
+    array, the same way a real model would run one forward pass per batch.
+    """
+
+    version = "dummy-1.0"
+
+    # Wear above this level is unsafe
+    threshold = 0.7
+
+    def predict_batch(self, features_list):
+        # Pad every input to the same length so the batch is one 2-D array
+        width = max(len(f) for f in features_list)
+        batch = np.full((len(features_list), width), np.nan)
+        for row, features in enumerate(features_list):
+            batch[row, :len(features)] = features
+
+        worst = np.nanmax(batch, axis=1)
+        mean = np.nanmean(batch, axis=1)
+        unsafe = worst > self.threshold
+
+        # Confidence grows with the distance from the decision threshold
+        distance = np.abs(worst - self.threshold) / max(self.threshold, 1 - self.threshold)
+        confidence = np.clip(50 + distance * 50, 0, 100).round().astype(int)
+
+        results = []
+        for i in range(len(features_list)):
+            defects = []
+            if mean[i] > 0.6:
+                defects.append("Tread Wear")
+            if worst[i] > 0.9:
+                defects.append("Sidewall Damage")
+            results.append({
+                "status": "unsafe" if unsafe[i] else "safe",
+                "confidence": int(confidence[i]),
+                "defects": defects,
+            })
+        return results
+
+
+# -------------------------------------------------------------------------
+# MODEL REGISTRY
+# -------------------------------------------------------------------------
+
+class ModelRegistry:
+    """
+    Keeps the known model factories and the models already loaded.
+    Each model is created only once per process, even if several threads
+    ask for it at the same time.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Register a function that creates the model called 'name'."""
+        self._factories[name] = factory
+
+    def load(self, name):
+        """Return the model called 'name', creating it on first use."""
+        with self._lock:
+            if name not in self._loaded:
+                if name not in self._factories:
+                    raise InferenceError(f"Unknown model '{name}'.")
+                self._loaded[name] = self._factories[name]()
+            return self._loaded[name]
+
+
+registry = ModelRegistry()
+registry.register("dummy", DummyTireModel)
+
+
+# -------------------------------------------------------------------------
+# MICRO-BATCHING ENGINE
+# -------------------------------------------------------------------------
+
+class _Request:
+    """One queued prediction request."""
+
+    def __init__(self, features):
+        self.features = features
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class InferenceEngine:
+    """
+    Collects concurrent prediction requests into batches and runs them on a
+    worker pool.
+
+    A single collector thread takes the first waiting request, then keeps
+    taking more until the batch is full or max_wait has passed, and hands the
+    batch to a worker. Threads start on first use, and restart after a fork
+    (e.g. gunicorn --preload), since threads do not survive fork().
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, workers=DEFAULT_WORKERS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = max(1, workers)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._collector = None
+        self._stopping = False
+
+    # ----- lifecycle -----
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._stopping = False
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="atis-inference")
+            self._collector = threading.Thread(target=self._collect, name="atis-batcher", daemon=True)
+            self._collector.start()
+            self._pid = os.getpid()
+
+    def shutdown(self):
+        """Stop the collector thread and wait for running batches to finish."""
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._queue.put(None)
+        # Let the collector dispatch its last batch before closing the pool
+        self._collector.join()
+        self._pool.shutdown(wait=True)
+        self._pid = None
+
+    # ----- batching -----
+
+    def _collect(self):
+        """Collector loop: build batches from the queue and dispatch them."""
+        while True:
+            first = self._queue.get()
+            if first is None or self._stopping:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._stopping = True
+                    break
+                batch.append(item)
+            self._pool.submit(self._run_batch, batch)
+            if self._stopping:
+                return
+
+    def _run_batch(self, batch):
+        """Worker: run one forward pass for the whole batch."""
+        try:
+            outputs = self.model.predict_batch([r.features for r in batch])
+        except Exception as e:
+            for r in batch:
+                r.future.set_exception(InferenceError(f"Model error: {e}"))
+            return
+
+        done = time.perf_counter()
+        for r, output in zip(batch, outputs):
+            r.future.set_result({
+                "prediction": output,
+                "model_version": self.model.version,
+                "latency_ms": round((done - r.enqueued) * 1000, 3),
+                "batch_size": len(batch),
+            })
+
+    # ----- public API -----
+
+    def submit(self, features):
+        """Queue one input and return a Future for its result."""
+        self._ensure_started()
+        request = _Request(features)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, features, timeout=DEFAULT_TIMEOUT):
+        """Run one prediction and wait for the result."""
+        future = self.submit(validate_features(features))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            raise InferenceError("Prediction timed out.")
+
+    def predict_many(self, features_list, timeout=DEFAULT_TIMEOUT):
+        """
+        Queue several inputs at once (they may share a batch) and wait for all.
+        At most MAX_INPUTS inputs; all are checked before any is queued.
+        """
+        if not isinstance(features_list, list) or not features_list:
+            raise InferenceError("inputs must be a non-empty list of feature lists.")
+        if len(features_list) > MAX_INPUTS:
+            raise InferenceError(f"inputs may have at most {MAX_INPUTS} feature lists.")
+        checked = [validate_features(f) for f in features_list]
+        futures = [self.submit(f) for f in checked]
+        try:
+            return [f.result(timeout=timeout) for f in futures]
+        except FutureTimeout:
+            raise InferenceError("Prediction timed out.")
+
+
+def validate_features(features):
+    """Check that an input is a non-empty list of finite numbers."""
+    if not isinstance(features, list) or not features:
+        raise InferenceError("features must be a non-empty list of numbers.")
+    if len(features) > MAX_FEATURES:
+        raise InferenceError(f"features may have at most {MAX_FEATURES} values.")
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in features):
+        raise InferenceError("features must only contain numbers.")
+    # JSON from Python clients may carry NaN or Infinity
+    if not all(math.isfinite(v) for v in features):
+        raise InferenceError("features must not contain NaN or Infinity.")
+    return [float(v) for v in features]
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+def init_app(app):
+    """
+    Load the configured model once and attach an engine to the app.
+    """
+    config = app.config
+    model = registry.load(config.get("ATIS_MODEL", DEFAULT_MODEL))
+    engine = InferenceEngine(
+        model,
+        max_batch_size=config.get("ATIS_INFERENCE_MAX_BATCH", DEFAULT_MAX_BATCH),
+        max_wait_ms=config.get("ATIS_INFERENCE_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+        workers=config.get("ATIS_INFERENCE_WORKERS", DEFAULT_WORKERS),
+    )
+    app.extensions["atis_inference"] = engine
+    atexit.register(engine.shutdown)
+    return engine
+
+
+def get_engine(app):
+    """Return the engine created by init_app()."""
+    return app.extensions["atis_inference"]
@@ -0,0 +1,370 @@
+"""
+ingest.py - Batch Ingestion of Inspection Results
+
+Edge boxes send inspection results in bursts. Instead of one request (and one
+transaction) per result, they POST a batch to /api/ingest and we:
+
+1. Parse the body (a JSON array, {"items": [...]}, or JSON lines).
+2. Validate every item on its own, so one bad item does not reject the batch.
+3. Skip items whose event_id we have already stored (safe retries after a timeout).
+4. Bulk INSERT the new inspections and queue a background job (jobs.py)
+   for the rest, committed in ONE transaction, and respond.
+5. The job then writes the defect links, the plate search index, a pending
+   alert for every "unsafe" result and the dashboard counters and trend
+   rollups, and announces the new inspections and alerts to live
+   dashboards (events.py).
+
+The response lists a status for every item, in the order they were sent:
+"created", "duplicate" or "invalid", and the id of the job ("job_id"; poll
+/api/jobs/<id> to see when the alerts exist).
+"""
+
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+import analytics
+import cache
+import defects
+import events
+import jobs
+import plates
+import stats
+from models import db, Inspection, Alert, split_defects
+
+# Largest batch we accept in one request, in items and in bytes (the body is
+# read into memory before parsing, so its size is checked first)
+DEFAULT_MAX_BATCH = 1000
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+
+# How many event IDs we look up per SELECT (stays under SQLite's variable limit)
+LOOKUP_CHUNK = 500
+
+INSPECTION_STATUSES = ("safe", "unsafe")
+
+
+class BatchError(ValueError):
+    """The request body could not be read as a batch at all."""
+
+
+# -------------------------------------------------------------------------
+# PARSING
+# -------------------------------------------------------------------------
+
+def parse_batch(body, content_type=""):
+    """
+    Turn a raw request body into a list of items.
+
+    Accepts a JSON array, a JSON object with an "items" array, a single JSON
+    object, or JSON lines (one object per line). A JSON-lines line that is not
+    valid JSON becomes a string item, which validation then reports as invalid.
+    """
+    try:
+        text = body.decode("utf-8") if isinstance(body, bytes) else body
+    except UnicodeDecodeError:
+        raise BatchError("Request body must be UTF-8 encoded.")
+    text = text.strip()
+    if not text:
+        raise BatchError("Request body is empty.")
+
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        else:
+            if isinstance(data, dict) and isinstance(data.get("items"), list):
+                return data["items"]
+            if isinstance(data, list):
+                return data
+            if isinstance(data, dict):
+                return [data]
+            raise BatchError("Expected a JSON array or object.")
+
+    # JSON lines
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(line)
+    return items
+
+
+# -------------------------------------------------------------------------
+# VALIDATION
+# -------------------------------------------------------------------------
+
+def _parse_timestamp(value):
+    """Parse an ISO-8601 timestamp into a naive UTC datetime."""
+    if value is None:
+        return datetime.utcnow()
+    stamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if stamp.tzinfo is not None:
+        stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return stamp
+
+
+def _optional_string(item, field, max_length, errors):
+    """Read an optional string field, recording an error if it is too long."""
+    value = item.get(field)
+    if value is None or value == "":
+        return None
+    value = str(value).strip()
+    if len(value) > max_length:
+        errors.append(f"{field} must be at most {max_length} characters.")
+    return value or None
+
+
+def validate_item(item):
+    """
+    Check one inspection result and convert it to column values.
+    Returns (values, errors); values is None when there are errors.
+    """
+    if not isinstance(item, dict):
+        return None, ["Item must be a JSON object."]
+
+    errors = []
+
+    event_id = _optional_string(item, "event_id", 64, errors)
+    if not event_id:
+        errors.append("event_id is required.")
+
+    location = _optional_string(item, "location", 200, errors)
+    if not location:
+        errors.append("location is required.")
+
+    status = str(item.get("status", "")).strip().lower()
+    if status not in INSPECTION_STATUSES:
+        errors.append("status must be 'safe' or 'unsafe'.")
+
+    confidence = item.get("confidence")
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 100:
+        errors.append("confidence must be a number from 0 to 100.")
+
+    try:
+        timestamp = _parse_timestamp(item.get("timestamp"))
+    except ValueError:
+        errors.append("timestamp must be an ISO-8601 date and time.")
+        timestamp = None
+
+    raw_defects = item.get("defects")
+    if isinstance(raw_defects, list):
+        raw_defects = ",".join(str(d).strip() for d in raw_defects if str(d).strip())
+    elif raw_defects is not None:
+        raw_defects = str(raw_defects).strip()
+    raw_defects = raw_defects or None
+    if raw_defects and len(raw_defects) > 300:
+        errors.append("defects must be at most 300 characters in total.")
+
+    values = {
+        "event_id": event_id,
+        "timestamp": timestamp,
+        "plate": _optional_string(item, "plate", 20, errors),
+        "location": location,
+        "camera": _optional_string(item, "camera", 20, errors),
+        "status": status,
+        "confidence": int(round(confidence)) if not errors else None,
+        "defects": raw_defects,
+    }
+
+    if errors:
+        return None, errors
+    return values, []
+
+
+# -------------------------------------------------------------------------
+# WRITING
+# -------------------------------------------------------------------------
+
+def _existing_event_ids(event_ids):
+    """Look up which event IDs are already stored. Returns {event_id: inspection_id}."""
+    found = {}
+    event_ids = list(event_ids)
+    for start in range(0, len(event_ids), LOOKUP_CHUNK):
+        chunk = event_ids[start:start + LOOKUP_CHUNK]
+        rows = db.session.query(Inspection.event_id, Inspection.id).filter(
+            Inspection.event_id.in_(chunk)
+        )
+        found.update(dict(rows))
+    return found
+
+
+def _write_batch(pending):
+    """
+    Bulk insert the new inspections, queue the job that does the rest
+    (see process_inspections) and commit. 'pending' maps event_id -> column values.
+    Returns ({event_id: inspection_id}, job id or None).
+    """
+    rows = list(pending.values())
+    if not rows:
+        return {}, None
+
+    # One multi-row INSERT for the inspections; RETURNING gives us the new IDs
+    result = db.session.execute(
+        insert(Inspection).returning(Inspection.id, Inspection.event_id),
+        rows,
+    )
+    ids = {event_id: inspection_id for inspection_id, event_id in result}
+
+    # Alerts, counters, rollups and live updates happen in the background,
+    # committed together with this batch so they can never be lost
+    job = jobs.enqueue(db.session, "ingest.side_effects", {"inspection_ids": sorted(ids.values())})
+
+    # Bulk INSERTs skip the cache hook: cached pages listing inspections are stale now
+    cache.mark_changed(db.session, "inspections")
+
+    db.session.flush()
+    job_id = job.id
+    db.session.commit()
+    return ids, job_id
+
+
+@jobs.task("ingest.side_effects", priority=jobs.HIGH)
+def process_inspections(payload):
+    """
+    Background job for one ingested batch: normalized defect rows, a pending
+    alert for every unsafe result, dashboard counters, trend rollups, cache
+    invalidation and live updates. The job runner commits it all at once.
+    """
+    rows = []
+    inspection_ids = payload["inspection_ids"]
+    for start in range(0, len(inspection_ids), LOOKUP_CHUNK):
+        chunk = inspection_ids[start:start + LOOKUP_CHUNK]
+        rows.extend(db.session.execute(
+            select(
+                Inspection.id, Inspection.event_id, Inspection.timestamp, Inspection.plate,
+                Inspection.location, Inspection.camera, Inspection.status,
+                Inspection.confidence, Inspection.defects,
+            ).where(Inspection.id.in_(chunk))
+        ).mappings())
+    if not rows:
+        return {"inspections": 0, "alerts": 0}
+
+    # Normalized defect rows for the new inspections (see defects.py)
+    defects.write_links(db.session.connection(), {
+        row["id"]: row["defects"] for row in rows if row["defects"]
+    })
+
+    # The plates of the new inspections, for plate search (see plates.py)
+    plates.record(db.session.connection(), [(row["plate"], row["timestamp"]) for row in rows])
+
+    # Every unsafe result gets a pending alert, created at detection time
+    alert_rows = [
+        {
+            "inspection_id": row["id"],
+            "status": "pending",
+            "created_at": row["timestamp"],
+        }
+        for row in rows
+        if row["status"] == "unsafe"
+    ]
+    alert_ids = {}
+    if alert_rows:
+        result = db.session.execute(
+            insert(Alert).returning(Alert.id, Alert.inspection_id),
+            alert_rows,
+        )
+        alert_ids = {inspection_id: alert_id for alert_id, inspection_id in result}
+
+    # Bulk INSERTs skip the ORM session hooks, so update the counters
+    # and the trend rollups here
+    deltas = Counter()
+    rollups = Counter()
+    cutoff = analytics.minute_cutoff()
+    for row in rows:
+        stats.inspection_deltas(deltas, row)
+        analytics.rollup_deltas(rollups, row, cutoff=cutoff)
+    for alert in alert_rows:
+        stats.alert_deltas(deltas, alert["status"])
+    stats.apply_deltas(db.session.connection(), deltas)
+    analytics.apply_deltas(db.session.connection(), rollups)
+
+    # Bulk INSERTs also skip the event hook: queue the live updates here
+    # (they are only sent if the commit succeeds)
+    for row in rows:
+        events.queue_event(db.session, "inspection.created", {
+            **{k: row[k] for k in ("id", "plate", "location", "camera", "status", "confidence", "event_id")},
+            "timestamp": row["timestamp"].isoformat(),
+            "defects": split_defects(row["defects"]),
+        })
+        if row["id"] in alert_ids:
+            events.queue_event(db.session, "alert.created", {
+                "id": alert_ids[row["id"]],
+                "inspection_id": row["id"],
+                "status": "pending",
+                "response": None,
+                "created_at": row["timestamp"].isoformat(),
+                "plate": row["plate"],
+                "location": row["location"],
+            })
+
+    # ...and the cache hook: the dashboard counters and alert lists changed
+    cache.mark_changed(db.session, "inspections", *(["alerts"] if alert_rows else []))
+    return {"inspections": len(rows), "alerts": len(alert_rows)}
+
+
+def ingest_batch(items):
+    """
+    Validate and store a batch of inspection results.
+    Returns a summary dict with per-item results, in input order.
+    """
+    results = [None] * len(items)
+    pending = {}      # event_id -> column values, in input order
+    positions = {}    # event_id -> index of the first item that used it
+
+    for index, item in enumerate(items):
+        values, errors = validate_item(item)
+        if errors:
+            event_id = item.get("event_id") if isinstance(item, dict) else None
+            results[index] = {"index": index, "event_id": event_id, "status": "invalid", "errors": errors}
+            continue
+        event_id = values["event_id"]
+        if event_id in pending:
+            # The same event sent twice in one batch: keep the first one
+            results[index] = {"index": index, "event_id": event_id, "status": "duplicate"}
+            continue
+        pending[event_id] = values
+        positions[event_id] = index
+
+    # Two attempts: if another request inserted one of our event IDs between
+    # our lookup and our INSERT, the unique index rejects the batch; we roll
+    # back, look up again and retry with the remaining items.
+    for attempt in range(2):
+        existing = _existing_event_ids(pending)
+        for event_id, inspection_id in existing.items():
+            pending.pop(event_id)
+            index = positions[event_id]
+            results[index] = {"index": index, "event_id": event_id, "status": "duplicate", "id": inspection_id}
+        try:
+            created, job_id = _write_batch(pending)
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 1:
+                raise
+
+    for event_id, inspection_id in created.items():
+        index = positions[event_id]
+        results[index] = {
+            "index": index,
+            "event_id": event_id,
+            "status": "created",
+            "id": inspection_id,
+        }
+
+    summary = Counter(r["status"] for r in results)
+    return {
+        "success": True,
+        "created": summary["created"],
+        "duplicates": summary["duplicate"],
+        "invalid": summary["invalid"],
+        "job_id": job_id,
+        "results": results,
+    }
@@ -0,0 +1,127 @@
+"""
+instrumentation.py - Query Counting and Query Budgets
+
+Counts the SQL statements each request runs, so we can catch "N+1" problems
+(one extra SELECT per table row) before they reach production.
+
+Usage:
+- Decorate a view with @query_budget(3) to say it may run at most 3 queries.
+  When a request goes over budget we log a warning; in testing mode
+  (app.testing or ATIS_ENFORCE_QUERY_BUDGETS = True) we raise
+  QueryBudgetExceeded instead, so the test that made the request fails.
+- Wrap any code in 'with count_queries() as counter:' and read counter.count
+  afterwards to check it by hand. Only queries run by the same thread are
+  counted, so background job threads (jobs.py) do not show up.
+- Code that must run extra queries depending on the data (not on the number
+  of rows shown) declares them with allow_queries(n).
+"""
+
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised (in testing mode) when a view runs more queries than its budget."""
+
+
+class QueryCounter:
+    """Simple container for the number of statements run and their SQL text."""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+# Counters opened by count_queries() in each thread, innermost last
+_local = threading.local()
+
+
+def _active_counters():
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = []
+    return counters
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Engine hook: called once for every SQL statement sent to the database."""
+    for counter in _active_counters():
+        counter.count += 1
+        counter.statements.append(statement)
+
+    if has_app_context():
+        counter = g.get("_query_counter")
+        if counter is not None:
+            counter.count += 1
+            counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries run inside a 'with' block:
+
+        with count_queries() as counter:
+            client.get("/alerts")
+        assert counter.count <= 2
+    """
+    counter = QueryCounter()
+    counters = _active_counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(max_queries):
+    """
+    Decorator that sets the maximum number of queries a view may run.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def allow_queries(count):
+    """
+    Let the current request run 'count' queries more than its budget, for
+    work whose size depends on the data (e.g. one query per archive file
+    a search has to open, see archive.py).
+    """
+    if has_app_context():
+        g._query_allowance = g.get("_query_allowance", 0) + count
+
+
+def init_app(app):
+    """
+    Install the engine hook and the per-request budget check.
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+
+    @app.before_request
+    def _start_query_counter():
+        g._query_counter = QueryCounter()
+
+    @app.after_request
+    def _check_query_budget(response):
+        counter = g.get("_query_counter")
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, "query_budget", None)
+        if counter is None or budget is None or counter.count <= budget + g.get("_query_allowance", 0):
+            return response
+
+        message = (
+            f"{request.endpoint} ran {counter.count} queries "
+            f"(budget {budget}):\n" + "\n".join(counter.statements)
+        )
+        if app.testing or app.config.get("ATIS_ENFORCE_QUERY_BUDGETS"):
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+        return response
@@ -0,0 +1,471 @@
+"""
+jobs.py - Background Jobs
+
+Work that does not have to finish before the response is sent (alerts,
+counters and live updates after an ingest, report exports...) runs as a
+background job instead of in the request thread.
+
+- Jobs are rows in the 'jobs' table of the main database, so they survive
+  restarts. enqueue() adds the row to the current session: the job is
+  committed together with the data it is about, or not at all.
+- Worker threads in each server process (ATIS_JOB_WORKERS) take the queued
+  job with the lowest priority number (HIGH, NORMAL, LOW) whose run_at has
+  come, and run its handler.
+- A handler does its database work on db.session and does not commit: the
+  worker commits it together with the job's "done" status. A job that
+  fails is rolled back completely and retried later with exponential
+  backoff, until max_attempts; then it stays "failed" for a human to look
+  at ('flask jobs retry').
+- Running jobs are leased: their worker refreshes locked_at every few
+  seconds. If a process dies, its jobs are queued again once the lease
+  (ATIS_JOB_LEASE seconds) runs out.
+
+Handlers are registered with the @task decorator:
+
+    @jobs.task("reports.export", priority=jobs.LOW)
+    def export(payload):
+        ...
+
+    jobs.enqueue(db.session, "reports.export", {"report_job_id": 7})
+
+Set ATIS_JOB_WORKERS = 0 (in the config or the environment) to run no
+workers in the web processes and run 'flask jobs work' as a separate
+process instead. Live updates (events.py)
+are only seen by browsers connected to the process that ran the job.
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import event, func, select, update
+
+import metrics
+from models import db, Job
+
+# Priorities: lower numbers run first
+HIGH = 0
+NORMAL = 5
+LOW = 9
+
+STATUSES = ("queued", "running", "done", "failed")
+
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 1.0     # seconds between looks at an empty queue
+DEFAULT_LEASE = 300             # seconds before a silent worker's job is taken back
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Retry delays: 2s, 4s, 8s... (with jitter), at most BACKOFF_MAX
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 3600.0
+
+_SESSION_KEY = "atis_jobs_enqueued"
+
+log = logging.getLogger("atis.jobs")
+
+jobs_finished = metrics.registry.add(metrics.Counter(
+    "atis_jobs_total", "Background jobs run, by kind and outcome (done/retry/failed).",
+    labels=("kind", "outcome"),
+))
+job_duration = metrics.registry.add(metrics.Histogram(
+    "atis_job_duration_seconds", "Time to run a background job, by kind.",
+    labels=("kind",),
+))
+
+
+class JobError(Exception):
+    """A job could not be queued or run (e.g. unknown kind)."""
+
+
+# -------------------------------------------------------------------------
+# TASK REGISTRY
+# -------------------------------------------------------------------------
+
+class Task:
+    """A registered job handler and its defaults."""
+
+    def __init__(self, name, fn, priority, max_attempts):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+_TASKS = {}
+
+
+def task(name, priority=NORMAL, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register fn(payload) as the handler of jobs of this kind."""
+    def decorator(fn):
+        _TASKS[name] = Task(name, fn, priority, max_attempts)
+        return fn
+    return decorator
+
+
+def enqueue(session, kind, payload=None, priority=None, delay=0, max_attempts=None):
+    """
+    Add a job to the session. It is queued when the session commits.
+    Returns the Job (its id is known after the next flush).
+    """
+    registered = _TASKS.get(kind)
+    if registered is None:
+        raise JobError(f"Unknown job kind '{kind}'.")
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        priority=registered.priority if priority is None else priority,
+        max_attempts=max_attempts or registered.max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    session.add(job)
+    session.info[_SESSION_KEY] = True
+    return job
+
+
+def _wake_after_commit(session):
+    """Session hook: wake this process's workers when jobs were committed."""
+    if session.info.pop(_SESSION_KEY, False):
+        runner = current_app.extensions.get("atis_jobs")
+        if runner is not None:
+            runner.wake()
+
+
+def _forget_after_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+# -------------------------------------------------------------------------
+# RUNNING ONE JOB
+# -------------------------------------------------------------------------
+
+def backoff(attempts):
+    """Seconds to wait before retry number 'attempts' (1, 2...), with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(worker):
+    """
+    Mark the next due job as running for this worker and return it
+    (id, kind, payload, attempts, max_attempts), or None if nothing is due.
+    """
+    while True:
+        now = datetime.utcnow()
+        candidate = db.session.execute(
+            select(Job.id)
+            .where(Job.status == "queued", Job.run_at <= now)
+            .order_by(Job.priority, Job.run_at, Job.id)
+            .limit(1)
+        ).scalar()
+        if candidate is None:
+            db.session.rollback()
+            return None
+
+        # Another worker may take the same candidate: only one UPDATE matches
+        row = db.session.execute(
+            update(Job)
+            .where(Job.id == candidate, Job.status == "queued")
+            .values(status="running", locked_by=worker, locked_at=now, started_at=now,
+                    attempts=Job.attempts + 1)
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        if row is not None:
+            return row
+
+
+def _finish(job_id, worker, **values):
+    """Update a job this worker holds. Returns False if the lease was lost."""
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker, Job.status == "running")
+        .values(locked_by=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def run_next(worker):
+    """
+    Run the next due job, if any. Returns True if a job was run.
+    Needs an app context; the caller removes the session afterwards.
+    """
+    job = claim(worker)
+    if job is None:
+        return False
+
+    started = time.perf_counter()
+    try:
+        registered = _TASKS.get(job.kind)
+        if registered is None:
+            raise JobError(f"No handler for job kind '{job.kind}'.")
+        result = registered.fn(json.loads(job.payload))
+        if not _finish(job.id, worker, status="done", finished_at=datetime.utcnow(),
+                       result=json.dumps(result) if result is not None else None, error=None):
+            # Taken back after a lost lease: someone else runs it, drop our work
+            log.warning("Job %s (%s) lost its lease; its work was rolled back.", job.id, job.kind)
+            db.session.rollback()
+            return True
+        db.session.commit()
+        jobs_finished.inc(job.kind, "done")
+    except Exception as e:
+        db.session.rollback()
+        _record_failure(job, worker, e)
+    finally:
+        job_duration.observe(time.perf_counter() - started, job.kind)
+    return True
+
+
+def _record_failure(job, worker, error):
+    """Schedule a retry, or mark the job failed after its last attempt."""
+    message = f"{type(error).__name__}: {error}"[:500]
+    if job.attempts >= job.max_attempts:
+        log.exception("Job %s (%s) failed for good after %s attempts", job.id, job.kind, job.attempts)
+        _finish(job.id, worker, status="failed", error=message, finished_at=datetime.utcnow())
+        outcome = "failed"
+    else:
+        delay = backoff(job.attempts)
+        log.warning("Job %s (%s) failed (attempt %s), retrying in %.0fs: %s",
+                    job.id, job.kind, job.attempts, delay, message)
+        _finish(job.id, worker, status="queued", error=message,
+                run_at=datetime.utcnow() + timedelta(seconds=delay))
+        outcome = "retry"
+    db.session.commit()
+    jobs_finished.inc(job.kind, outcome)
+
+
+def requeue_stale(lease=DEFAULT_LEASE):
+    """
+    Take back running jobs whose worker stopped refreshing its lease
+    (the process died). Returns the number of jobs taken back.
+    """
+    expired = datetime.utcnow() - timedelta(seconds=lease)
+    stale = (Job.status == "running", Job.locked_at < expired)
+    failed = db.session.execute(
+        update(Job).where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status="failed", locked_by=None, error="Worker stopped while running the job.",
+                finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    queued = db.session.execute(
+        update(Job).where(*stale)
+        .values(status="queued", locked_by=None, error="Worker stopped while running the job.")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return failed + queued
+
+
+# -------------------------------------------------------------------------
+# WORKER THREADS
+# -------------------------------------------------------------------------
+
+class JobRunner:
+    """
+    A pool of worker threads for one process. Threads start on first use
+    (the first request, or 'flask jobs work') and restart after a fork
+    (e.g. gunicorn --preload), since threads do not survive fork().
+    """
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, poll_interval=DEFAULT_POLL_INTERVAL, lease=DEFAULT_LEASE):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+        self._names = []        # worker names, for the lease heartbeat
+        self._stopping = threading.Event()
+
+    def ensure_started(self):
+        if self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = threading.Event()
+            self._wakeup = threading.Event()
+            prefix = f"{os.uname().nodename}:{os.getpid()}"
+            self._names = [f"{prefix}:{n}" for n in range(self.workers)]
+            self._threads = [
+                threading.Thread(target=self._work, args=(name,), name=f"atis-job-{n}", daemon=True)
+                for n, name in enumerate(self._names)
+            ]
+            self._threads.append(threading.Thread(target=self._heartbeat, name="atis-job-lease", daemon=True))
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """A job was just queued: stop waiting and look at the queue."""
+        self._wakeup.set()
+
+    def shutdown(self, timeout=10):
+        """Let running jobs finish, then stop the threads."""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _work(self, worker):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    ran = run_next(worker)
+            except Exception:
+                # The database is unreachable or similar: wait and try again
+                log.exception("Job worker %s failed", worker)
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _heartbeat(self):
+        """Refresh the leases of this process's running jobs; take back stale ones."""
+        interval = max(1.0, self.lease / 5)
+        while not self._stopping.wait(interval):
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        update(Job)
+                        .where(Job.status == "running", Job.locked_by.in_(self._names))
+                        .values(locked_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+                    requeue_stale(self.lease)
+            except Exception:
+                log.exception("Job lease refresh failed")
+
+
+def get_runner(app):
+    """Return the runner created by init_app()."""
+    return app.extensions["atis_jobs"]
+
+
+# -------------------------------------------------------------------------
+# STATUS
+# -------------------------------------------------------------------------
+
+def status_counts():
+    """Number of jobs per status, e.g. {"queued": 3, "running": 1, ...}."""
+    counts = dict.fromkeys(STATUSES, 0)
+    counts.update(db.session.query(Job.status, func.count()).group_by(Job.status).all())
+    return counts
+
+
+def waiting_count():
+    """Queued jobs that are due now (for the metrics gauge)."""
+    return db.session.query(func.count(Job.id)).filter(
+        Job.status == "queued", Job.run_at <= datetime.utcnow()
+    ).scalar()
+
+
+def prune(days):
+    """Delete finished ("done") jobs older than 'days'. Returns rows deleted."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = Job.query.filter(Job.status == "done", Job.finished_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+jobs_cli = click.Group("jobs", help="Run and inspect background jobs.")
+
+
+@jobs_cli.command("work")
+@click.option("--workers", type=int, default=None, help="Worker threads (default ATIS_JOB_WORKERS, at least 1).")
+@click.option("--drain", is_flag=True, help="Exit once no job is due.")
+def work_command(workers, drain):
+    """Run jobs in this process until stopped (Ctrl+C)."""
+    app = current_app._get_current_object()
+    if drain:
+        done = 0
+        requeue_stale(app.config.get("ATIS_JOB_LEASE", DEFAULT_LEASE))
+        while run_next(f"{os.uname().nodename}:{os.getpid()}:cli"):
+            db.session.remove()
+            done += 1
+        click.echo(f"Ran {done:,} jobs.")
+        return
+
+    runner = get_runner(app)
+    runner.workers = max(1, workers or runner.workers)
+    runner.ensure_started()
+    click.echo(f"Running jobs with {runner.workers} workers. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.shutdown()
+
+
+@jobs_cli.command("stats")
+def stats_command():
+    """Show the number of jobs per status, and the latest failures."""
+    for status, count in status_counts().items():
+        click.echo(f"{status:8} {count:,}")
+    for job in Job.query.filter_by(status="failed").order_by(Job.id.desc()).limit(10):
+        click.echo(f"  #{job.id} {job.kind}: {job.error}")
+
+
+@jobs_cli.command("retry")
+@click.argument("job_id", type=int, required=False)
+@click.option("--all-failed", is_flag=True, help="Retry every failed job.")
+def retry_command(job_id, all_failed):
+    """Queue failed jobs again (one job, or all of them)."""
+    query = Job.query.filter(Job.status == "failed")
+    if not all_failed:
+        if job_id is None:
+            raise click.UsageError("Give a job id or --all-failed.")
+        query = query.filter(Job.id == job_id)
+    count = query.update(
+        {"status": "queued", "attempts": 0, "run_at": datetime.utcnow(), "finished_at": None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    click.echo(f"Queued {count:,} jobs again.")
+
+
+@jobs_cli.command("prune")
+@click.option("--days", default=7, show_default=True, help="Keep finished jobs this many days.")
+def prune_command(days):
+    """Delete old finished jobs."""
+    click.echo(f"Deleted {prune(days):,} jobs.")
+
+
+def init_app(app):
+    """
+    Create this process's job runner (its threads start with the first
+    request), install the session hooks and register 'flask jobs'.
+    """
+    runner = JobRunner(
+        app,
+        workers=app.config.get("ATIS_JOB_WORKERS", DEFAULT_WORKERS),
+        poll_interval=app.config.get("ATIS_JOB_POLL_INTERVAL", DEFAULT_POLL_INTERVAL),
+        lease=app.config.get("ATIS_JOB_LEASE", DEFAULT_LEASE),
+    )
+    app.extensions["atis_jobs"] = runner
+    app.before_request(runner.ensure_started)
+    atexit.register(runner.shutdown)
+
+    if not event.contains(db.session, "after_commit", _wake_after_commit):
+        event.listen(db.session, "after_commit", _wake_after_commit)
+        event.listen(db.session, "after_rollback", _forget_after_rollback)
+    app.cli.add_command(jobs_cli)
+    return runner
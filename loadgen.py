@@ -0,0 +1,316 @@
+"""
+loadgen.py - Synthetic Data Generator
+
+seed.py creates 44 hand-written inspections, which is enough to look at the
+pages but tells us nothing about how they behave with millions of rows.
+This file generates as many inspections as you like, using the same
+vocabulary as seed.py:
+
+- the same locations and cameras (and how often each appears)
+- the same defect names, and how many defects an unsafe tire usually has
+- the same alert status mix and operator responses
+
+Timestamps follow a daily traffic pattern (quiet nights, morning and
+evening peaks, less traffic at weekends), and rows are written in time
+order with bulk INSERTs, one transaction per batch, so a million rows take
+seconds rather than minutes.
+
+    flask loadgen --count 1000000 --days 90 --unsafe-rate 0.12 --seed 42
+
+Run it on a copy of the database; it only adds rows.
+"""
+
+import random
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from string import ascii_uppercase, digits
+
+import click
+from sqlalchemy import insert
+
+import analytics
+import cache
+import defects
+import plates
+import stats
+from models import db, Inspection, Alert, split_defects
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_DAYS = 30
+DEFAULT_UNSAFE_RATE = 0.12
+
+# Relative traffic per hour of the day (0 = midnight)
+HOURLY_TRAFFIC = [
+    2, 1, 1, 1, 2, 4, 8, 14, 16, 12, 10, 10,
+    11, 11, 12, 13, 15, 16, 13, 9, 7, 5, 4, 3,
+]
+
+# Relative traffic per day of the week (Monday first)
+WEEKDAY_TRAFFIC = [1.0, 1.0, 1.0, 1.0, 1.1, 0.7, 0.6]
+
+# Share of inspections by vehicles seen earlier (regular commuters, fleets)
+REPEAT_VEHICLE_RATE = 0.3
+
+# Alerts older than this are usually closed already
+OPEN_ALERT_AGE = timedelta(days=1)
+OLD_ALERT_RESOLVED_RATE = 0.9
+
+
+# -------------------------------------------------------------------------
+# VOCABULARY (taken from seed.py)
+# -------------------------------------------------------------------------
+
+class Vocabulary:
+    """The value distributions of seed.py's dummy data."""
+
+    def __init__(self, inspections, alerts):
+        self.places = Counter((d["location"], d["camera"]) for d in inspections)
+        self.missing_plate_rate = sum(1 for d in inspections if not d["plate"]) / len(inspections)
+
+        unsafe = [d for d in inspections if d["status"] == "unsafe"]
+        self.defect_names = Counter(name for d in unsafe for name in split_defects(d["defects"]))
+        self.defect_counts = Counter(len(split_defects(d["defects"])) for d in unsafe)
+
+        self.confidence = {}
+        for status in ("safe", "unsafe"):
+            values = [d["confidence"] for d in inspections if d["status"] == status]
+            self.confidence[status] = (min(values), max(values))
+
+        self.alert_statuses = Counter(status for _, status, _ in alerts)
+        self.responses = {}
+        for _, status, response in alerts:
+            if response:
+                self.responses.setdefault(status, []).append(response)
+
+    @classmethod
+    def from_seed(cls):
+        import seed
+        return cls(seed.INSPECTIONS_DATA, seed.ALERT_DATA)
+
+
+def _weighted(counter):
+    """Split a Counter into (values, weights) lists for random.choices."""
+    values = list(counter)
+    return values, [counter[v] for v in values]
+
+
+# -------------------------------------------------------------------------
+# ROW GENERATION
+# -------------------------------------------------------------------------
+
+class Generator:
+    """Produces inspection and alert rows, reproducibly for a given seed."""
+
+    def __init__(self, vocabulary, unsafe_rate=DEFAULT_UNSAFE_RATE, seed=None):
+        self.rng = random.Random(seed)
+        self.vocab = vocabulary
+        self.unsafe_rate = unsafe_rate
+        # Event IDs must be unique across runs, even with the same seed
+        self.run_id = secrets.token_hex(4)
+        self.recent_plates = []
+        self.sequence = 0
+        self._places = _weighted(vocabulary.places)
+        self._defect_names = _weighted(vocabulary.defect_names)
+        self._defect_counts = _weighted(vocabulary.defect_counts)
+        self._alert_statuses = _weighted(vocabulary.alert_statuses)
+
+    # ----- timestamps -----
+
+    def day_counts(self, count, start, days):
+        """Spread 'count' inspections over the days, following weekday traffic."""
+        weights = [WEEKDAY_TRAFFIC[(start + timedelta(days=d)).weekday()] for d in range(days)]
+        total = sum(weights)
+        counts = [int(count * w / total) for w in weights]
+        for d in self.rng.choices(range(days), weights=weights, k=count - sum(counts)):
+            counts[d] += 1
+        return counts
+
+    def timestamps(self, day, count, now):
+        """
+        'count' sorted timestamps within one day, following hourly traffic.
+        Today's timestamps that would fall in the future are moved to a
+        random earlier time instead.
+        """
+        rng = self.rng
+        hours = rng.choices(range(24), weights=HOURLY_TRAFFIC, k=count)
+        elapsed_today = max(int((now - day).total_seconds()), 1)
+        stamps = []
+        for h in hours:
+            stamp = day + timedelta(hours=h, seconds=rng.randrange(3600))
+            if stamp > now:
+                stamp = day + timedelta(seconds=rng.randrange(elapsed_today))
+            stamps.append(stamp)
+        stamps.sort()
+        return stamps
+
+    # ----- values -----
+
+    def plate(self):
+        rng = self.rng
+        if rng.random() < self.vocab.missing_plate_rate:
+            return None
+        if self.recent_plates and rng.random() < REPEAT_VEHICLE_RATE:
+            return rng.choice(self.recent_plates)
+        plate = "".join(rng.choices(ascii_uppercase, k=3)) + "-" + "".join(rng.choices(digits, k=4))
+        if len(self.recent_plates) < 5000:
+            self.recent_plates.append(plate)
+        else:
+            self.recent_plates[rng.randrange(5000)] = plate
+        return plate
+
+    def defects(self):
+        rng = self.rng
+        count = rng.choices(*self._defect_counts)[0]
+        names = []
+        while len(names) < count:
+            name = rng.choices(*self._defect_names)[0]
+            if name not in names:
+                names.append(name)
+        return ",".join(names) or None
+
+    def inspection(self, timestamp):
+        rng = self.rng
+        self.sequence += 1
+        location, camera = rng.choices(*self._places)[0]
+        status = "unsafe" if rng.random() < self.unsafe_rate else "safe"
+        low, high = self.vocab.confidence[status]
+        return {
+            "event_id": f"loadgen-{self.run_id}-{self.sequence}",
+            "timestamp": timestamp,
+            "plate": self.plate(),
+            "location": location,
+            "camera": camera,
+            "status": status,
+            "confidence": rng.randint(low, high),
+            "defects": self.defects() if status == "unsafe" else None,
+        }
+
+    def alert(self, inspection_id, timestamp, now):
+        rng = self.rng
+        if now - timestamp > OPEN_ALERT_AGE and rng.random() < OLD_ALERT_RESOLVED_RATE:
+            status = "resolved"
+        else:
+            status = rng.choices(*self._alert_statuses)[0]
+        responses = self.vocab.responses.get(status)
+        return {
+            "inspection_id": inspection_id,
+            "status": status,
+            "response": rng.choice(responses) if responses else None,
+            "created_at": timestamp,
+        }
+
+
+# -------------------------------------------------------------------------
+# WRITING
+# -------------------------------------------------------------------------
+
+def _write_batch(generator, rows, now):
+    """Bulk insert one batch of inspections with their defects, plates, alerts and counters."""
+    # Core INSERTs on the tables: the ORM bulk path is far slower for
+    # batches this size when it has to return the new IDs
+    connection = db.session.connection()
+    table = Inspection.__table__
+    result = connection.execute(insert(table).returning(table.c.id, table.c.event_id), rows)
+    by_event = {event_id: inspection_id for inspection_id, event_id in result}
+    ids = [by_event[row["event_id"]] for row in rows]
+
+    defects.write_links(connection, {
+        inspection_id: row["defects"] for inspection_id, row in zip(ids, rows) if row["defects"]
+    })
+
+    plates.record(connection, [(row["plate"], row["timestamp"]) for row in rows])
+
+    alert_rows = [
+        generator.alert(inspection_id, row["timestamp"], now)
+        for inspection_id, row in zip(ids, rows)
+        if row["status"] == "unsafe"
+    ]
+    if alert_rows:
+        connection.execute(insert(Alert.__table__), alert_rows)
+
+    deltas = Counter()
+    rollups = Counter()
+    cutoff = analytics.minute_cutoff()
+    for row in rows:
+        stats.inspection_deltas(deltas, row)
+        analytics.rollup_deltas(rollups, row, cutoff=cutoff)
+    for alert in alert_rows:
+        stats.alert_deltas(deltas, alert["status"])
+    stats.apply_deltas(connection, deltas)
+    analytics.apply_deltas(connection, rollups)
+    cache.mark_changed(db.session, "inspections", "alerts")
+
+    db.session.commit()
+    return len(alert_rows)
+
+
+def generate(count, days=DEFAULT_DAYS, end=None, unsafe_rate=DEFAULT_UNSAFE_RATE,
+             seed=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Insert 'count' synthetic inspections spread over the 'days' days before
+    'end' (default: now), oldest first. Returns (inspections, alerts) written.
+    'progress', if given, is called with the running inspection total.
+    """
+    now = end or datetime.utcnow()
+    first_day = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    generator = Generator(Vocabulary.from_seed(), unsafe_rate=unsafe_rate, seed=seed)
+
+    written = alerts = 0
+    batch = []
+    for offset, day_count in enumerate(generator.day_counts(count, first_day, days + 1)):
+        day = first_day + timedelta(days=offset)
+        for timestamp in generator.timestamps(day, day_count, now):
+            batch.append(generator.inspection(timestamp))
+            if len(batch) == batch_size:
+                alerts += _write_batch(generator, batch, now)
+                written += len(batch)
+                batch = []
+                if progress:
+                    progress(written)
+    if batch:
+        alerts += _write_batch(generator, batch, now)
+        written += len(batch)
+        if progress:
+            progress(written)
+    return written, alerts
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+@click.command("loadgen")
+@click.option("--count", default=100000, show_default=True, help="Inspections to generate.")
+@click.option("--days", default=DEFAULT_DAYS, show_default=True, help="Spread them over this many days.")
+@click.option("--unsafe-rate", default=DEFAULT_UNSAFE_RATE, show_default=True, help="Share of unsafe results.")
+@click.option("--seed", type=int, default=None, help="Random seed for reproducible data.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, help="Rows per INSERT batch.")
+def loadgen_command(count, days, unsafe_rate, seed, batch_size):
+    """Add synthetic inspections and alerts for load testing."""
+    started = time.perf_counter()
+    shown = False
+
+    def progress(done):
+        nonlocal shown
+        shown = True
+        click.echo(f"\r{done:,} / {count:,} inspections", nl=False)
+
+    try:
+        written, alerts = generate(
+            count, days=days, unsafe_rate=unsafe_rate, seed=seed,
+            batch_size=batch_size, progress=progress,
+        )
+    finally:
+        # End the progress line, also when the run stops with an error
+        if shown:
+            click.echo()
+    elapsed = time.perf_counter() - started
+    click.echo(f"Inserted {written:,} inspections and {alerts:,} alerts in {elapsed:.1f}s "
+               f"({written / max(elapsed, 1e-9):,.0f} rows/s).")
+
+
+def init_app(app):
+    """Register 'flask loadgen'."""
+    app.cli.add_command(loadgen_command)
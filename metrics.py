@@ -0,0 +1,342 @@
+"""
+metrics.py - Request Metrics, Profiling and Slow-Query Log
+
+Answers "where does the time go?" for every request:
+
+- request latency per route (histogram), and requests per route/status
+- SQL statements per request, and how long each statement took
+- Jinja template render time per template
+- a slow-query log: statements slower than ATIS_SLOW_QUERY_MS are logged
+  to the "atis.slow_sql" logger
+
+Everything is kept in memory in this process and exposed in the Prometheus
+text format on /metrics. Each response also carries a "Server-Timing"
+header (db / render / total), which browser dev tools show per request.
+
+Per-request profiling: an admin can send the header "X-ATIS-Profile: 1".
+That request then runs under cProfile, and the stats are saved to
+instance/profiles/ (open them with 'python -m pstats' or snakeviz). The
+file name comes back in the "X-ATIS-Profile-File" header. Set
+ATIS_PROFILER_ENABLED = False to switch this off completely.
+"""
+
+import bisect
+import cProfile
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import before_render_template, g, has_request_context, request, session, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram buckets (upper bounds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+DEFAULT_SLOW_QUERY_MS = 200
+PROFILE_HEADER = "X-ATIS-Profile"
+PROFILE_ROLES = ("Admin",)
+
+slow_query_log = logging.getLogger("atis.slow_sql")
+
+
+# -------------------------------------------------------------------------
+# METRIC TYPES
+# -------------------------------------------------------------------------
+
+class Counter:
+    """A number that only goes up, per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Histogram:
+    """Counts observations into buckets, per label set (like Prometheus)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}    # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+        for label_values, series in items:
+            labels = dict(zip(self.labels, label_values))
+            running = 0
+            for bound, count in zip(self.buckets, series):
+                running += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_number(bound)}, running
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, series[-1]
+            yield f"{self.name}_sum", labels, series[-2]
+            yield f"{self.name}_count", labels, series[-1]
+
+
+class Gauge:
+    """A value read at scrape time from a function (e.g. open connections)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def samples(self):
+        yield self.name, {}, self.read()
+
+
+class Registry:
+    """All metrics of this process, rendered together on /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """The Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+registry = Registry()
+
+http_requests = registry.add(Counter(
+    "atis_http_requests_total", "Requests handled, by route, method and status.",
+    labels=("route", "method", "status"),
+))
+http_latency = registry.add(Histogram(
+    "atis_http_request_duration_seconds", "Time to build each response, by route.",
+    labels=("route",),
+))
+request_queries = registry.add(Histogram(
+    "atis_http_request_sql_queries", "SQL statements run per request, by route.",
+    labels=("route",), buckets=QUERY_COUNT_BUCKETS,
+))
+request_sql_time = registry.add(Histogram(
+    "atis_http_request_sql_seconds", "Time spent in SQL per request, by route.",
+    labels=("route",),
+))
+sql_duration = registry.add(Histogram(
+    "atis_sql_statement_duration_seconds", "Duration of single SQL statements, by route.",
+    labels=("route",), buckets=SQL_BUCKETS,
+))
+slow_queries = registry.add(Counter(
+    "atis_sql_slow_statements_total", "Statements slower than the slow-query threshold, by route.",
+    labels=("route",),
+))
+render_time = registry.add(Histogram(
+    "atis_template_render_seconds", "Jinja render time, by template.",
+    labels=("template",),
+))
+
+
+def _route():
+    """Label for the current request: the endpoint name (bounded cardinality)."""
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "background"
+
+
+# -------------------------------------------------------------------------
+# SQL TIMING
+# -------------------------------------------------------------------------
+
+_slow_threshold = [DEFAULT_SLOW_QUERY_MS / 1000]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("atis_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("atis_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    route = _route()
+
+    sql_duration.observe(elapsed, route)
+    if has_request_context():
+        g._sql_time = g.get("_sql_time", 0.0) + elapsed
+        g._sql_count = g.get("_sql_count", 0) + 1
+
+    threshold = _slow_threshold[0]
+    if threshold is not None and elapsed >= threshold:
+        slow_queries.inc(route)
+        slow_query_log.warning(
+            "%.1f ms [%s] %s", elapsed * 1000, route, " ".join(statement.split())[:2000]
+        )
+
+
+# -------------------------------------------------------------------------
+# TEMPLATE TIMING
+# -------------------------------------------------------------------------
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault("_render_starts", []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    starts = g.get("_render_starts")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    render_time.observe(elapsed, template.name or "string")
+    # Nested templates (includes) are part of the outer render, count it once
+    if not starts:
+        g._render_time = g.get("_render_time", 0.0) + elapsed
+
+
+# -------------------------------------------------------------------------
+# REQUEST HOOKS
+# -------------------------------------------------------------------------
+
+def _profiling_allowed(app):
+    return (
+        app.config.get("ATIS_PROFILER_ENABLED", True)
+        and request.headers.get(PROFILE_HEADER)
+        and session.get("role") in PROFILE_ROLES
+    )
+
+
+def _start_request(app):
+    g._request_start = time.perf_counter()
+    if _profiling_allowed(app):
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+
+def _save_profile(app, profiler):
+    """Write the profile of this request to instance/profiles/. Returns the file name."""
+    folder = os.path.join(app.instance_path, "profiles")
+    os.makedirs(folder, exist_ok=True)
+    name = f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{request.endpoint or 'unmatched'}.prof"
+    profiler.dump_stats(os.path.join(folder, name))
+    return name
+
+
+def _finish_request(app, response):
+    started = g.get("_request_start")
+    if started is None:
+        return response
+
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers["X-ATIS-Profile-File"] = _save_profile(app, profiler)
+
+    elapsed = time.perf_counter() - started
+    route = _route()
+    http_requests.inc(route, request.method, str(response.status_code))
+    http_latency.observe(elapsed, route)
+    request_queries.observe(g.get("_sql_count", 0), route)
+    request_sql_time.observe(g.get("_sql_time", 0.0), route)
+
+    response.headers["Server-Timing"] = ", ".join((
+        f"db;desc=\"{g.get('_sql_count', 0)} queries\";dur={g.get('_sql_time', 0.0) * 1000:.1f}",
+        f"render;dur={g.get('_render_time', 0.0) * 1000:.1f}",
+        f"total;dur={elapsed * 1000:.1f}",
+    ))
+    return response
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+def render():
+    """Text for the /metrics endpoint."""
+    return registry.render()
+
+
+def add_gauge(name, help_text, read):
+    """Expose a value computed at scrape time (e.g. connected clients)."""
+    if not any(m.name == name for m in registry.metrics):
+        registry.add(Gauge(name, help_text, read))
+
+
+def init_app(app):
+    """
+    Install the SQL and template timers and the request hooks.
+    Streamed responses are timed until their first byte, not until the end.
+    """
+    _slow_threshold[0] = _threshold_seconds(app.config.get("ATIS_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS))
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    app.before_request(lambda: _start_request(app))
+    app.after_request(lambda response: _finish_request(app, response))
+
+
+def _threshold_seconds(value):
+    """ATIS_SLOW_QUERY_MS in seconds; None or a negative value turns the log off."""
+    if value is None or value < 0:
+        return None
+    return value / 1000
@@ -0,0 +1,178 @@
+"""
+migrations.py - Database Schema Upgrades
+
+db.create_all() only creates tables that are missing; it never changes existing
+ones. This file keeps an ordered list of numbered upgrade steps for databases
+created by older versions of the app (like an existing instance/atis.db).
+
+The 'schema_migrations' table remembers which steps have already run, so each
+step runs exactly once per database. Steps run automatically when the app
+starts (set ATIS_AUTO_MIGRATE = False to turn this off) or by hand with:
+
+    flask upgrade-db
+"""
+
+import click
+from sqlalchemy import inspect as sa_inspect, text
+
+from models import db
+
+# Ordered list of (version, description, function)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Decorator that registers an upgrade step.
+    Versions must be unique and are applied in ascending order.
+    """
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+# -------------------------------------------------------------------------
+# HELPERS
+# -------------------------------------------------------------------------
+
+def column_exists(table, column):
+    """True if the table already has the column (create_all may have added it)."""
+    columns = sa_inspect(db.session.connection()).get_columns(table)
+    return any(c["name"] == column for c in columns)
+
+
+def add_column(table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN, skipped if the column is already there."""
+    if not column_exists(table, column):
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def create_missing_indexes(*tables):
+    """Create every index declared on the models for these tables, if missing."""
+    connection = db.session.connection()
+    for name in tables:
+        for index in db.metadata.tables[name].indexes:
+            index.create(connection, checkfirst=True)
+
+
+# -------------------------------------------------------------------------
+# UPGRADE STEPS
+# -------------------------------------------------------------------------
+
+@migration(1, "Build the dashboard counters from existing rows")
+def _build_stat_counters():
+    import stats
+    stats.rebuild()
+
+
+@migration(2, "Add inspections.event_id for idempotent ingestion")
+def _add_inspection_event_id():
+    add_column("inspections", "event_id", "VARCHAR(64)")
+    db.session.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_inspections_event_id ON inspections (event_id)"
+    ))
+
+
+@migration(3, "Add indexes for the view query patterns")
+def _add_query_indexes():
+    create_missing_indexes("inspections", "alerts")
+    if db.session.get_bind().dialect.name == "sqlite":
+        # SQLite's LIKE is case-insensitive, so the plate-prefix search can
+        # only use an index built with the NOCASE collation
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_inspections_plate_nocase"
+            " ON inspections (plate COLLATE NOCASE)"
+        ))
+
+
+@migration(4, "Backfill normalized defects and per-defect counters")
+def _backfill_defects():
+    import defects
+    import stats
+    defects.backfill()
+    stats.rebuild()
+
+
+@migration(5, "Add alerts.version for optimistic concurrency")
+def _add_alert_version():
+    add_column("alerts", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+@migration(6, "Build the inspection trend rollups from existing rows")
+def _build_rollups():
+    import analytics
+    analytics.backfill()
+
+
+@migration(7, "Build the plate search index from existing rows")
+def _build_plate_index():
+    import plates
+    create_missing_indexes("inspections")
+    plates.rebuild()
+
+
+@migration(8, "Hash the plaintext passwords")
+def _hash_passwords():
+    import auth
+    add_column("users", "password_hash", "VARCHAR(256)")
+    auth.hash_plaintext_passwords()
+
+
+# -------------------------------------------------------------------------
+# RUNNER
+# -------------------------------------------------------------------------
+
+def applied_versions():
+    """Return the set of migration versions already applied."""
+    rows = db.session.execute(text("SELECT version FROM schema_migrations"))
+    return {row[0] for row in rows}
+
+
+def upgrade():
+    """
+    Create any missing tables, then run every pending upgrade step in order.
+    Returns the list of versions that were applied.
+    """
+    db.create_all()
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY,"
+        " description VARCHAR(200) NOT NULL)"
+    ))
+    db.session.commit()
+
+    done = applied_versions()
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        fn()
+        db.session.execute(
+            text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+            {"v": version, "d": description},
+        )
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+
+@click.command("upgrade-db")
+def upgrade_command():
+    """Create missing tables and apply pending schema upgrades."""
+    applied = upgrade()
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo("Database is up to date.")
+
+
+def init_app(app):
+    """
+    Register 'flask upgrade-db' and, unless disabled, upgrade the database now.
+    """
+    app.cli.add_command(upgrade_command)
+    if app.config.get("ATIS_AUTO_MIGRATE", True):
+        with app.app_context():
+            upgrade()
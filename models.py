@@ -2,29 +2,85 @@
 models.py - Database Models
 
 This file defines the structure of our database using SQLAlchemy.
-We have three main tables:
-1. User - for login/authentication
+We have these tables:
+1. User - for login/authentication (passwords are hashed, see auth.py)
 2. Inspection - stores data about each tire inspection (plate, status, etc.)
 3. Alert - tracks issues that need attention
+4. StatCounter - pre-computed dashboard counts (see stats.py)
+5. DefectType + inspection_defects - the defects of each inspection as rows,
+   so they can be indexed, filtered and counted (see defects.py)
+6. ReportJob - background report exports (see reports.py)
+7. InspectionRollup - inspection counts per minute/hour/day for trend charts
+   (see analytics.py)
+8. Artifact + InspectionArtifact - images and sensor files of an inspection,
+   stored on disk by content hash (see artifacts.py)
+9. ArchiveMonth - which months of old inspections were moved to archive
+   files (see archive.py)
+10. Job - the background job queue (see jobs.py)
+11. Plate + plate_trigrams - the plate search index (see plates.py)
 """
 
+import json
+
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
 from datetime import datetime
 
+# Name of the optional read-replica engine in SQLALCHEMY_BINDS (see database.py)
+READER_BIND = "reader"
+
+
+class RoutingSession(Session):
+    """
+    The session used by db.session. Inside a view marked with
+    @database.read_replica, plain SELECTs go to the read replica (if one is
+    configured). Everything else - INSERT/UPDATE/DELETE, flushes,
+    session.connection() and all code outside such views - uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and isinstance(clause, Select)
+            and not self._flushing
+            and has_request_context()
+            and g.get("atis_read_replica")
+        ):
+            reader = self._db.engines.get(READER_BIND)
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
 # Initialize the database object
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def split_defects(raw):
+    """
+    Convert a comma-separated defects string into a list of names,
+    e.g. "Tread Wear, Bulge" -> ["Tread Wear", "Bulge"].
+    """
+    if not raw:
+        return []
+    # Split string by comma and remove whitespace
+    return [d.strip() for d in raw.split(",") if d.strip()]
 
 
 class User(db.Model):
     """
     User Table
-    Stores login credentials and roles.
+    Stores login credentials and roles. Passwords are stored as salted
+    hashes (see auth.py); 'password' only held plain text in old databases.
     """
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(128), nullable=False)  # Storing plain text for demo (use hash in prod!)
+    password = db.Column(db.String(128), nullable=False, default="")  # Old plaintext password, emptied once hashed
+    password_hash = db.Column(db.String(256), nullable=True)           # e.g. "scrypt:32768:8:1$<salt>$<hash>"
     role = db.Column(db.String(20), nullable=False, default="Operator")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -39,28 +95,73 @@ class Inspection(db.Model):
     """
     __tablename__ = "inspections"
 
+    # Indexes matching how the views query this table: newest-first lists,
+    # optionally filtered by status, location or camera. The trailing id
+    # column makes the (timestamp, id) cursor pagination an index range scan.
+    __table_args__ = (
+        db.Index("ix_inspections_timestamp_id", "timestamp", "id"),
+        db.Index("ix_inspections_status_timestamp", "status", "timestamp", "id"),
+        db.Index("ix_inspections_location_timestamp", "location", "timestamp", "id"),
+        db.Index("ix_inspections_camera_timestamp", "camera", "timestamp", "id"),
+        db.Index("ix_inspections_plate_timestamp", "plate", "timestamp", "id"),
+    )
+
+    # Columns with active_history=True: the session hooks (stats.py,
+    # analytics.py, plates.py) need the value before a change, so it is loaded
+    # when the attribute is set even if a commit expired the object
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    plate = db.Column(db.String(20), nullable=True)          # License plate (can be null if not readable)
-    location = db.Column(db.String(200), nullable=False)     # e.g. "Main Gate Entrance"
-    camera = db.Column(db.String(20), nullable=True)         # Camera ID
-    status = db.Column(db.String(10), nullable=False)        # "safe" or "unsafe"
+    timestamp = db.mapped_column(db.DateTime, nullable=False, default=datetime.utcnow, active_history=True)
+    plate = db.mapped_column(db.String(20), nullable=True, active_history=True)        # License plate (can be null if not readable)
+    location = db.mapped_column(db.String(200), nullable=False, active_history=True)   # e.g. "Main Gate Entrance"
+    camera = db.mapped_column(db.String(20), nullable=True, active_history=True)       # Camera ID
+    status = db.mapped_column(db.String(10), nullable=False, active_history=True)      # "safe" or "unsafe"
     confidence = db.Column(db.Integer, nullable=False)       # AI confidence score (0-100)
-    defects = db.Column(db.String(300), nullable=True)       # String list of defects, e.g. "Tread,Sidewall"
+    defects = db.mapped_column(db.String(300), nullable=True, active_history=True)     # String list of defects, e.g. "Tread,Sidewall"
+    event_id = db.Column(db.String(64), nullable=True, unique=True, index=True)  # Client-supplied ID (makes ingestion retries safe)
 
     # Relationship: One inspection can have many alerts
     alerts = db.relationship("Alert", backref="inspection", lazy=True)
 
+    # Relationship: the normalized defect rows (kept in sync by defects.py).
+    # Read-only here; use the 'defects' string to change an inspection's defects.
+    defect_types = db.relationship(
+        "DefectType",
+        secondary="inspection_defects",
+        order_by="inspection_defects.c.position",
+        viewonly=True,
+        lazy=True,
+    )
+
     @property
     def defect_list(self):
         """
-        Helper function to convert the comma-separated defects string 
+        Helper function to convert the comma-separated defects string
         into a Python list for easy loop usage in templates.
+
+        The list is parsed once and remembered until 'defects' changes,
+        so templates can call this many times per row for free.
+        """
+        cached = self.__dict__.get("_defect_list_cache")
+        if cached is None or cached[0] != self.defects:
+            cached = (self.defects, split_defects(self.defects))
+            self.__dict__["_defect_list_cache"] = cached
+        return cached[1]
+
+    def to_dict(self):
+        """
+        Convert the inspection into a plain dictionary for JSON responses.
         """
-        if not self.defects:
-            return []
-        # Split string by comma and remove whitespace
-        return [d.strip() for d in self.defects.split(",") if d.strip()]
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp.isoformat(),
+            "plate": self.plate,
+            "location": self.location,
+            "camera": self.camera,
+            "status": self.status,
+            "confidence": self.confidence,
+            "defects": self.defect_list,
+            "event_id": self.event_id,
+        }
 
     def __repr__(self):
         return f"<Inspection {self.id} {self.plate or '—'} {self.status}>"
@@ -73,17 +174,312 @@ class Alert(db.Model):
     """
     __tablename__ = "alerts"
 
+    # Indexes for newest-first alert lists, the pending badge (status) and
+    # the per-inspection alert list on the detail page.
+    __table_args__ = (
+        db.Index("ix_alerts_created_at", "created_at"),
+        db.Index("ix_alerts_status_created_at", "status", "created_at"),
+        db.Index("ix_alerts_inspection_id_created_at", "inspection_id", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     
     # Link to the Inspection table
     inspection_id = db.Column(db.Integer, db.ForeignKey("inspections.id"), nullable=False)
     
     # Status of the alert workflow: pending -> acknowledged -> resolved
-    status = db.Column(db.String(20), nullable=False, default="pending")
+    # (or escalated on the way; see workflow.TRANSITIONS). The old value is
+    # loaded before a change for the counters (stats.py) and the
+    # "alert.updated" event's previous_status (events.py).
+    status = db.mapped_column(db.String(20), nullable=False, default="pending", active_history=True)
     
     # Optional notes added by the operator
     response = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Bumped on every change. An update only succeeds if the version is still
+    # the one the operator saw, so nobody silently overwrites someone else
+    # (see workflow.py). ORM updates check it automatically.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    def to_dict(self):
+        """
+        Convert the alert into a plain dictionary for JSON responses.
+        """
+        return {
+            "id": self.id,
+            "inspection_id": self.inspection_id,
+            "status": self.status,
+            "response": self.response,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "version": self.version,
+        }
+
     def __repr__(self):
         return f"<Alert {self.id} {self.status}>"
+
+
+# Link table: which defect types each inspection has, in display order
+inspection_defects = db.Table(
+    "inspection_defects",
+    db.Column("inspection_id", db.Integer, db.ForeignKey("inspections.id", ondelete="CASCADE"), primary_key=True),
+    db.Column("defect_type_id", db.Integer, db.ForeignKey("defect_types.id"), primary_key=True),
+    db.Column("position", db.Integer, nullable=False, default=0),
+    # Lets "all inspections with a Bulge" start from the defect side
+    db.Index("ix_inspection_defects_type_inspection", "defect_type_id", "inspection_id"),
+)
+
+
+class DefectType(db.Model):
+    """
+    Defect Type Table
+    One row per distinct defect name (e.g. "Bulge"), so each name is stored once
+    and inspections point to it through the inspection_defects table.
+    """
+    __tablename__ = "defect_types"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<DefectType {self.name}>"
+
+
+class StatCounter(db.Model):
+    """
+    Stat Counter Table
+    Pre-computed counts for the dashboard (see stats.py).
+    Each row is one counter, e.g. kind="inspection_status", key="unsafe".
+    The counters are kept up to date whenever inspections or alerts change,
+    so the dashboard never has to COUNT(*) the big tables.
+    """
+    __tablename__ = "stat_counters"
+
+    kind = db.Column(db.String(30), primary_key=True)             # e.g. "inspection_location"
+    key = db.Column(db.String(200), primary_key=True, default="")  # e.g. "Highway 101 - Toll Plaza"
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatCounter {self.kind}:{self.key}={self.value}>"
+
+
+class InspectionRollup(db.Model):
+    """
+    Inspection Rollup Table
+    Inspection counts per time bucket (see analytics.py), so trend charts
+    never scan the inspections table. One row per grain ("minute", "hour",
+    "day"), bucket start, location, camera, status and defect.
+    defect="" counts inspections; a defect name counts inspections with that defect.
+    """
+    __tablename__ = "inspection_rollups"
+
+    grain = db.Column(db.String(6), primary_key=True)                # "minute", "hour" or "day"
+    bucket = db.Column(db.DateTime, primary_key=True)                # Start of the bucket
+    location = db.Column(db.String(200), primary_key=True)
+    camera = db.Column(db.String(20), primary_key=True, default="")  # "" when there is no camera
+    status = db.Column(db.String(10), primary_key=True)              # "safe" or "unsafe"
+    defect = db.Column(db.String(100), primary_key=True, default="")
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<InspectionRollup {self.grain} {self.bucket} {self.location} {self.status} {self.defect}={self.count}>"
+
+
+class Artifact(db.Model):
+    """
+    Artifact Table
+    One row per stored file (tire image, sensor trace...). The file itself
+    lives on disk under its SHA-256 hash (see artifacts.py), so the same
+    content uploaded twice is stored once.
+    """
+    __tablename__ = "artifacts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)                  # Bytes
+    content_type = db.Column(db.String(100), nullable=False)         # e.g. "image/jpeg"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Last upload or link
+
+    def to_dict(self):
+        return {
+            "sha256": self.sha256,
+            "size": self.size,
+            "content_type": self.content_type,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class InspectionArtifact(db.Model):
+    """
+    Inspection Artifact Table
+    Links an inspection to its files, with what the file is ("image",
+    "sensor"...) and the name it was uploaded with.
+    """
+    __tablename__ = "inspection_artifacts"
+    __table_args__ = (
+        db.UniqueConstraint("inspection_id", "artifact_id", name="uq_inspection_artifacts"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    inspection_id = db.Column(db.Integer, db.ForeignKey("inspections.id", ondelete="CASCADE"), nullable=False, index=True)
+    artifact_id = db.Column(db.Integer, db.ForeignKey("artifacts.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False, default="image")   # "image", "sensor" or "other"
+    filename = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    artifact = db.relationship("Artifact", lazy="joined")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "inspection_id": self.inspection_id,
+            "kind": self.kind,
+            "filename": self.filename,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            **self.artifact.to_dict(),
+        }
+
+
+class ArchiveMonth(db.Model):
+    """
+    Archive Month Table
+    One row per month of inspections moved out of the main tables into an
+    archive file (see archive.py). The ranges tell the query layer which
+    archive files a search has to open.
+    """
+    __tablename__ = "archive_months"
+
+    month = db.Column(db.String(7), primary_key=True)             # e.g. "2025-03"
+    inspections = db.Column(db.Integer, nullable=False, default=0)
+    alerts = db.Column(db.Integer, nullable=False, default=0)
+    first_timestamp = db.Column(db.DateTime, nullable=False)      # Oldest archived inspection
+    last_timestamp = db.Column(db.DateTime, nullable=False)       # Newest archived inspection
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ArchiveMonth {self.month} {self.inspections}>"
+
+
+class Plate(db.Model):
+    """
+    Plate Table
+    One row per spelling of a license plate as the cameras read it, e.g.
+    "hST-1181" and "HST-1181" are two rows with the same search key
+    (see plates.py). Archived inspections stay counted.
+    """
+    __tablename__ = "plates"
+
+    id = db.Column(db.Integer, primary_key=True)
+    plate = db.Column(db.String(20), unique=True, nullable=False)       # Exactly as stored on the inspections
+    key = db.Column(db.String(20), nullable=False, index=True)         # Normalized for search, e.g. "hST-1181" -> "H5T1181"
+    inspections = db.Column(db.Integer, nullable=False, default=0)
+    last_seen = db.Column(db.DateTime, nullable=True)                  # Newest inspection with this spelling
+
+    def __repr__(self):
+        return f"<Plate {self.plate} ({self.key})>"
+
+
+# The three-character pieces of every search key, so a search can find the
+# keys that share most pieces with the query (fuzzy matching with an index)
+plate_trigrams = db.Table(
+    "plate_trigrams",
+    db.Column("gram", db.String(3), primary_key=True),
+    db.Column("key", db.String(20), primary_key=True),
+)
+
+
+class Job(db.Model):
+    """
+    Job Table
+    The persistent background job queue (see jobs.py). Workers take the
+    queued job with the lowest priority number whose run_at has come.
+    """
+    __tablename__ = "jobs"
+
+    # The index the workers use to find the next job
+    __table_args__ = (
+        db.Index("ix_jobs_status_priority_run_at", "status", "priority", "run_at", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)                 # e.g. "ingest.side_effects"
+    payload = db.Column(db.Text, nullable=False, default="{}")      # JSON arguments of the handler
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued -> running -> done / failed
+    priority = db.Column(db.Integer, nullable=False, default=5)     # Lower runs first
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not before (retry backoff)
+    locked_by = db.Column(db.String(100), nullable=True)            # Worker running it
+    locked_at = db.Column(db.DateTime, nullable=True)               # Last heartbeat of that worker
+    result = db.Column(db.Text, nullable=True)                      # JSON returned by the handler
+    error = db.Column(db.String(500), nullable=True)                # Last error
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        """
+        Convert the job into a plain dictionary for JSON responses.
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_at": self.run_at.isoformat() if self.run_at else None,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
+
+
+class ReportJob(db.Model):
+    """
+    Report Job Table
+    One row per background export. The file is written to disk by a worker
+    and downloaded later (see reports.py).
+    """
+    __tablename__ = "report_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset = db.Column(db.String(20), nullable=False)           # "inspections" or "alerts"
+    format = db.Column(db.String(10), nullable=False)            # "csv", "jsonl" or "xlsx"
+    filters = db.Column(db.Text, nullable=False, default="{}")   # JSON of the query-string filters
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued -> running -> done / failed
+    rows = db.Column(db.Integer, nullable=True)                  # Rows written so far
+    path = db.Column(db.String(300), nullable=True)              # Finished file on disk
+    error = db.Column(db.String(500), nullable=True)
+    created_by = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        """
+        Convert the job into a plain dictionary for JSON responses.
+        """
+        return {
+            "id": self.id,
+            "dataset": self.dataset,
+            "format": self.format,
+            "filters": json.loads(self.filters or "{}"),
+            "status": self.status,
+            "rows": self.rows,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<ReportJob {self.id} {self.status}>"
@@ -0,0 +1,426 @@
+"""
+plates.py - Plate Search Index
+
+License plates come from OCR, so one vehicle shows up under several
+spellings: "hST-1181", "HST-1181", "HST 1181", or with 0/O and 8/B mixed up.
+A LIKE on the inspections table only finds one exact spelling, and a
+"contains" or "looks like" search cannot use an index at all.
+
+This file keeps a small search index next to the inspections:
+
+- plates          one row per spelling, with its search key, the number of
+                  inspections that have it and when it was last seen
+- plate_trigrams  the three-character pieces of every search key
+                  ("^H5", "H5T", "5T1", ..., "81$")
+
+normalize() turns a plate into its search key: upper case, letters and digits
+only, and the characters OCR confuses folded onto one of them (O/Q/D -> 0,
+I/L -> 1, Z -> 2, S -> 5, G -> 6, B -> 8). A search normalizes the query the
+same way, asks the trigram table for the keys sharing the most pieces with it
+(one indexed query), ranks them by similarity and returns their spellings.
+The History plate filter uses the same keys, so "hst1181" finds "HST-1181".
+
+ORM writes are picked up by a session hook; bulk writers (ingest.py) call
+record() themselves. Archived inspections stay in the index (see archive.py).
+Existing rows are indexed by migration 7, and 'flask plates rebuild'
+recounts everything from the inspections and the archive files.
+"""
+
+import math
+from collections import Counter, defaultdict
+
+import click
+from flask import current_app
+from sqlalchemy import case, delete, event, exists, func, insert, inspect as sa_inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import cache
+import instrumentation
+from models import db, Inspection, Plate, plate_trigrams
+
+# Characters OCR mixes up, each folded onto the digit it is confused with
+_CONFUSIONS = str.maketrans("OQDILZSGB", "000112568")
+
+# Readings that mean "no plate" (after removing spaces and punctuation)
+MISSING = {"UNKNOWN", "NONE", "NULL", "NA", "NOPLATE"}
+
+# Longest search key (the length of the plate column)
+MAX_KEY_LENGTH = 20
+
+# Keys taken from the trigram index before ranking them
+CANDIDATES = 200
+
+# A key must share at least this fraction of the query's trigrams
+MIN_OVERLAP = 0.4
+
+# Most spellings the History plate filter expands a prefix to
+MAX_SPELLINGS = 500
+
+# Results of /api/plates/search
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Rows handled per statement when building the index
+CHUNK_SIZE = 500
+
+
+def normalize(plate):
+    """The search key of a plate reading ("hST-1181" -> "H5T1181"), or None."""
+    if not plate:
+        return None
+    text = "".join(ch for ch in str(plate).upper() if ch.isascii() and ch.isalnum())
+    if not text or text in MISSING:
+        return None
+    return text.translate(_CONFUSIONS)[:MAX_KEY_LENGTH]
+
+
+def trigrams(key):
+    """
+    The three-character pieces of a key. "^" and "$" mark the start and end,
+    so a key's first and last characters count as much as the middle ones.
+    """
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(query_key, key):
+    """
+    How much 'key' looks like 'query_key', from 0 to 1: the share of trigrams
+    they have in common, raised for keys that contain the query (the user
+    typed only part of the plate).
+    """
+    if key == query_key:
+        return 1.0
+    a, b = trigrams(query_key), trigrams(key)
+    score = len(a & b) / len(a | b)
+    if query_key in key:
+        partial = 0.5 + 0.4 * len(query_key) / len(key)
+        if key.startswith(query_key):
+            partial += 0.05
+        score = max(score, partial)
+    return round(score, 3)
+
+
+# -------------------------------------------------------------------------
+# WRITING
+# -------------------------------------------------------------------------
+
+def _insert_ignoring_duplicates(connection, table, rows, key_columns):
+    """INSERT rows, skipping those whose key already exists."""
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        connection.execute(insert_fn(table).on_conflict_do_nothing(index_elements=key_columns), rows)
+        return
+    for row in rows:
+        found = connection.execute(
+            select(*key_columns).where(*(column == row[column.name] for column in key_columns))
+        ).first()
+        if found is None:
+            connection.execute(insert(table), [row])
+
+
+def record(connection, readings):
+    """
+    Add inspections to the index. 'readings' is an iterable of
+    (plate, timestamp) pairs; readings without a plate are skipped.
+    Runs on the caller's connection, in its transaction.
+    """
+    counts = Counter()
+    last_seen = {}
+    for plate, timestamp in readings:
+        if normalize(plate) is None:
+            continue
+        counts[plate] += 1
+        if timestamp is not None and (last_seen.get(plate) is None or timestamp > last_seen[plate]):
+            last_seen[plate] = timestamp
+    if not counts:
+        return
+
+    table = Plate.__table__
+    params = [
+        {"plate": plate, "key": normalize(plate), "inspections": count, "last_seen": last_seen.get(plate)}
+        for plate, count in counts.items()
+    ]
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = insert_fn(table)
+        newest = case(
+            (stmt.excluded.last_seen > table.c.last_seen, stmt.excluded.last_seen),
+            else_=func.coalesce(table.c.last_seen, stmt.excluded.last_seen),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.plate],
+            set_={"inspections": table.c.inspections + stmt.excluded.inspections, "last_seen": newest},
+        )
+        connection.execute(stmt, params)
+    else:
+        # Other databases: update first, insert the spellings not seen before
+        for p in params:
+            result = connection.execute(
+                table.update()
+                .where(table.c.plate == p["plate"])
+                .values(
+                    inspections=table.c.inspections + p["inspections"],
+                    last_seen=case(
+                        (table.c.last_seen < p["last_seen"], p["last_seen"]),
+                        else_=func.coalesce(table.c.last_seen, p["last_seen"]),
+                    ),
+                )
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(**p))
+
+    grams = [
+        {"gram": gram, "key": key}
+        for key in {p["key"] for p in params}
+        for gram in sorted(trigrams(key))
+    ]
+    for start in range(0, len(grams), CHUNK_SIZE):
+        _insert_ignoring_duplicates(
+            connection, plate_trigrams, grams[start:start + CHUNK_SIZE],
+            [plate_trigrams.c.gram, plate_trigrams.c.key],
+        )
+
+
+def forget(connection, plates):
+    """
+    Take inspections out of the index (one plate string per deleted
+    inspection). Spellings left without inspections are removed, and so are
+    the trigrams of keys that have no spelling left.
+    """
+    counts = Counter(p for p in plates if normalize(p) is not None)
+    if not counts:
+        return
+
+    table = Plate.__table__
+    for plate, count in counts.items():
+        connection.execute(
+            table.update().where(table.c.plate == plate).values(inspections=table.c.inspections - count)
+        )
+    connection.execute(delete(table).where(table.c.plate.in_(list(counts)), table.c.inspections <= 0))
+    keys = {normalize(p) for p in counts}
+    connection.execute(
+        delete(plate_trigrams).where(
+            plate_trigrams.c.key.in_(keys),
+            ~exists().where(table.c.key == plate_trigrams.c.key),
+        )
+    )
+
+
+def _sync_session_plates(session, flush_context):
+    """
+    Session hook: after each flush, count new inspections in the index and
+    move changed or deleted ones out of it.
+    """
+    added = []
+    removed = []
+
+    for obj in session.new:
+        if isinstance(obj, Inspection) and obj.plate:
+            added.append((obj.plate, obj.timestamp))
+
+    for obj in session.dirty:
+        if isinstance(obj, Inspection):
+            history = sa_inspect(obj).attrs.plate.history
+            if history.has_changes():
+                removed.extend(history.deleted)
+                added.append((obj.plate, obj.timestamp))
+
+    for obj in session.deleted:
+        if isinstance(obj, Inspection):
+            history = sa_inspect(obj).attrs.plate.history
+            removed.extend(history.deleted or [obj.plate])
+
+    if not (added or removed):
+        return
+
+    connection = session.connection()
+    if removed:
+        forget(connection, [p for p in removed if p])
+    if added:
+        record(connection, added)
+
+
+# -------------------------------------------------------------------------
+# REBUILD
+# -------------------------------------------------------------------------
+
+def count_plates(session):
+    """(inspections, newest timestamp) per spelling in one database (main or archive)."""
+    rows = (
+        session.query(Inspection.plate, func.count(), func.max(Inspection.timestamp))
+        .filter(Inspection.plate.isnot(None))
+        .group_by(Inspection.plate)
+    )
+    return {plate: (count, newest) for plate, count, newest in rows}
+
+
+def rebuild():
+    """
+    Throw the index away and build it again from the inspections, including
+    the archived months. Returns the number of spellings indexed.
+    """
+    import archive  # archive.py imports queries.py, which imports this file
+
+    totals = count_plates(db.session)
+    for archive_session in archive.archive_sessions(current_app._get_current_object()):
+        for plate, (count, newest) in count_plates(archive_session).items():
+            old_count, old_newest = totals.get(plate, (0, None))
+            totals[plate] = (old_count + count, max(filter(None, (old_newest, newest)), default=None))
+
+    connection = db.session.connection()
+    connection.execute(delete(plate_trigrams))
+    connection.execute(delete(Plate.__table__))
+
+    rows = [
+        {"plate": plate, "key": normalize(plate), "inspections": count, "last_seen": newest}
+        for plate, (count, newest) in totals.items()
+        if normalize(plate) is not None
+    ]
+    for start in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(insert(Plate.__table__), rows[start:start + CHUNK_SIZE])
+
+    grams = [
+        {"gram": gram, "key": key}
+        for key in {row["key"] for row in rows}
+        for gram in sorted(trigrams(key))
+    ]
+    for start in range(0, len(grams), CHUNK_SIZE):
+        connection.execute(insert(plate_trigrams), grams[start:start + CHUNK_SIZE])
+
+    cache.mark_changed(db.session, "inspections")
+    db.session.commit()
+    return len(rows)
+
+
+# -------------------------------------------------------------------------
+# SEARCHING
+# -------------------------------------------------------------------------
+
+def _key_starts_with(key):
+    """
+    SQL condition: Plate.key starts with 'key'. Written as a range (keys are
+    letters and digits, all sorting before "~") so it uses the index where a
+    LIKE would not.
+    """
+    return (Plate.key >= key) & (Plate.key < key + "~")
+
+
+def candidate_query(query_key):
+    """
+    The query for the keys worth ranking for a query key (also checked by
+    'flask check-query-plans').
+    """
+    if len(query_key) < 3:
+        # Too short for trigrams: the most seen keys starting with it
+        return (
+            db.session.query(Plate.key)
+            .filter(_key_starts_with(query_key))
+            .group_by(Plate.key)
+            .order_by(func.sum(Plate.inspections).desc())
+            .limit(CANDIDATES)
+        )
+
+    grams = trigrams(query_key)
+    shared = func.count().label("shared")
+    return (
+        db.session.query(plate_trigrams.c.key)
+        .filter(plate_trigrams.c.gram.in_(grams))
+        .group_by(plate_trigrams.c.key)
+        .having(shared >= max(1, math.ceil(len(grams) * MIN_OVERLAP)))
+        .order_by(shared.desc())
+        .limit(CANDIDATES)
+    )
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    """
+    The plates that look most like 'query', best first. Each match is one
+    search key with all its spellings (most frequent first), the number of
+    inspections and when it was last seen. Two queries, whatever the table size.
+    """
+    query_key = normalize(query)
+    if query_key is None:
+        return []
+
+    keys = [key for key, in candidate_query(query_key)]
+    if not keys:
+        return []
+
+    spellings = defaultdict(list)
+    for plate in Plate.query.filter(Plate.key.in_(keys)):
+        spellings[plate.key].append(plate)
+
+    matches = []
+    for key, plates in spellings.items():
+        plates.sort(key=lambda p: (-p.inspections, p.plate))
+        seen = [p.last_seen for p in plates if p.last_seen]
+        matches.append({
+            "plate": plates[0].plate,
+            "key": key,
+            "spellings": [p.plate for p in plates],
+            "inspections": sum(p.inspections for p in plates),
+            "last_seen": max(seen).isoformat() if seen else None,
+            "score": similarity(query_key, key),
+        })
+
+    matches.sort(key=lambda m: (-m["score"], -m["inspections"], m["key"]))
+    return matches[:limit]
+
+
+def spellings_for_prefix(prefix):
+    """
+    Every stored spelling whose search key starts with the key of 'prefix',
+    so the History plate filter also finds "HST-1181" for "hst1181" or
+    "H5T-1181". Empty when there is nothing to add or more than
+    MAX_SPELLINGS spellings match (the filter then stays a plain prefix match).
+    """
+    key = normalize(prefix)
+    if key is None:
+        return []
+
+    def build():
+        # One extra query on a cache miss, on top of the view's own budget
+        instrumentation.allow_queries(1)
+        found = db.session.execute(
+            select(Plate.plate).where(_key_starts_with(key)).order_by(Plate.plate).limit(MAX_SPELLINGS + 1)
+        ).scalars().all()
+        return found if len(found) <= MAX_SPELLINGS else []
+
+    return cache.cached_value("plate_spellings", ("inspections",), build, params=key)
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+plates_cli = click.Group("plates", help="Maintain the plate search index.")
+
+
+@plates_cli.command("rebuild")
+def rebuild_command():
+    """Re-index every plate from the inspections and the archive files."""
+    indexed = rebuild()
+    click.echo(f"Indexed {indexed} plate spellings.")
+
+
+@plates_cli.command("search")
+@click.argument("query")
+@click.option("--limit", default=DEFAULT_LIMIT, show_default=True, help="Number of matches to show.")
+def search_command(query, limit):
+    """Show the plates matching QUERY, best first."""
+    for match in search(query, limit=limit):
+        click.echo(f"{match['score']:.3f}  {match['plate']:<20} {match['inspections']:>7}  "
+                   f"{', '.join(match['spellings'][1:])}")
+
+
+def init_app(app):
+    """
+    Register the session hook and the 'flask plates' commands.
+    """
+    if not event.contains(db.session, "after_flush", _sync_session_plates):
+        event.listen(db.session, "after_flush", _sync_session_plates)
+    app.cli.add_command(plates_cli)
@@ -0,0 +1,307 @@
+"""
+queries.py - Reusable Query Helpers
+
+This file builds the queries used by the views: the filtered, paginated
+inspection queries for the History page and the JSON API, and the alert and
+recent-inspection lists. Keeping them here also lets 'flask check-query-plans'
+(database.py) check that every one of them is served by an index.
+
+Instead of OFFSET paging we use "keyset" (cursor) pagination on (timestamp, id):
+every page remembers the last row it showed, and the next page starts right after
+that row. The database can jump straight to that spot with an index, so page 1000
+costs the same as page 1 no matter how big the table gets.
+"""
+
+import base64
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import (
+    contains_eager, joinedload, lazyload, raiseload, selectinload, subqueryload,
+)
+
+from defects import has_defect
+from models import Inspection, Alert
+from plates import spellings_for_prefix
+
+# Page size limits for the History page and the API
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Inspection statuses we allow filtering on
+INSPECTION_STATUSES = ("safe", "unsafe")
+
+
+# How each relationship is loaded by the list views. Override any entry with
+# app.config["ATIS_LOADER_STRATEGIES"] = {"Alert.inspection": "selectin", ...}
+DEFAULT_LOADER_STRATEGIES = {
+    "Alert.inspection": "contains_eager",  # the alert views already JOIN inspections
+    "Inspection.alerts": "selectin",
+}
+
+_LOADERS = {
+    "contains_eager": contains_eager,
+    "joined": joinedload,
+    "selectin": selectinload,
+    "subquery": subqueryload,
+    "lazy": lazyload,
+    "raise": raiseload,
+}
+
+
+# -------------------------------------------------------------------------
+# RELATIONSHIP LOADING
+# -------------------------------------------------------------------------
+
+def loader_strategy(name):
+    """
+    Return the configured loading strategy name for a relationship,
+    e.g. loader_strategy("Alert.inspection") -> "contains_eager".
+    """
+    configured = current_app.config.get("ATIS_LOADER_STRATEGIES", {})
+    strategy = configured.get(name, DEFAULT_LOADER_STRATEGIES.get(name, "lazy"))
+    if strategy not in _LOADERS:
+        raise ValueError(f"Unknown loader strategy '{strategy}' for {name}.")
+    return strategy
+
+
+def load_option(attribute):
+    """
+    Build the query option that loads a relationship with its configured
+    strategy, e.g. query.options(load_option(Alert.inspection)).
+
+    "contains_eager" only works when the query already JOINs the related
+    table; use one of the other strategies for queries that do not.
+    """
+    name = f"{attribute.class_.__name__}.{attribute.key}"
+    return _LOADERS[loader_strategy(name)](attribute)
+
+
+# -------------------------------------------------------------------------
+# VIEW QUERIES
+# -------------------------------------------------------------------------
+
+def recent_inspections_query(limit=10):
+    """The newest inspections, for the dashboard table."""
+    return (
+        Inspection.query
+        .order_by(Inspection.timestamp.desc(), Inspection.id.desc())
+        .limit(limit)
+    )
+
+
+def alerts_query():
+    """
+    Alerts newest first, with their inspection loaded by the same JOIN
+    (or by the configured loader strategy), so templates can use
+    a.inspection without one extra SELECT per row.
+    """
+    return (
+        Alert.query
+        .join(Inspection)
+        .options(load_option(Alert.inspection))
+        .order_by(Alert.created_at.desc())
+    )
+
+
+def inspection_alerts_query(inspection_id):
+    """All alerts raised for one inspection, newest first."""
+    return (
+        Alert.query
+        .filter(Alert.inspection_id == inspection_id)
+        .order_by(Alert.created_at.desc())
+    )
+
+
+# -------------------------------------------------------------------------
+# FILTERS
+# -------------------------------------------------------------------------
+
+def parse_inspection_filters(args, strict=True):
+    """
+    Read the filter fields from a request's query string.
+
+    Supported fields: plate (prefix, OCR-tolerant), status, location, camera, defect
+    (defect type name), date_from and date_to (YYYY-MM-DD, both inclusive).
+
+    With strict=True a bad value raises ValueError (used by the API).
+    With strict=False bad values are simply dropped (used by the HTML page).
+    """
+    filters = {}
+
+    for field in ("plate", "location", "camera", "defect"):
+        value = (args.get(field) or "").strip()
+        if value:
+            filters[field] = value
+
+    status = (args.get("status") or "").strip().lower()
+    if status and status != "all":
+        if status in INSPECTION_STATUSES:
+            filters["status"] = status
+        elif strict:
+            raise ValueError(f"Unknown status '{status}'.")
+
+    for field in ("date_from", "date_to"):
+        value = (args.get(field) or "").strip()
+        if not value:
+            continue
+        try:
+            filters[field] = datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            if strict:
+                raise ValueError(f"{field} must be a date in YYYY-MM-DD format.")
+
+    return filters
+
+
+def filters_to_args(filters):
+    """
+    Turn a filters dict back into query-string values (for links and cursors).
+    """
+    args = {}
+    for key, value in filters.items():
+        if isinstance(value, datetime):
+            value = value.strftime("%Y-%m-%d")
+        args[key] = value
+    return args
+
+
+def _escape_like(value):
+    """Escape the LIKE wildcards so user input is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def apply_inspection_filters(query, filters):
+    """
+    Add WHERE clauses for every filter in the dict to an Inspection query.
+    """
+    if "plate" in filters:
+        # The typed prefix, or any spelling of a plate that normalizes to the
+        # same search key prefix ("hst1181" also finds "HST-1181", see plates.py)
+        condition = Inspection.plate.like(_escape_like(filters["plate"]) + "%", escape="\\")
+        spellings = spellings_for_prefix(filters["plate"])
+        if spellings:
+            condition = or_(condition, Inspection.plate.in_(spellings))
+        query = query.filter(condition)
+    if "status" in filters:
+        query = query.filter(Inspection.status == filters["status"])
+    if "location" in filters:
+        query = query.filter(Inspection.location == filters["location"])
+    if "camera" in filters:
+        query = query.filter(Inspection.camera == filters["camera"])
+    if "defect" in filters:
+        query = query.filter(has_defect(filters["defect"]))
+    if "date_from" in filters:
+        query = query.filter(Inspection.timestamp >= filters["date_from"])
+    if "date_to" in filters:
+        # date_to is inclusive, so stop at midnight of the following day
+        query = query.filter(Inspection.timestamp < filters["date_to"] + timedelta(days=1))
+    return query
+
+
+# -------------------------------------------------------------------------
+# CURSORS
+# -------------------------------------------------------------------------
+
+def encode_cursor(timestamp, row_id):
+    """
+    Pack the (timestamp, id) of the last row on a page into an opaque token.
+    """
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Unpack a cursor token back into (timestamp, id).
+    Raises ValueError if the token was tampered with or is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        stamp, row_id = raw.split("|")
+        timestamp, row_id = datetime.fromisoformat(stamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+    # encode_cursor() only writes naive timestamps and ids that fit a 64-bit
+    # column (a bigger one would make the database driver fail)
+    if timestamp.tzinfo is not None or not 0 <= row_id < 2 ** 63:
+        raise ValueError("Invalid cursor.")
+    return timestamp, row_id
+
+
+def parse_page_size(value):
+    """Clamp the requested page size to 1..MAX_PAGE_SIZE."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+# -------------------------------------------------------------------------
+# PAGINATION
+# -------------------------------------------------------------------------
+
+def build_page_query(filters, cursor=None, limit=DEFAULT_PAGE_SIZE, query=None):
+    """
+    Build (but do not run) the query for one page of inspections.
+    See paginate_inspections().
+    """
+    if query is None:
+        query = Inspection.query
+    query = apply_inspection_filters(query, filters)
+
+    if cursor:
+        last_ts, last_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                Inspection.timestamp < last_ts,
+                and_(Inspection.timestamp == last_ts, Inspection.id < last_id),
+            )
+        )
+
+    return (
+        query
+        .order_by(Inspection.timestamp.desc(), Inspection.id.desc())
+        .limit(limit + 1)
+    )
+
+
+def paginate_inspections(filters, cursor=None, limit=DEFAULT_PAGE_SIZE, query=None):
+    """
+    Fetch one page of inspections, newest first.
+
+    Returns (rows, next_cursor). next_cursor is None on the last page.
+    We ask for one extra row so we know whether another page exists
+    without running a separate COUNT query.
+    """
+    rows = build_page_query(filters, cursor=cursor, limit=limit, query=query).all()
+    return split_page(rows, limit)
+
+
+def split_page(rows, limit):
+    """
+    Cut the limit+1 rows fetched for a page down to the page itself.
+    Returns (rows, next_cursor).
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return rows, next_cursor
+
+
+def iter_inspection_pages(filters, cursor=None, limit=MAX_PAGE_SIZE):
+    """
+    Generator that walks every matching page in order.
+    Only one page is held in memory at a time.
+    """
+    while True:
+        rows, cursor = paginate_inspections(filters, cursor=cursor, limit=limit)
+        if rows:
+            yield rows, cursor
+        if not cursor:
+            return
@@ -0,0 +1,399 @@
+"""
+reports.py - Streaming Report Exports
+
+Auditors need months of inspection and alert history. Loading all of that
+into memory (or into a template) does not scale, so exports are streamed:
+
+- Rows are read with a server-side cursor (yield_per), a chunk at a time.
+- Each chunk is turned into CSV or JSON-lines text and sent straight to the
+  client through a generator-based Flask response.
+
+Memory use therefore stays flat whether the report has 100 rows or 10 million.
+
+Long exports (and XLSX, which is a zip file and must be written to disk)
+can run as a background job instead (a low-priority job, see jobs.py): the
+job writes the file under instance/reports/ and the user downloads it when
+it is done.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from flask import current_app
+from sqlalchemy import select
+
+import archive
+import jobs
+from models import db, Alert, Inspection, ReportJob
+from queries import apply_inspection_filters, parse_inspection_filters
+
+# Rows fetched from the database per round trip
+FETCH_SIZE = 1000
+
+# Rows encoded per chunk sent to the client
+CHUNK_ROWS = 500
+
+DATASETS = ("inspections", "alerts")
+STREAM_FORMATS = ("csv", "jsonl")
+JOB_FORMATS = ("csv", "jsonl", "xlsx")
+ALERT_STATUSES = ("pending", "acknowledged", "resolved", "escalated")
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Columns of each dataset, in export order
+COLUMNS = {
+    "inspections": [
+        ("id", Inspection.id),
+        ("timestamp", Inspection.timestamp),
+        ("plate", Inspection.plate),
+        ("location", Inspection.location),
+        ("camera", Inspection.camera),
+        ("status", Inspection.status),
+        ("confidence", Inspection.confidence),
+        ("defects", Inspection.defects),
+    ],
+    "alerts": [
+        ("alert_id", Alert.id),
+        ("created_at", Alert.created_at),
+        ("alert_status", Alert.status),
+        ("response", Alert.response),
+        ("inspection_id", Inspection.id),
+        ("inspection_time", Inspection.timestamp),
+        ("plate", Inspection.plate),
+        ("location", Inspection.location),
+        ("camera", Inspection.camera),
+        ("defects", Inspection.defects),
+    ],
+}
+
+
+class ReportError(ValueError):
+    """Bad report parameters (unknown dataset, format or filter value)."""
+
+
+# -------------------------------------------------------------------------
+# PARAMETERS
+# -------------------------------------------------------------------------
+
+def parse_report_params(args, formats=STREAM_FORMATS):
+    """
+    Read dataset, format and filters from a query string or form.
+    'status' means the inspection status for the inspections dataset and the
+    alert status for the alerts dataset. Raises ReportError on bad values.
+    """
+    dataset = args.get("dataset", "inspections")
+    if dataset not in DATASETS:
+        raise ReportError(f"dataset must be one of: {', '.join(DATASETS)}.")
+
+    fmt = args.get("format", "csv")
+    if fmt not in formats:
+        raise ReportError(f"format must be one of: {', '.join(formats)}.")
+
+    plain = {k: v for k, v in args.items() if k not in ("dataset", "format", "status")}
+    try:
+        filters = parse_inspection_filters(plain)
+    except ValueError as e:
+        raise ReportError(str(e))
+
+    status = (args.get("status") or "").strip().lower()
+    if status and status != "all":
+        allowed = ALERT_STATUSES if dataset == "alerts" else ("safe", "unsafe")
+        if status not in allowed:
+            raise ReportError(f"Unknown status '{status}'.")
+        filters["status"] = status
+
+    return dataset, fmt, filters
+
+
+def build_select(dataset, filters):
+    """The SELECT statement for a dataset, filtered and in a stable order."""
+    filters = dict(filters)
+    columns = [column for _, column in COLUMNS[dataset]]
+
+    if dataset == "inspections":
+        stmt = select(*columns)
+        stmt = apply_inspection_filters(stmt, filters)
+        return stmt.order_by(Inspection.timestamp, Inspection.id)
+
+    alert_status = filters.pop("status", None)
+    stmt = select(*columns).join(Inspection, Inspection.id == Alert.inspection_id)
+    stmt = apply_inspection_filters(stmt, filters)
+    if alert_status:
+        stmt = stmt.filter(Alert.status == alert_status)
+    return stmt.order_by(Alert.created_at, Alert.id)
+
+
+def _row_order(row):
+    """Sort key of a result row: (timestamp, id), the first two columns of every dataset."""
+    return (row[1] or datetime.min, row[0])
+
+
+def iter_rows(dataset, filters, connection=None):
+    """
+    Yield result rows one at a time, fetched FETCH_SIZE at a time through a
+    server-side cursor, so the full result is never held in memory.
+    Uses the request's session unless a connection is given.
+
+    Archived months inside the date range (see archive.py) are read the
+    same way and merged in order.
+    """
+    stmt = build_select(dataset, filters).execution_options(
+        yield_per=FETCH_SIZE, stream_results=True
+    )
+    yield from archive.iter_merged(
+        current_app._get_current_object(),
+        lambda source: source.execute(stmt),
+        filters,
+        connection or db.session,
+        key=_row_order,
+    )
+
+
+# -------------------------------------------------------------------------
+# ENCODERS
+# -------------------------------------------------------------------------
+
+def _plain(value):
+    """Make a cell value JSON/CSV friendly."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(headers, rows):
+    """Yield CSV text: the header line, then CHUNK_ROWS rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow([_plain(v) for v in row])
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(headers, rows):
+    """Yield JSON lines (one object per row), CHUNK_ROWS rows per chunk."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(headers, (_plain(v) for v in row)))))
+        if len(lines) == CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+ENCODERS = {"csv": csv_chunks, "jsonl": jsonl_chunks}
+
+
+def stream_report(dataset, fmt, filters):
+    """Generator of text chunks for a streamed download."""
+    headers = [name for name, _ in COLUMNS[dataset]]
+    yield from ENCODERS[fmt](headers, iter_rows(dataset, filters))
+
+
+def download_name(dataset, fmt):
+    """File name for a download, e.g. 'atis-inspections-20260213-1448.csv'."""
+    return f"atis-{dataset}-{datetime.utcnow():%Y%m%d-%H%M}.{fmt}"
+
+
+# -------------------------------------------------------------------------
+# XLSX WRITER
+# -------------------------------------------------------------------------
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Report" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+# Control characters XML 1.0 does not allow (all below 0x20 except tab,
+# newline and carriage return); Excel refuses a sheet that contains one
+_XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_row(values):
+    """One <row> of inline-string and number cells."""
+    cells = []
+    for value in values:
+        value = _plain(value)
+        if value is None:
+            cells.append("<c/>")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f"<c t=\"n\"><v>{value}</v></c>")
+        else:
+            text = _XML_ILLEGAL.sub("", str(value))
+            cells.append(f"<c t=\"inlineStr\"><is><t>{escape(text)}</t></is></c>")
+    return "<row>" + "".join(cells) + "</row>"
+
+
+def write_xlsx(path, headers, rows, progress=None):
+    """
+    Write a single-sheet XLSX file row by row. The sheet XML is streamed into
+    the zip, so memory use does not depend on the number of rows.
+    Returns the number of data rows written.
+    """
+    count = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(headers).encode())
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode())
+                count += 1
+                if progress and count % FETCH_SIZE == 0:
+                    progress(count)
+            sheet.write(b"</sheetData></worksheet>")
+    return count
+
+
+# -------------------------------------------------------------------------
+# BACKGROUND JOBS
+# -------------------------------------------------------------------------
+
+def reports_dir(app):
+    """Folder for finished report files (created on first use)."""
+    path = os.path.join(app.instance_path, "reports")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def create_job(dataset, fmt, filters_args, user):
+    """
+    Store a queued report job, and the background job (jobs.py) that will
+    write it, in one transaction. 'filters_args' are the raw query-string values.
+    """
+    job = ReportJob(
+        dataset=dataset,
+        format=fmt,
+        filters=json.dumps(filters_args),
+        status="queued",
+        created_by=user,
+    )
+    db.session.add(job)
+    db.session.flush()
+    jobs.enqueue(db.session, "reports.export", {"report_job_id": job.id})
+    db.session.commit()
+    return job
+
+
+def _count_rows(rows, counter):
+    """Pass rows through, counting them in counter[0]."""
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def write_report_file(path, dataset, fmt, filters, connection=None):
+    """Write a whole report to 'path'. Returns the number of data rows."""
+    headers = [name for name, _ in COLUMNS[dataset]]
+    rows = iter_rows(dataset, filters, connection)
+    if fmt == "xlsx":
+        return write_xlsx(path, headers, rows)
+
+    counter = [0]
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        for chunk in ENCODERS[fmt](headers, _count_rows(rows, counter)):
+            out.write(chunk)
+    return counter[0]
+
+
+def run_job(app, job_id):
+    """
+    Produce the file for one job. Writes to a temporary name and renames it
+    when complete, so a half-written file is never offered for download.
+    """
+    with app.app_context():
+        job = db.session.get(ReportJob, job_id)
+        job.status = "running"
+        db.session.commit()
+
+        final_path = os.path.join(reports_dir(app), f"report-{job.id}.{job.format}")
+        temp_path = final_path + ".part"
+        try:
+            dataset, fmt, filters = parse_report_params(
+                {**json.loads(job.filters), "dataset": job.dataset, "format": job.format},
+                formats=JOB_FORMATS,
+            )
+            # The export reads on its own connection, so the job row can be
+            # updated and committed on the session meanwhile
+            with db.engine.connect() as connection:
+                count = write_report_file(temp_path, dataset, fmt, filters, connection)
+            os.replace(temp_path, final_path)
+            job.status = "done"
+            job.rows = count
+            job.path = final_path
+        except Exception as e:
+            app.logger.exception("Report job %s failed", job_id)
+            db.session.rollback()
+            job = db.session.get(ReportJob, job_id)
+            job.status = "failed"
+            job.error = str(e)[:500]
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        db.session.remove()
+
+
+@jobs.task("reports.export", priority=jobs.LOW, max_attempts=1)
+def export_job(payload):
+    """
+    Background job: write one report. Failures are recorded on the report
+    job itself (status "failed"), so this job is not retried.
+    """
+    report_job_id = payload["report_job_id"]
+    run_job(current_app._get_current_object(), report_job_id)
+    return {"report_job_id": report_job_id}
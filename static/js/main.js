@@ -4,35 +4,191 @@
 document.addEventListener("DOMContentLoaded", () => {
 
     /* ----- Plate search filter ----- */
+    // Narrows the rows on the page; plate-search.js suggests matching
+    // plates from all inspections under the same box
     const searchInput = document.getElementById("search-plate");
     const statusFilter = document.getElementById("status-filter");
     const tbody = document.getElementById("inspection-tbody");
 
-    function filterTable() {
-        if (!tbody) return;
+    function filterRow(row) {
         const query = (searchInput?.value || "").toLowerCase();
         const status = statusFilter?.value || "all";
 
-        tbody.querySelectorAll("tr").forEach(row => {
-            const plate = (row.querySelector(".cell-plate")?.textContent || "").toLowerCase();
-            const badge = row.querySelector(".badge");
-            const rowStatus = badge?.classList.contains("badge-safe") ? "safe" :
-                badge?.classList.contains("badge-unsafe") ? "unsafe" : "";
+        const plate = (row.querySelector(".cell-plate")?.textContent || "").toLowerCase();
+        const badge = row.querySelector(".badge");
+        const rowStatus = badge?.classList.contains("badge-safe") ? "safe" :
+            badge?.classList.contains("badge-unsafe") ? "unsafe" : "";
 
-            const matchPlate = !query || plate.includes(query);
-            const matchStatus = status === "all" || rowStatus === status;
+        const matchPlate = !query || plate.includes(query);
+        const matchStatus = status === "all" || rowStatus === status;
 
-            row.style.display = (matchPlate && matchStatus) ? "" : "none";
-        });
+        row.style.display = (matchPlate && matchStatus) ? "" : "none";
+    }
+
+    function filterTable() {
+        if (!tbody) return;
+        tbody.querySelectorAll("tr").forEach(filterRow);
     }
 
     if (searchInput) searchInput.addEventListener("input", filterTable);
     if (statusFilter) statusFilter.addEventListener("change", filterTable);
 
+    /* ----- Live updates (Server-Sent Events) ----- */
+    // The server pushes new inspections and alert changes; we patch the
+    // table and the counters in place instead of reloading the page.
+    const live = window.ATIS_EVENTS;
+    const liveStatus = document.getElementById("live-status");
+    const MAX_ROWS = tbody ? Math.max(tbody.rows.length, 10) : 10;
+    let source = null;
+    let lastEventId = live?.lastEventId || "";
+
+    function el(tag, className, text) {
+        const node = document.createElement(tag);
+        if (className) node.className = className;
+        if (text !== undefined) node.textContent = text;
+        return node;
+    }
+
+    function addToCounter(id, delta) {
+        const node = document.getElementById(id);
+        if (!node) return;
+        node.textContent = Math.max(0, (parseInt(node.textContent, 10) || 0) + delta);
+    }
+
+    function updatePassRate() {
+        const total = parseInt(document.getElementById("stat-total")?.textContent, 10) || 0;
+        const safe = parseInt(document.getElementById("stat-safe")?.textContent, 10) || 0;
+        const rate = document.getElementById("stat-pass-rate");
+        if (rate) rate.textContent = total ? (Math.round(safe / total * 1000) / 10) : 0;
+    }
+
+    function updatePending(delta) {
+        addToCounter("stat-pending", delta);
+        const badge = document.getElementById("notification-badge");
+        const pending = parseInt(document.getElementById("stat-pending")?.textContent, 10) || 0;
+        if (badge) badge.hidden = pending === 0;
+    }
+
+    function inspectionRow(item) {
+        const time = new Date(item.timestamp);
+        const row = el("tr");
+        row.dataset.inspectionId = item.id;
+
+        const timeCell = el("td", "cell-time");
+        timeCell.append(
+            el("span", "time-main", time.toLocaleTimeString("en-US")),
+            el("span", "time-sub", time.toLocaleDateString("en-US", { month: "short", day: "2-digit" })),
+        );
+
+        const locationCell = el("td", "cell-location");
+        locationCell.append(el("span", "loc-main", item.location), el("span", "loc-sub", item.camera || ""));
+
+        const statusCell = el("td");
+        statusCell.append(el("span", `badge badge-${item.status}`,
+            item.status.charAt(0).toUpperCase() + item.status.slice(1)));
+
+        const fill = el("div", `confidence-fill ${item.status}`, " ");
+        fill.style.width = `${item.confidence}%`;
+        const bar = el("div", "confidence-bar");
+        bar.append(fill);
+        const wrap = el("div", "confidence-wrap");
+        wrap.append(bar, el("span", null, `${item.confidence}%`));
+        const confidenceCell = el("td", "cell-confidence");
+        confidenceCell.append(wrap);
+
+        const link = el("a", "action-link", "View");
+        link.href = tbody.dataset.detailUrl.replace(/0$/, item.id);
+        const actionCell = el("td");
+        actionCell.append(link);
+
+        row.append(timeCell, el("td", "cell-plate", item.plate || "—"), locationCell,
+            statusCell, confidenceCell, actionCell);
+        return row;
+    }
+
+    function onInspectionCreated(item) {
+        addToCounter("stat-total", 1);
+        addToCounter(item.status === "safe" ? "stat-safe" : "stat-unsafe", 1);
+        updatePassRate();
+
+        if (!tbody) return;
+        const row = inspectionRow(item);
+        filterRow(row);
+        tbody.prepend(row);
+        while (tbody.rows.length > MAX_ROWS) tbody.deleteRow(-1);
+    }
+
+    function onAlertCreated(alert) {
+        if (alert.status === "pending") updatePending(1);
+
+        const list = document.getElementById("notif-list");
+        if (!list) return;
+        list.querySelector(".notif-empty")?.remove();
+
+        const link = el("a", "notif-link");
+        link.href = document.getElementById("notification-dropdown")
+            ?.querySelector(".notif-view-all")?.href || "#";
+        const content = el("div", "notif-content");
+        const time = new Date(alert.created_at).toLocaleTimeString("en-US", { hour: "2-digit", minute: "2-digit" });
+        content.append(
+            el("div", "notif-main", (alert.location || `Inspection #${alert.inspection_id}`).slice(0, 25)),
+            el("div", "notif-sub", `${alert.plate || "Unknown"} • ${time}`),
+        );
+        link.append(el("div", "notif-dot warning"), content);
+        const item = el("li", "notif-item");
+        item.append(link);
+        list.prepend(item);
+        while (list.children.length > 5) list.lastElementChild.remove();
+    }
+
+    function onAlertUpdated(alert) {
+        if (alert.previous_status === "pending") updatePending(-1);
+        if (alert.status === "pending") updatePending(1);
+    }
+
+    const handlers = {
+        "inspection.created": onInspectionCreated,
+        "alert.created": onAlertCreated,
+        "alert.updated": onAlertUpdated,
+    };
+
+    function connect() {
+        const url = live.url + (lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : "");
+        source = new EventSource(url);
+
+        Object.entries(handlers).forEach(([type, handler]) => {
+            source.addEventListener(type, (e) => {
+                lastEventId = e.lastEventId || lastEventId;
+                handler(JSON.parse(e.data));
+            });
+        });
+
+        // Missed too much (or the server restarted): start from a fresh page
+        source.addEventListener("reset", () => location.reload());
+
+        source.addEventListener("open", () => {
+            if (liveStatus) liveStatus.textContent = "System Online · Live";
+        });
+        source.addEventListener("error", () => {
+            // EventSource reconnects on its own, sending Last-Event-ID
+            if (liveStatus) liveStatus.textContent = "Reconnecting…";
+        });
+    }
+
+    if (live && window.EventSource) {
+        connect();
+    }
+
     /* ----- Refresh button ----- */
+    // With live updates a refresh only needs to re-sync the stream
     const refreshBtn = document.getElementById("refresh-btn");
     if (refreshBtn) {
         refreshBtn.addEventListener("click", () => {
+            if (source) {
+                source.close();
+                connect();
+                return;
+            }
             refreshBtn.disabled = true;
             refreshBtn.textContent = "Refreshing…";
             setTimeout(() => {
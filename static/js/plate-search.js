@@ -0,0 +1,112 @@
+/**
+ * plate-search.js — Plate suggestions for the plate search boxes.
+ * As the user types, asks the server's plate index (/api/plates/search) for
+ * the closest plates across all inspections, not only the rows on the page.
+ * Any input with a data-plate-search="<api url>" attribute gets a list.
+ */
+document.addEventListener("DOMContentLoaded", () => {
+    const DELAY_MS = 150;   // wait for a pause in typing before asking
+    const MIN_CHARS = 2;
+    const MAX_ITEMS = 8;
+
+    document.querySelectorAll("input[data-plate-search]").forEach((input) => {
+        const box = input.parentElement;
+        box.classList.add("plate-search");
+        input.setAttribute("autocomplete", "off");
+
+        const list = document.createElement("ul");
+        list.className = "plate-suggest";
+        list.hidden = true;
+        box.append(list);
+
+        let timer = null;
+        let controller = null;
+        let active = -1;
+
+        function close() {
+            list.hidden = true;
+            list.replaceChildren();
+            active = -1;
+        }
+
+        function suggestion(item) {
+            const link = document.createElement("a");
+            link.href = item.history_url;
+
+            const plate = document.createElement("span");
+            plate.className = "suggest-plate";
+            plate.textContent = item.plate;
+
+            const meta = document.createElement("span");
+            meta.className = "suggest-meta";
+            const others = item.spellings.slice(1, 3);
+            meta.textContent = `${item.inspections} inspection${item.inspections === 1 ? "" : "s"}` +
+                (others.length ? ` · also ${others.join(", ")}` : "");
+
+            link.append(plate, meta);
+            const row = document.createElement("li");
+            row.append(link);
+            return row;
+        }
+
+        function show(items) {
+            list.replaceChildren(...items.map(suggestion));
+            list.hidden = items.length === 0;
+            active = -1;
+        }
+
+        function highlight(index) {
+            const links = list.querySelectorAll("a");
+            if (!links.length) return;
+            active = (index + links.length) % links.length;
+            links.forEach((link, i) => link.classList.toggle("active", i === active));
+        }
+
+        async function lookup() {
+            const query = input.value.trim();
+            if (query.length < MIN_CHARS) {
+                close();
+                return;
+            }
+
+            // Only the answer to the latest keystroke matters
+            controller?.abort();
+            controller = new AbortController();
+            const url = `${input.dataset.plateSearch}?q=${encodeURIComponent(query)}&limit=${MAX_ITEMS}`;
+            try {
+                const response = await fetch(url, { signal: controller.signal });
+                if (!response.ok) {
+                    close();
+                    return;
+                }
+                const data = await response.json();
+                if (input.value.trim() === query) show(data.items);
+            } catch (err) {
+                if (err.name !== "AbortError") close();
+            }
+        }
+
+        input.addEventListener("input", () => {
+            clearTimeout(timer);
+            timer = setTimeout(lookup, DELAY_MS);
+        });
+
+        input.addEventListener("keydown", (e) => {
+            if (list.hidden) return;
+            if (e.key === "ArrowDown" || e.key === "ArrowUp") {
+                e.preventDefault();
+                highlight(active + (e.key === "ArrowDown" ? 1 : -1));
+            } else if (e.key === "Enter" && active >= 0) {
+                // Open the chosen plate instead of submitting the form
+                e.preventDefault();
+                window.location.href = list.querySelectorAll("a")[active].href;
+            } else if (e.key === "Escape") {
+                close();
+            }
+        });
+
+        document.addEventListener("click", (e) => {
+            if (!box.contains(e.target)) close();
+        });
+    });
+});
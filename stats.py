@@ -0,0 +1,341 @@
+"""
+stats.py - Materialized Dashboard Statistics
+
+The dashboard used to run several COUNT(*) queries on every page load. Instead,
+we now keep running counters in the 'stat_counters' table and update them every
+time an inspection or alert is written, deleted or changes status.
+
+Counter kinds:
+- inspection_total     (key "")             - number of inspections
+- inspection_status    (key "safe"/"unsafe")
+- inspection_location  (key = location)
+- inspection_camera    (key = camera ID)
+- inspection_hour      (key = "YYYY-MM-DDTHH")
+- inspection_defect    (key = defect name)
+- alert_status         (key = alert status)
+
+ORM writes are picked up automatically by a session hook. Code that writes with
+bulk INSERT/UPDATE statements (which skip the ORM) must build deltas with
+inspection_deltas()/alert_deltas() and call apply_deltas() itself.
+
+If the counters ever drift, 'flask stats verify' reports the differences and
+'flask stats rebuild' recalculates everything from the base tables (and the
+archive files: archived inspections stay counted, see archive.py).
+"""
+
+from collections import Counter
+
+import click
+from flask import current_app
+from sqlalchemy import event, func, inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import archive
+import cache
+from models import db, Inspection, Alert, StatCounter, DefectType, inspection_defects, split_defects
+
+# The counters the dashboard reads on every page view
+DASHBOARD_KINDS = ("inspection_total", "inspection_status", "alert_status")
+
+# Inspection columns that feed a counter (a change to any of them moves counts)
+_INSPECTION_FIELDS = ("status", "location", "camera", "timestamp", "defects")
+
+
+# -------------------------------------------------------------------------
+# BUILDING DELTAS
+# -------------------------------------------------------------------------
+
+def hour_key(timestamp):
+    """Bucket key for the per-hour counter, e.g. '2026-02-13T14'."""
+    return timestamp.strftime("%Y-%m-%dT%H")
+
+
+def inspection_deltas(deltas, values, sign=1):
+    """
+    Add (sign=+1) or remove (sign=-1) one inspection's contribution to the
+    counters. 'values' is a dict with status/location/camera/timestamp/defects keys.
+    """
+    deltas[("inspection_total", "")] += sign
+    deltas[("inspection_status", values["status"])] += sign
+    deltas[("inspection_location", values["location"])] += sign
+    if values.get("camera"):
+        deltas[("inspection_camera", values["camera"])] += sign
+    if values.get("timestamp"):
+        deltas[("inspection_hour", hour_key(values["timestamp"]))] += sign
+    for name in dict.fromkeys(split_defects(values.get("defects"))):
+        deltas[("inspection_defect", name)] += sign
+    return deltas
+
+
+def alert_deltas(deltas, status, sign=1):
+    """Add or remove one alert's contribution to the counters."""
+    deltas[("alert_status", status)] += sign
+    return deltas
+
+
+# -------------------------------------------------------------------------
+# WRITING DELTAS
+# -------------------------------------------------------------------------
+
+def apply_deltas(connection, deltas):
+    """
+    Add every non-zero delta to its counter in one batched statement.
+    Runs on the caller's connection so it commits (or rolls back)
+    together with the rows that caused it.
+    """
+    params = [
+        {"kind": kind, "key": key, "value": delta}
+        for (kind, key), delta in deltas.items()
+        if delta
+    ]
+    if not params:
+        return
+
+    table = StatCounter.__table__
+    dialect = connection.dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.kind, table.c.key],
+            set_={"value": table.c.value + stmt.excluded.value},
+        )
+        connection.execute(stmt, params)
+        return
+
+    # Other databases: update first, insert the counters that did not exist yet
+    for p in params:
+        result = connection.execute(
+            table.update()
+            .where(table.c.kind == p["kind"], table.c.key == p["key"])
+            .values(value=table.c.value + p["value"])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**p))
+
+
+def old_values(obj, fields):
+    """
+    Return the values an object had before this flush
+    (for changed attributes) or its current values (for unchanged ones).
+    """
+    state = sa_inspect(obj)
+    old = {}
+    changed = False
+    for field in fields:
+        history = state.attrs[field].history
+        if history.deleted:
+            old[field] = history.deleted[0]
+            changed = True
+        else:
+            old[field] = getattr(obj, field)
+    return old, changed
+
+
+def _collect_session_deltas(session, flush_context):
+    """
+    Session hook: after each flush, turn the inserted, deleted and modified
+    Inspection/Alert objects into counter deltas and write them.
+    """
+    deltas = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, Inspection):
+            inspection_deltas(deltas, {f: getattr(obj, f) for f in _INSPECTION_FIELDS})
+        elif isinstance(obj, Alert):
+            alert_deltas(deltas, obj.status)
+
+    for obj in session.deleted:
+        if isinstance(obj, Inspection):
+            old, _ = old_values(obj, _INSPECTION_FIELDS)
+            inspection_deltas(deltas, old, sign=-1)
+        elif isinstance(obj, Alert):
+            old, _ = old_values(obj, ("status",))
+            alert_deltas(deltas, old["status"], sign=-1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Inspection):
+            old, changed = old_values(obj, _INSPECTION_FIELDS)
+            if changed:
+                inspection_deltas(deltas, old, sign=-1)
+                inspection_deltas(deltas, {f: getattr(obj, f) for f in _INSPECTION_FIELDS})
+        elif isinstance(obj, Alert):
+            old, changed = old_values(obj, ("status",))
+            if changed:
+                alert_deltas(deltas, old["status"], sign=-1)
+                alert_deltas(deltas, obj.status)
+
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+# -------------------------------------------------------------------------
+# READING
+# -------------------------------------------------------------------------
+
+def read_counters(*kinds):
+    """
+    Fetch all counters of the given kinds in a single query.
+    Returns {kind: {key: value}}.
+    """
+    result = {kind: {} for kind in kinds}
+    rows = db.session.query(StatCounter.kind, StatCounter.key, StatCounter.value).filter(
+        StatCounter.kind.in_(kinds)
+    )
+    for kind, key, value in rows:
+        result[kind][key] = value
+    return result
+
+
+def dashboard_stats():
+    """
+    Build the 'stats' dictionary for the dashboard cards from the counters.
+    """
+    counters = read_counters(*DASHBOARD_KINDS)
+    total = counters["inspection_total"].get("", 0)
+    safe = counters["inspection_status"].get("safe", 0)
+    unsafe = counters["inspection_status"].get("unsafe", 0)
+
+    # Avoid division by zero
+    pass_rate = 0
+    if total > 0:
+        pass_rate = round((safe / total * 100), 1)
+
+    return {
+        "total": total,
+        "safe": safe,
+        "unsafe": unsafe,
+        "pending_alerts": counters["alert_status"].get("pending", 0),
+        "pass_rate": pass_rate,
+    }
+
+
+def pending_alert_count():
+    """Number of pending alerts (for the alerts badge)."""
+    return read_counters("alert_status")["alert_status"].get("pending", 0)
+
+
+# -------------------------------------------------------------------------
+# REBUILD / VERIFY
+# -------------------------------------------------------------------------
+
+def compute_counters():
+    """
+    Recalculate every counter from the base tables with GROUP BY queries,
+    including the archived months (see archive.py).
+    This is the slow, authoritative version used by rebuild and verify.
+    """
+    counts = count_rows(db.session)
+    for archive_session in archive.archive_sessions(current_app._get_current_object()):
+        counts += count_rows(archive_session)
+    return counts
+
+
+def count_rows(session):
+    """The counters for the rows of one database (main or archive)."""
+    counts = Counter()
+
+    counts[("inspection_total", "")] = session.query(func.count(Inspection.id)).scalar()
+
+    for column, kind in (
+        (Inspection.status, "inspection_status"),
+        (Inspection.location, "inspection_location"),
+        (Inspection.camera, "inspection_camera"),
+    ):
+        for key, value in session.query(column, func.count()).group_by(column):
+            if key is not None:
+                counts[(kind, key)] = value
+
+    # Same format as hour_key(), in each supported database's SQL (database.py)
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        hour = func.strftime("%Y-%m-%dT%H", Inspection.timestamp)
+    elif dialect == "postgresql":
+        hour = func.to_char(Inspection.timestamp, 'YYYY-MM-DD"T"HH24')
+    else:
+        raise NotImplementedError(f"count_rows() does not support {dialect!r} databases.")
+    for key, value in session.query(hour, func.count()).group_by(hour):
+        counts[("inspection_hour", key)] = value
+
+    defect_rows = (
+        session.query(DefectType.name, func.count())
+        .join(inspection_defects, inspection_defects.c.defect_type_id == DefectType.id)
+        .group_by(DefectType.name)
+    )
+    for key, value in defect_rows:
+        counts[("inspection_defect", key)] = value
+
+    for key, value in session.query(Alert.status, func.count()).group_by(Alert.status):
+        counts[("alert_status", key)] = value
+
+    return counts
+
+
+def rebuild():
+    """
+    Throw away the stored counters and rebuild them from the base tables.
+    Returns the number of counters written.
+    """
+    counts = compute_counters()
+    db.session.query(StatCounter).delete()
+    db.session.add_all(
+        StatCounter(kind=kind, key=key, value=value)
+        for (kind, key), value in counts.items()
+        if value
+    )
+    # Cached dashboard numbers came from the old counters
+    cache.mark_changed(db.session, *cache.DOMAINS)
+    db.session.commit()
+    return len(counts)
+
+
+def verify():
+    """
+    Compare the stored counters against the base tables.
+    Returns a list of (kind, key, stored, actual) for every mismatch.
+    """
+    actual = compute_counters()
+    stored = Counter({
+        (c.kind, c.key): c.value for c in StatCounter.query.all()
+    })
+    mismatches = []
+    for kind_key in sorted(set(actual) | set(stored)):
+        if actual[kind_key] != stored[kind_key]:
+            mismatches.append((*kind_key, stored[kind_key], actual[kind_key]))
+    return mismatches
+
+
+# -------------------------------------------------------------------------
+# FLASK INTEGRATION
+# -------------------------------------------------------------------------
+
+stats_cli = click.Group("stats", help="Maintain the dashboard counters.")
+
+
+@stats_cli.command("rebuild")
+def rebuild_command():
+    """Recalculate all counters from the inspections and alerts tables."""
+    written = rebuild()
+    click.echo(f"Rebuilt {written} counters.")
+
+
+@stats_cli.command("verify")
+def verify_command():
+    """Check the counters against the base tables (exit code 1 on drift)."""
+    mismatches = verify()
+    for kind, key, stored, actual in mismatches:
+        click.echo(f"{kind}:{key} stored={stored} actual={actual}")
+    if mismatches:
+        raise SystemExit(1)
+    click.echo("All counters match.")
+
+
+def init_app(app):
+    """
+    Register the session hook and the 'flask stats' commands.
+    """
+    if not event.contains(db.session, "after_flush", _collect_session_deltas):
+        event.listen(db.session, "after_flush", _collect_session_deltas)
+    app.cli.add_command(stats_cli)
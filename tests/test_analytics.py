@@ -0,0 +1,38 @@
+"""
+Trend rollups (analytics.py): an edit of an inspection loaded in an earlier
+transaction moves its counts out of the old buckets.
+"""
+
+from datetime import datetime, timedelta
+
+import analytics
+from models import db, Inspection, InspectionRollup
+
+LOCATIONS = ("Rollup Lane A", "Rollup Lane B")
+
+
+def rollups():
+    rows = InspectionRollup.query.filter(InspectionRollup.location.in_(LOCATIONS), InspectionRollup.count != 0)
+    return sorted((r.grain, r.bucket, r.location, r.camera, r.status, r.defect, r.count) for r in rows)
+
+
+def test_rollups_follow_edits_of_expired_objects(app):
+    with app.app_context():
+        inspection = Inspection(
+            timestamp=datetime.utcnow() - timedelta(days=2), plate="ANA-0001",
+            location=LOCATIONS[0], camera="CAM-T01", status="unsafe", confidence=90,
+            defects="Bulge,Cracking",
+        )
+        db.session.add(inspection)
+        db.session.commit()
+
+        inspection.location = LOCATIONS[1]
+        inspection.status = "safe"
+        inspection.timestamp = datetime.utcnow() - timedelta(minutes=5)
+        inspection.defects = None
+        db.session.commit()
+        incremental = rollups()
+
+        analytics.backfill()
+        assert incremental == rollups()
+        assert {row[2] for row in incremental} == {LOCATIONS[1]}
@@ -0,0 +1,124 @@
+"""
+Image and sensor file store (artifacts.py): uploads, deduplication,
+Range downloads and garbage collection.
+"""
+
+import io
+import os
+from datetime import datetime, timedelta
+
+import artifacts
+from models import db, Artifact, Inspection, InspectionArtifact
+
+TRACE = b"t,pressure\n" + b"".join(b"%d,%d\n" % (n, 200 + n % 7) for n in range(500))
+
+
+def inspection_ids(app, count=2):
+    with app.app_context():
+        return [row.id for row in Inspection.query.order_by(Inspection.id).limit(count)]
+
+
+def upload(client, inspection_id, data, kind="sensor"):
+    return client.post(
+        f"/api/inspections/{inspection_id}/artifacts?kind={kind}&filename=trace.csv",
+        data=data, content_type="text/csv",
+    )
+
+
+def test_same_file_is_stored_once(app, login):
+    first, second = inspection_ids(app)
+    content = TRACE + b"dedupe\n"
+
+    response = upload(login, first, content)
+    assert response.status_code == 201
+    sha256 = response.get_json()["artifact"]["sha256"]
+    assert upload(login, first, content).status_code == 200     # same link again
+    assert upload(login, second, content).status_code == 201
+
+    with app.app_context():
+        artifact = Artifact.query.filter_by(sha256=sha256).one()
+        assert InspectionArtifact.query.filter_by(artifact_id=artifact.id).count() == 2
+    folder = os.path.dirname(artifacts.object_path(app, sha256))
+    assert os.listdir(folder) == [sha256]
+
+
+def test_range_requests(app, login):
+    content = TRACE + b"range\n"
+    url = upload(login, inspection_ids(app)[0], content).get_json()["url"]
+
+    response = login.get(url)
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    response = login.get(url, headers={"Range": "bytes=2-11"})
+    assert response.status_code == 206
+    assert response.data == content[2:12]
+    assert response.headers["Content-Range"] == f"bytes 2-11/{len(content)}"
+
+    response = login.get(url, headers={"Range": f"bytes={len(content) + 10}-"})
+    assert response.status_code == 416
+
+
+def orphan(app, content, age=timedelta(days=2)):
+    """Store a file nothing links to, last used 'age' ago. Returns its hash."""
+    with app.app_context():
+        inspection = db.session.get(Inspection, inspection_ids(app)[0])
+        link, _ = artifacts.attach(app, inspection, io.BytesIO(content))
+        sha256 = link.artifact.sha256
+        link.artifact.last_used_at = datetime.utcnow() - age
+        db.session.delete(link)
+        db.session.commit()
+    path = artifacts.object_path(app, sha256)
+    stamp = (datetime.now() - age).timestamp()
+    os.utime(path, (stamp, stamp))
+    return sha256
+
+
+def test_gc_deletes_unused_files(app):
+    unused = orphan(app, TRACE + b"unused\n")
+    recent = orphan(app, TRACE + b"recent\n", age=timedelta(minutes=5))
+
+    with app.app_context():
+        summary = artifacts.collect_garbage(app, retention_days=0)
+        assert summary["files"] >= 1
+        assert Artifact.query.filter_by(sha256=unused).first() is None
+        assert Artifact.query.filter_by(sha256=recent).one()
+    assert not os.path.exists(artifacts.object_path(app, unused))
+    assert os.path.exists(artifacts.object_path(app, recent))
+
+
+def test_gc_during_upload_of_the_same_file(app, monkeypatch):
+    content = TRACE + b"race\n"
+    sha256 = orphan(app, content)
+
+    # 'gc' deletes the old copy after the upload has received the file but
+    # before it links it: the upload must still end up with a file
+    link_file = artifacts._link
+
+    def gc_then_link(*args):
+        summary = artifacts.collect_garbage(app, retention_days=0)
+        assert not os.path.exists(artifacts.object_path(app, sha256))
+        assert summary["files"] >= 1
+        return link_file(*args)
+
+    monkeypatch.setattr(artifacts, "_link", gc_then_link)
+    with app.app_context():
+        inspection = db.session.get(Inspection, inspection_ids(app)[0])
+        link, created = artifacts.attach(app, inspection, io.BytesIO(content))
+        assert created and link.artifact.sha256 == sha256
+    assert os.path.exists(artifacts.object_path(app, sha256))
+
+
+def test_gc_skips_files_used_since_it_looked(app):
+    sha256 = orphan(app, TRACE + b"reused\n")
+
+    with app.app_context():
+        stale = Artifact.query.filter_by(sha256=sha256).one()
+        # An upload links the file after 'gc' listed it as unused
+        inspection = db.session.get(Inspection, inspection_ids(app)[0])
+        artifacts.attach(app, inspection, io.BytesIO(TRACE + b"reused\n"))
+
+        assert artifacts._delete_artifacts(app, [stale], artifacts.GC_GRACE, unlinked=True) == (0, 0)
+        assert Artifact.query.filter_by(sha256=sha256).one()
+    assert os.path.exists(artifacts.object_path(app, sha256))
@@ -0,0 +1,27 @@
+"""
+Authorization reads (auth.py): a role change made outside this process is
+seen on the next request.
+"""
+
+from sqlalchemy import text
+
+from models import db
+
+
+def set_role(app, role):
+    # A plain UPDATE, as another process would write it: nothing bumps this
+    # process's cache generations
+    with app.app_context():
+        db.session.execute(text("UPDATE users SET role = :role WHERE email = 'admin@atis.com'"), {"role": role})
+        db.session.commit()
+
+
+def test_role_change_from_another_process(app, login):
+    assert login.get("/dashboard").status_code == 200
+    set_role(app, "Operator")
+    try:
+        assert login.get("/dashboard").status_code == 200
+        with login.session_transaction() as session:
+            assert session["role"] == "Operator"
+    finally:
+        set_role(app, "Admin")
@@ -0,0 +1,80 @@
+"""
+Query budgets (instrumentation.py): the budgeted views stay within their
+budget however many inspections and alerts there are.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import run_jobs
+from instrumentation import QueryBudgetExceeded
+from models import Alert, Inspection
+
+LOCATION = "Budget Lane"
+COUNT = 60
+
+
+@pytest.fixture(scope="module")
+def many_rows(app):
+    """COUNT inspections at LOCATION, every second one unsafe (with an alert)."""
+    client = app.test_client()
+    client.post("/login", data={"email": "admin@atis.com", "password": "admin123"})
+    now = datetime.utcnow()
+    items = [
+        {
+            "event_id": f"budget-{number}",
+            "timestamp": (now - timedelta(minutes=number)).isoformat(),
+            "plate": f"BUD-{number:04d}",
+            "location": LOCATION,
+            "camera": "CAM-B01",
+            "status": "unsafe" if number % 2 else "safe",
+            "confidence": 80,
+            "defects": "Bulge,Cracking" if number % 2 else None,
+        }
+        for number in range(COUNT)
+    ]
+    response = client.post("/api/ingest", json=items)
+    assert response.status_code in (200, 202, 207)
+    run_jobs(app)
+
+    with app.app_context():
+        inspection = Inspection.query.filter_by(plate="BUD-0001").one()
+        assert Alert.query.filter_by(inspection_id=inspection.id).count() == 1
+        return inspection.id
+
+
+BUDGETED_URLS = [
+    "/dashboard",
+    "/alerts",
+    "/alerts?status=pending",
+    "/history",
+    f"/history?location={LOCATION}",
+    "/history?defect=Bulge",
+    "/history?status=unsafe&limit=100",
+    "/api/inspections",
+    f"/api/inspections?location={LOCATION}&limit=100",
+    "/api/plates/search?q=BUD-0001",
+    "/api/trends",
+    "/api/jobs",
+]
+
+
+@pytest.mark.parametrize("url", BUDGETED_URLS)
+def test_views_stay_within_budget(login, many_rows, url):
+    # The test client runs in testing mode: going over budget raises
+    assert login.get(url).status_code == 200
+
+
+def test_detail_and_next_page_stay_within_budget(login, many_rows):
+    assert login.get(f"/inspection/{many_rows}").status_code == 200
+
+    first = login.get(f"/api/inspections?location={LOCATION}&limit=10").get_json()
+    response = login.get(f"/api/inspections?location={LOCATION}&limit=10&cursor={first['next_cursor']}")
+    assert response.status_code == 200
+
+
+def test_view_over_budget_raises(app, login, monkeypatch):
+    monkeypatch.setattr(app.view_functions["api_inspections"], "query_budget", 0)
+    with pytest.raises(QueryBudgetExceeded):
+        login.get("/api/inspections")
@@ -0,0 +1,35 @@
+"""
+Cache generations (cache.py): bumps, and renewal of the per-process ones.
+"""
+
+import time
+
+import cache
+
+
+def test_bump_gives_a_newer_generation():
+    backend = cache.MemoryBackend(ttl=60)
+    first = backend.generations(["inspections", "alerts"])
+    backend.bump(["inspections"])
+    second = backend.generations(["inspections", "alerts"])
+    assert second[0] > first[0]
+    assert second[1] == first[1]
+
+
+def test_memory_generations_are_renewed_after_ttl():
+    # Another process's write cannot bump this backend, so the generation
+    # must change on its own once the TTL has passed
+    backend = cache.MemoryBackend(ttl=0.05)
+    first = backend.generations(["inspections"])
+    assert backend.generations(["inspections"]) == first
+    time.sleep(0.1)
+    assert backend.generations(["inspections"])[0] > first[0]
+
+
+def test_sqlite_generations_are_shared(tmp_path):
+    path = str(tmp_path / "cache.db")
+    one = cache.SQLiteBackend(path)
+    other = cache.SQLiteBackend(path)
+    first = one.generations(["alerts"])
+    other.bump(["alerts"])
+    assert one.generations(["alerts"])[0] > first[0]
@@ -0,0 +1,137 @@
+"""Database settings, pool options and read-replica routing (database.py)."""
+
+import os
+
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import insert, select
+
+import database
+from conftest import TMP
+from models import db, User, READER_BIND
+
+
+def test_environment_overrides_config(monkeypatch):
+    app = Flask("settings_test")
+    app.config["ATIS_DB_POOL_SIZE"] = 3
+    monkeypatch.setenv("ATIS_DATABASE_URL", "postgresql+psycopg://atis:secret@db/atis")
+    monkeypatch.setenv("ATIS_DB_POOL_SIZE", "25")
+    monkeypatch.setenv("ATIS_DB_POOL_PRE_PING", "off")
+    monkeypatch.delenv("ATIS_DATABASE_READ_URL", raising=False)
+
+    database.configure(app)
+
+    assert app.config["SQLALCHEMY_DATABASE_URI"] == "postgresql+psycopg://atis:secret@db/atis"
+    options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    assert options["pool_size"] == 25
+    assert options["pool_pre_ping"] is False
+    assert options["max_overflow"] == database.DEFAULT_MAX_OVERFLOW
+    assert "SQLALCHEMY_BINDS" not in app.config
+
+
+def test_invalid_environment_value(monkeypatch):
+    monkeypatch.setenv("ATIS_DB_POOL_SIZE", "many")
+    with pytest.raises(ValueError, match="ATIS_DB_POOL_SIZE"):
+        database.configure(Flask("invalid_test"))
+
+
+@pytest.mark.parametrize("name", ["ATIS_DATABASE_URL", "ATIS_DATABASE_READ_URL"])
+def test_unsupported_database(monkeypatch, name):
+    monkeypatch.setenv("ATIS_DATABASE_URL", "sqlite:///atis.db")
+    monkeypatch.setenv(name, "mysql+pymysql://atis@db/atis")
+    with pytest.raises(ValueError, match="mysql"):
+        database.configure(Flask("unsupported_test"))
+
+
+def test_in_memory_sqlite_gets_no_pool_options():
+    assert database.engine_options(Flask("memory_test"), "sqlite://") == {}
+    assert database.engine_options(Flask("memory_test"), "sqlite:///:memory:") == {}
+
+
+def test_read_url_adds_reader_bind(monkeypatch):
+    app = Flask("bind_test")
+    monkeypatch.setenv("ATIS_DATABASE_URL", "postgresql+psycopg://atis@primary/atis")
+    monkeypatch.setenv("ATIS_DATABASE_READ_URL", "postgresql+psycopg://atis@replica/atis")
+    database.configure(app)
+
+    reader = app.config["SQLALCHEMY_BINDS"][READER_BIND]
+    assert reader["url"] == "postgresql+psycopg://atis@replica/atis"
+    assert reader["pool_size"] == database.DEFAULT_POOL_SIZE
+
+
+@pytest.fixture
+def replica_app(monkeypatch):
+    """
+    A small app on two SQLite files, the second one standing in for a read
+    replica, each holding a different user so the tests can tell them apart.
+    """
+    folder = os.path.join(TMP, "replica")
+    os.makedirs(folder, exist_ok=True)
+    for name in ("primary.db", "replica.db"):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    app = Flask("replica_test")
+    monkeypatch.setenv("ATIS_DATABASE_URL", f"sqlite:///{folder}/primary.db")
+    monkeypatch.setenv("ATIS_DATABASE_READ_URL", f"sqlite:///{folder}/replica.db")
+    database.configure(app)
+    db.init_app(app)
+
+    with app.app_context():
+        for engine, email in ((db.engines[None], "primary@atis.com"), (db.engines[READER_BIND], "replica@atis.com")):
+            db.metadata.create_all(engine, tables=[User.__table__])
+            with engine.begin() as connection:
+                connection.execute(insert(User.__table__).values(email=email, password="", role="Operator"))
+
+    def emails():
+        return jsonify(sorted(user.email for user in User.query))
+
+    @app.route("/replica")
+    @database.read_replica
+    def read_from_replica():
+        return emails()
+
+    @app.route("/primary")
+    def read_from_primary():
+        return emails()
+
+    @app.route("/write")
+    @database.read_replica
+    def write_in_replica_view():
+        db.session.add(User(email="new@atis.com", password="", role="Operator"))
+        db.session.commit()
+        return "", 204
+
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_read_replica_views_read_from_the_replica(replica_app):
+    client = replica_app.test_client()
+    assert client.get("/replica").get_json() == ["replica@atis.com"]
+    assert client.get("/primary").get_json() == ["primary@atis.com"]
+
+
+def test_writes_in_replica_views_go_to_the_primary(replica_app):
+    assert replica_app.test_client().get("/write").status_code == 204
+
+    with replica_app.app_context():
+        primary = db.engines[None]
+        reader = db.engines[READER_BIND]
+        with primary.connect() as connection:
+            assert "new@atis.com" in connection.execute(select(User.email)).scalars().all()
+        with reader.connect() as connection:
+            assert "new@atis.com" not in connection.execute(select(User.email)).scalars().all()
+
+
+def test_outside_requests_everything_uses_the_primary(replica_app):
+    with replica_app.app_context():
+        assert [user.email for user in User.query] == ["primary@atis.com"]
+
+
+def test_app_pages_work_on_the_configured_database(login):
+    for path in ("/dashboard", "/alerts", "/history", "/reports"):
+        assert login.get(path).status_code == 200, path
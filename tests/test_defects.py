@@ -0,0 +1,50 @@
+"""
+Defect filter and per-defect counts (defects.py) on /api/defects and /history.
+"""
+
+from collections import Counter
+
+import archive
+from models import db, Inspection, split_defects
+
+
+def expected_counts(defect):
+    """Per-defect counts of the main database's inspections that have 'defect'."""
+    counts = Counter()
+    for inspection in Inspection.query.all():
+        names = set(split_defects(inspection.defects))
+        if defect in names:
+            counts.update(names)
+    return counts
+
+
+def as_counter(response):
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["success"] is True
+    return Counter({item["name"]: item["count"] for item in data["defects"]})
+
+
+def test_defect_filter(app, login):
+    with app.app_context():
+        expected = expected_counts("Bulge")
+    assert expected["Bulge"] > 0
+
+    assert as_counter(login.get("/api/defects?defect=Bulge")) == expected
+    assert login.get("/history?defect=Bulge").status_code == 200
+
+
+def test_unfiltered_counts(login):
+    counts = as_counter(login.get("/api/defects"))
+    assert counts["Bulge"] > 0
+
+
+def test_filtered_counts_include_archive(app, login, restore_archive):
+    before = as_counter(login.get("/api/defects?defect=Bulge"))
+
+    with app.app_context():
+        bulge = [i for i in Inspection.query.all() if "Bulge" in split_defects(i.defects)]
+        archive.archive_batch(app, [bulge[0].id])
+        db.session.remove()
+
+    assert as_counter(login.get("/api/defects?defect=Bulge")) == before
@@ -0,0 +1,39 @@
+"""
+Live events (events.py): changing the status of an alert loaded in an
+earlier transaction publishes "alert.updated" with the previous status.
+"""
+
+import queue
+
+import events
+from models import db, Alert, Inspection
+
+
+def published(subscriber):
+    items = []
+    while True:
+        try:
+            items.append(subscriber.queue.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def test_alert_update_of_expired_alert(app):
+    broker = events.get_broker()
+    with app.app_context():
+        inspection = Inspection.query.filter_by(status="unsafe").first()
+        alert = Alert(inspection_id=inspection.id, status="pending")
+        db.session.add(alert)
+        db.session.commit()
+
+        subscriber, _ = broker.subscribe()
+        try:
+            alert.status = "acknowledged"
+            db.session.commit()
+            updates = [data for _, kind, data in published(subscriber) if kind == "alert.updated"]
+        finally:
+            broker.unsubscribe(subscriber)
+
+    assert len(updates) == 1
+    assert updates[0]["status"] == "acknowledged"
+    assert updates[0]["previous_status"] == "pending"
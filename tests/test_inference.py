@@ -0,0 +1,41 @@
+"""
+The /predict endpoint (inference.py): input checks.
+"""
+
+import pytest
+
+import inference
+
+
+def test_single_prediction(login):
+    response = login.post("/predict", json={"features": [0.2, 0.4, 0.6]})
+    assert response.status_code == 200
+    assert response.get_json()["success"] is True
+
+
+@pytest.mark.parametrize("value", ["NaN", "Infinity", "-Infinity"])
+def test_non_finite_features_are_rejected(login, value):
+    body = '{"features": [0.2, %s, 0.6]}' % value
+    response = login.post("/predict", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_non_finite_form_features_are_rejected(login):
+    response = login.post("/predict", data={"features": "0.2,nan,0.6"})
+    assert response.status_code == 400
+
+
+def test_too_many_inputs(login):
+    inputs = [[0.1, 0.2]] * (inference.MAX_INPUTS + 1)
+    response = login.post("/predict", json={"inputs": inputs})
+    assert response.status_code == 400
+    assert str(inference.MAX_INPUTS) in response.get_json()["message"]
+
+    response = login.post("/predict", json={"inputs": [[0.1, 0.2]] * 3})
+    assert response.status_code == 200
+    assert len(response.get_json()["results"]) == 3
+
+
+def test_inputs_must_be_a_list(login):
+    assert login.post("/predict", json={"inputs": "0.1,0.2"}).status_code == 400
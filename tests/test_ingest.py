@@ -0,0 +1,51 @@
+"""
+Batch ingestion (ingest.py): parsing of the request body and its size limit.
+"""
+
+import io
+
+import pytest
+
+import ingest
+
+
+def test_parse_formats():
+    assert ingest.parse_batch(b'[{"a": 1}, {"a": 2}]') == [{"a": 1}, {"a": 2}]
+    assert ingest.parse_batch(b'{"items": [{"a": 1}]}') == [{"a": 1}]
+    assert ingest.parse_batch(b'{"a": 1}\n{"a": 2}\n', "application/x-ndjson") == [{"a": 1}, {"a": 2}]
+
+
+def test_body_that_is_not_utf8():
+    with pytest.raises(ingest.BatchError):
+        ingest.parse_batch(b'[{"plate": "\xff\xfe"}]')
+
+
+def test_api_rejects_body_that_is_not_utf8(login):
+    response = login.post("/api/ingest", data=b'[{"plate": "\xff"}]', content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+@pytest.fixture
+def small_body_limit(app):
+    old = app.config["ATIS_INGEST_MAX_BYTES"]
+    app.config["ATIS_INGEST_MAX_BYTES"] = 1000
+    yield 1000
+    app.config["ATIS_INGEST_MAX_BYTES"] = old
+
+
+def test_api_rejects_large_body(login, small_body_limit):
+    body = b"[" + b",".join([b'{"event_id": "big", "location": "x"}'] * 100) + b"]"
+    response = login.post("/api/ingest", data=body, content_type="application/json")
+    assert response.status_code == 413
+    assert response.get_json()["success"] is False
+
+
+def test_api_rejects_large_body_without_length(login, small_body_limit):
+    # A chunked upload has no Content-Length: reading stops at the limit
+    # (the server marks such bodies with wsgi.input_terminated)
+    body = io.BytesIO(b'{"event_id": "chunked", "location": "' + b"x" * 5000 + b'"}')
+    response = login.post("/api/ingest", input_stream=body, content_type="application/json",
+                          headers={"Transfer-Encoding": "chunked"},
+                          environ_overrides={"wsgi.input_terminated": True})
+    assert response.status_code == 413
@@ -0,0 +1,179 @@
+"""
+Background jobs (jobs.py): settings from the environment, who may see the
+queue, retries, leases, and query counting next to worker threads.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from instrumentation import count_queries
+from models import db, Job, User
+
+
+def test_workers_from_environment(app):
+    # conftest.py sets ATIS_JOB_WORKERS=0 in the environment
+    assert app.config["ATIS_JOB_WORKERS"] == 0
+    assert jobs.get_runner(app).workers == 0
+
+
+def test_only_admins_see_jobs(app, login):
+    assert login.get("/api/jobs").status_code == 200
+
+    operator = app.test_client()
+    response = operator.post("/login", data={"email": "operator@atis.com", "password": "operator123"})
+    assert response.status_code == 302
+    assert operator.get("/api/jobs").status_code == 403
+    assert operator.get("/api/jobs/1").status_code == 403
+
+    assert app.test_client().get("/api/jobs").status_code == 401
+
+
+def test_edge_boxes_see_one_job(app, client):
+    old_key = app.config["ATIS_INGEST_API_KEY"]
+    app.config["ATIS_INGEST_API_KEY"] = "test-key"
+    try:
+        with app.app_context():
+            job = Job(kind="test.noop", payload="{}")
+            db.session.add(job)
+            db.session.commit()
+            job_id = job.id
+        response = client.get(f"/api/jobs/{job_id}", headers={"X-API-Key": "test-key"})
+        assert response.status_code == 200
+        assert client.get("/api/jobs", headers={"X-API-Key": "test-key"}).status_code == 401
+    finally:
+        app.config["ATIS_INGEST_API_KEY"] = old_key
+        with app.app_context():
+            Job.query.filter_by(kind="test.noop").delete()
+            db.session.commit()
+
+
+def test_count_queries_ignores_other_threads(app):
+    def other_thread():
+        with app.app_context():
+            User.query.count()
+
+    with count_queries() as counter:
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+    assert counter.count == 0
+
+    with app.app_context(), count_queries() as counter:
+        User.query.count()
+    assert counter.count == 1
+
+
+@pytest.fixture
+def flaky_task(monkeypatch):
+    """
+    Register "test.flaky", which fails as long as calls["failures"] > 0.
+    Its jobs get priority 0, so run_next() takes them before anything else.
+    """
+    calls = {"count": 0, "failures": 0}
+
+    def flaky(payload):
+        calls["count"] += 1
+        if calls["failures"] > 0:
+            calls["failures"] -= 1
+            raise RuntimeError("sensor offline")
+        return {"echo": payload.get("value")}
+
+    monkeypatch.setitem(jobs._TASKS, "test.flaky", jobs.Task("test.flaky", flaky, 0, 3))
+    return calls
+
+
+def queue_flaky(app, **options):
+    with app.app_context():
+        job = jobs.enqueue(db.session, "test.flaky", {"value": 7}, **options)
+        db.session.commit()
+        return job.id
+
+
+def make_due(app, job_id):
+    """Skip the retry delay."""
+    with app.app_context():
+        db.session.get(Job, job_id).run_at = datetime.utcnow()
+        db.session.commit()
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    for attempts in range(1, 8):
+        delay = jobs.BACKOFF_BASE * 2 ** (attempts - 1)
+        assert delay / 2 <= jobs.backoff(attempts) <= delay
+    assert jobs.backoff(40) <= jobs.BACKOFF_MAX
+
+
+def test_failed_job_is_retried_later(app, flaky_task):
+    flaky_task["failures"] = 1
+    job_id = queue_flaky(app)
+
+    with app.app_context():
+        assert jobs.run_next("pytest")
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.attempts, job.locked_by) == ("queued", 1, None)
+        assert job.error == "RuntimeError: sensor offline"
+        delay = (job.run_at - datetime.utcnow()).total_seconds()
+        assert 0 < delay <= jobs.BACKOFF_BASE
+        db.session.remove()
+
+    make_due(app, job_id)
+    with app.app_context():
+        assert jobs.run_next("pytest")
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.attempts, job.to_dict()["result"]) == ("done", 2, {"echo": 7})
+    assert flaky_task["count"] == 2
+
+
+def test_job_fails_for_good_after_max_attempts(app, flaky_task):
+    flaky_task["failures"] = 10
+    job_id = queue_flaky(app)
+
+    for attempt in range(1, 4):
+        make_due(app, job_id)
+        with app.app_context():
+            assert jobs.run_next("pytest")
+            job = db.session.get(Job, job_id)
+            assert job.attempts == attempt
+            assert job.status == ("failed" if attempt == 3 else "queued")
+
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.finished_at is not None and job.locked_by is None
+        assert job.error == "RuntimeError: sensor offline"
+    assert flaky_task["count"] == 3
+
+
+def test_stale_lease_is_taken_back(app, flaky_task):
+    job_id = queue_flaky(app)
+    last_try = queue_flaky(app, max_attempts=1)
+
+    with app.app_context():
+        # Two workers take the jobs and die; their leases run out
+        assert jobs.claim("dead-worker-1").id == job_id
+        assert jobs.claim("dead-worker-2").id == last_try
+        running = queue_flaky(app)
+        assert jobs.claim("live-worker").id == running
+        long_ago = datetime.utcnow() - timedelta(seconds=120)
+        Job.query.filter(Job.id.in_([job_id, last_try])).update({"locked_at": long_ago})
+        db.session.commit()
+
+        assert jobs.requeue_stale(lease=60) == 2
+        assert db.session.get(Job, running).status == "running"
+        assert db.session.get(Job, last_try).status == "failed"
+        job = db.session.get(Job, job_id)
+        assert (job.status, job.locked_by, job.attempts) == ("queued", None, 1)
+
+        # The dead worker cannot finish the job any more...
+        assert not jobs._finish(job_id, "dead-worker-1", status="done")
+        db.session.commit()
+        db.session.remove()
+
+    # ...another worker runs it instead
+    with app.app_context():
+        assert jobs.run_next("pytest")
+        assert db.session.get(Job, job_id).status == "done"
+        assert jobs._finish(running, "live-worker", status="done")
+        db.session.commit()
@@ -0,0 +1,33 @@
+"""
+Plate search index (plates.py): correcting the plate of an inspection
+loaded in an earlier transaction moves it to the new spelling.
+"""
+
+from datetime import datetime
+
+from models import db, Inspection, Plate
+
+
+def spelling(plate):
+    row = Plate.query.filter_by(plate=plate).first()
+    return row.inspections if row else 0
+
+
+def test_plate_edit_of_expired_inspection(app):
+    with app.app_context():
+        inspection = Inspection(
+            timestamp=datetime.utcnow(), plate="QZX-4417", location="Plate Lane",
+            camera="CAM-T01", status="safe", confidence=90,
+        )
+        db.session.add(inspection)
+        db.session.commit()
+        assert spelling("QZX-4417") == 1
+
+        inspection.plate = "QZX-4418"
+        db.session.commit()
+        assert spelling("QZX-4417") == 0
+        assert spelling("QZX-4418") == 1
+
+        db.session.delete(inspection)
+        db.session.commit()
+        assert spelling("QZX-4418") == 0
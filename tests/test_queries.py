@@ -0,0 +1,75 @@
+"""
+Cursor pagination (queries.py): cursor tokens and paging through
+/api/inspections.
+"""
+
+import base64
+from datetime import datetime
+
+import pytest
+
+from models import db, Inspection
+from queries import decode_cursor, encode_cursor
+
+
+def token(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    stamp = datetime(2026, 2, 13, 14, 48, 33, 125000)
+    assert decode_cursor(encode_cursor(stamp, 42)) == (stamp, 42)
+
+
+BAD_CURSORS = [
+    "not a cursor!",
+    "é",
+    token("no separator"),
+    token("2026-02-13T14:48:33|x"),
+    token("a|b|c"),
+    token("2026-02-13T14:48:33|" + "9" * 30),     # id too big for the database
+    token("2026-02-13T14:48:33+05:00|5"),         # never written by encode_cursor
+    encode_cursor(datetime(2026, 2, 13), 42)[:-3],
+]
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_bad_cursor(login, cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+    for params in ({"cursor": cursor}, {"cursor": cursor, "format": "ndjson"}):
+        response = login.get("/api/inspections", query_string=params)
+        assert response.status_code == 400
+        assert response.get_json()["success"] is False
+
+    # The HTML page starts over at the first page instead
+    response = login.get("/history", query_string={"cursor": cursor, "status": "unsafe"})
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/history?status=unsafe"
+
+
+def test_pages_with_equal_timestamps(app, login):
+    stamp = datetime(2026, 2, 10, 8, 0, 0)
+    with app.app_context():
+        rows = [
+            Inspection(timestamp=stamp, plate=f"CUR-{n:04d}", location="Cursor Lane",
+                       camera="CAM-C01", status="safe", confidence=90)
+            for n in range(7)
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        expected = sorted((row.id for row in rows), reverse=True)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"location": "Cursor Lane", "limit": 3, **({"cursor": cursor} if cursor else {})}
+        data = login.get("/api/inspections", query_string=params).get_json()
+        assert len(data["items"]) <= 3
+        seen += [item["id"] for item in data["items"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == expected
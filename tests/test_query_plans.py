@@ -0,0 +1,40 @@
+"""
+Query plans (database.py): every view query searches an index or stops
+after its LIMIT, like 'flask check-query-plans'.
+"""
+
+import pytest
+
+import database
+from models import db, Inspection
+from queries import build_page_query
+
+
+@pytest.fixture
+def sqlite_context(app):
+    with app.app_context():
+        if db.session.get_bind().dialect.name != "sqlite":
+            pytest.skip("EXPLAIN QUERY PLAN checks only run on SQLite.")
+        yield
+
+
+def test_view_queries_use_indexes(sqlite_context):
+    results = database.check_query_plans()
+    assert results
+    failures = {label: plan for label, plan, problems in results if problems}
+    assert failures == {}
+
+
+def test_filtered_index_walk_is_a_problem(sqlite_context):
+    # Newest first with a filter the index does not cover: walks the whole
+    # timestamp index when few rows match
+    query = build_page_query({"defect": "Bulge"})
+    plan = database.explain(query)
+    assert any(line.startswith("SCAN inspections USING INDEX") for line in plan)
+    assert database.plan_problems(query, plan)
+
+
+def test_bounded_and_unbounded_walks(sqlite_context):
+    newest = Inspection.query.order_by(Inspection.timestamp.desc(), Inspection.id.desc())
+    assert database.plan_problems(newest.limit(10), database.explain(newest.limit(10))) == []
+    assert database.plan_problems(newest, database.explain(newest))
@@ -0,0 +1,25 @@
+"""
+Report exports (reports.py): job parameters and the XLSX writer.
+"""
+
+import zipfile
+from xml.etree import ElementTree
+
+import reports
+
+
+def test_xlsx_drops_control_characters(tmp_path):
+    path = tmp_path / "report.xlsx"
+    rows = [["tab\there", "bell\x07 and nul\x00", 3, "line\nbreak"]]
+    assert reports.write_xlsx(path, ["a", "b", "c", "d"], rows) == 1
+
+    with zipfile.ZipFile(path) as archive:
+        sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    texts = [t.text for t in sheet.iter("{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t")]
+    assert texts[4:] == ["tab\there", "bell and nul", "line\nbreak"]
+
+
+def test_report_job_needs_an_object(login):
+    response = login.post("/api/reports/jobs", json=["inspections", "csv"])
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
@@ -0,0 +1,43 @@
+"""
+Dashboard counters (stats.py): edits and deletes of inspections and alerts
+loaded in an earlier transaction must move the counts, not only add to them.
+"""
+
+from datetime import datetime, timedelta
+
+import stats
+from models import db, Alert, Inspection
+
+
+def test_counters_follow_edits_of_expired_objects(app):
+    with app.app_context():
+        assert stats.verify() == []
+
+        inspection = Inspection(
+            timestamp=datetime.utcnow() - timedelta(hours=3), plate="STA-0001",
+            location="Test Lane", camera="CAM-T01", status="unsafe", confidence=90,
+            defects="Bulge",
+        )
+        db.session.add(inspection)
+        db.session.flush()
+        alert = Alert(inspection_id=inspection.id, status="pending")
+        db.session.add(alert)
+        db.session.commit()
+        assert stats.verify() == []
+
+        # After the commit every attribute is expired: the hooks must still
+        # know the old values
+        inspection.status = "safe"
+        inspection.location = "Other Lane"
+        inspection.camera = "CAM-T02"
+        inspection.timestamp = datetime.utcnow() - timedelta(hours=1)
+        inspection.defects = "Cracking"
+        alert.status = "resolved"
+        db.session.commit()
+        assert stats.verify() == []
+
+        db.session.delete(alert)
+        db.session.commit()
+        db.session.delete(inspection)
+        db.session.commit()
+        assert stats.verify() == []
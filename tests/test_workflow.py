@@ -0,0 +1,93 @@
+"""
+Alert workflow (workflow.py): the state machine, version conflicts and
+bulk changes through the API.
+"""
+
+import pytest
+
+import workflow
+from models import db, Alert, Inspection
+
+
+def new_alerts(app, count=1, status="pending"):
+    """Fresh alerts on a seeded unsafe inspection. Returns their ids."""
+    with app.app_context():
+        inspection = Inspection.query.filter_by(status="unsafe").first()
+        alerts = [Alert(inspection_id=inspection.id, status=status) for _ in range(count)]
+        db.session.add_all(alerts)
+        db.session.commit()
+        return [alert.id for alert in alerts]
+
+
+def test_state_machine():
+    assert workflow.can_transition("pending", "acknowledged")
+    assert workflow.can_transition("escalated", "acknowledged")
+    assert not workflow.can_transition("acknowledged", "pending")
+    assert not any(workflow.can_transition("resolved", target) for target in workflow.STATUSES)
+    assert sorted(workflow.allowed_sources("resolved")) == ["acknowledged", "escalated", "pending"]
+
+
+def test_transition_and_stale_version(app, login):
+    alert_id = new_alerts(app)[0]
+    url = f"/api/alerts/{alert_id}/transition"
+
+    response = login.post(url, json={"status": "acknowledged", "version": 1, "response": "On it"})
+    assert response.status_code == 200
+    assert response.get_json()["alert"]["version"] == 2
+
+    # A second operator still has version 1 on screen
+    response = login.post(url, json={"status": "resolved", "version": 1})
+    assert response.status_code == 409
+    assert response.get_json()["alert"]["status"] == "acknowledged"
+    assert response.get_json()["alert"]["version"] == 2
+
+
+def test_illegal_transition(app, login):
+    alert_id = new_alerts(app, status="resolved")[0]
+    response = login.post(f"/api/alerts/{alert_id}/transition", json={"status": "acknowledged", "version": 1})
+    assert response.status_code == 422
+    assert response.get_json()["alert"]["status"] == "resolved"
+
+    response = login.post(f"/api/alerts/{alert_id}/transition", json={"status": "reopened", "version": 1})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("url", ["/api/alerts/1/transition", "/api/alerts/bulk"])
+@pytest.mark.parametrize("body", [[], [1], "resolved", 3])
+def test_body_must_be_an_object(login, url, body):
+    response = login.post(url, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_conflict_on_an_alert_that_is_gone(login, monkeypatch):
+    # The alert was archived or deleted between the UPDATE and the reload
+    monkeypatch.setattr(workflow, "transition_alerts",
+                        lambda items, target, response: {"results": [{"id": 10**9, "result": "conflict"}]})
+    response = login.post(f"/api/alerts/{10**9}/transition", json={"status": "resolved", "version": 1})
+    assert response.status_code == 404
+
+
+def test_bulk_partly_succeeds(app, login):
+    fresh, stale, done = new_alerts(app, 3)
+    with app.app_context():
+        db.session.get(Alert, done).status = "resolved"
+        db.session.commit()
+
+    response = login.post("/api/alerts/bulk", json={
+        "status": "escalated",
+        "alerts": [
+            {"id": fresh, "version": 1},
+            {"id": stale, "version": 7},
+            {"id": done, "version": 2},
+            {"id": 10**9, "version": 1},
+        ],
+    })
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data["updated"], data["conflicts"], data["invalid"], data["not_found"]) == (1, 1, 1, 1)
+    assert [r["result"] for r in data["results"]] == ["updated", "conflict", "invalid_transition", "not_found"]
+
+    with app.app_context():
+        assert db.session.get(Alert, fresh).status == "escalated"
+        assert db.session.get(Alert, stale).status == "pending"
@@ -0,0 +1,220 @@
+"""
+workflow.py - Alert Workflow (status changes)
+
+Every alert moves through a small state machine:
+
+- pending       -> acknowledged, escalated or resolved
+- acknowledged  -> escalated or resolved
+- escalated     -> acknowledged or resolved
+- resolved      (final)
+
+Two operators may look at the same alert at once. Each alert has a
+'version' number that goes up on every change; a change must name the
+version the operator saw, and is refused (a "conflict") if the alert was
+changed in the meantime. Nobody silently overwrites anybody else.
+
+Bulk changes (clearing hundreds of alerts after an incident) run as one
+SELECT and one UPDATE per batch of BATCH_SIZE alerts, not one ORM object
+at a time. Because that UPDATE skips the ORM, the dashboard counters and
+live events are updated here directly.
+"""
+
+from collections import Counter
+
+from sqlalchemy import tuple_, update
+
+import cache
+import events
+import stats
+from models import db, Alert
+
+# Allowed moves: current status -> statuses it may change to
+TRANSITIONS = {
+    "pending": {"acknowledged", "escalated", "resolved"},
+    "acknowledged": {"escalated", "resolved"},
+    "escalated": {"acknowledged", "resolved"},
+    "resolved": set(),
+}
+
+STATUSES = tuple(TRANSITIONS)
+
+# Alerts changed per UPDATE statement
+BATCH_SIZE = 500
+
+# Largest bulk request we accept
+MAX_BULK = 5000
+
+RESPONSE_MAX_LENGTH = 200
+
+
+class WorkflowError(ValueError):
+    """The request itself is invalid (unknown status, bad item list...)."""
+
+
+def can_transition(current, target):
+    """True if an alert in status 'current' may move to 'target'."""
+    return target in TRANSITIONS.get(current, ())
+
+
+def allowed_sources(target):
+    """Statuses from which an alert may move to 'target'."""
+    return [status for status, targets in TRANSITIONS.items() if target in targets]
+
+
+# -------------------------------------------------------------------------
+# PARSING
+# -------------------------------------------------------------------------
+
+def parse_target(data):
+    """Read and check "status" and the optional "response" note."""
+    target = str(data.get("status", "")).strip().lower()
+    if target not in TRANSITIONS:
+        raise WorkflowError(f"status must be one of: {', '.join(STATUSES)}.")
+
+    response = data.get("response")
+    if response is not None:
+        response = str(response).strip()
+        if len(response) > RESPONSE_MAX_LENGTH:
+            raise WorkflowError(f"response must be at most {RESPONSE_MAX_LENGTH} characters.")
+    return target, response or None
+
+
+def parse_items(raw):
+    """
+    Read the list of alerts to change: [{"id": 1, "version": 3}, ...].
+    Returns a list of (id, version) pairs, in request order.
+    """
+    if not isinstance(raw, list) or not raw:
+        raise WorkflowError("alerts must be a non-empty list of {\"id\", \"version\"} objects.")
+    if len(raw) > MAX_BULK:
+        raise WorkflowError(f"At most {MAX_BULK} alerts per request.")
+
+    items = []
+    for entry in raw:
+        if not isinstance(entry, dict):
+            raise WorkflowError("Each alert must be an object with \"id\" and \"version\".")
+        alert_id, version = entry.get("id"), entry.get("version")
+        if not _is_int(alert_id) or not _is_int(version):
+            raise WorkflowError("Each alert needs an integer \"id\" and \"version\".")
+        items.append((alert_id, version))
+    return items
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# -------------------------------------------------------------------------
+# TRANSITIONS
+# -------------------------------------------------------------------------
+
+def _transition_batch(items, target, response):
+    """
+    Apply one batch (at most BATCH_SIZE alerts) inside the current
+    transaction. Returns {alert_id: result dict}.
+    """
+    ids = [alert_id for alert_id, _ in items]
+    current = {
+        row.id: row
+        for row in db.session.query(Alert.id, Alert.status, Alert.version).filter(Alert.id.in_(ids))
+    }
+
+    results = {}
+    candidates = []
+    for alert_id, version in items:
+        row = current.get(alert_id)
+        if row is None:
+            results[alert_id] = {"id": alert_id, "result": "not_found"}
+        elif row.version != version:
+            results[alert_id] = {"id": alert_id, "result": "conflict", "status": row.status, "version": row.version}
+        elif not can_transition(row.status, target):
+            results[alert_id] = {
+                "id": alert_id,
+                "result": "invalid_transition",
+                "status": row.status,
+                "version": row.version,
+                "message": f"An alert cannot move from {row.status} to {target}.",
+            }
+        else:
+            candidates.append((alert_id, version))
+
+    if not candidates:
+        return results
+
+    values = {"status": target, "version": Alert.version + 1}
+    if response is not None:
+        values["response"] = response
+
+    # One UPDATE for the whole batch. The WHERE clause re-checks version and
+    # status, so a change made by someone else since our SELECT still wins.
+    stmt = (
+        update(Alert)
+        .where(
+            tuple_(Alert.id, Alert.version).in_(candidates),
+            Alert.status.in_(allowed_sources(target)),
+        )
+        .values(**values)
+        .returning(Alert.id, Alert.inspection_id, Alert.response, Alert.created_at, Alert.version)
+        .execution_options(synchronize_session=False)
+    )
+    updated = {row.id: row for row in db.session.execute(stmt)}
+
+    deltas = Counter()
+    for alert_id, _ in candidates:
+        row = updated.get(alert_id)
+        previous = current[alert_id].status
+        if row is None:
+            results[alert_id] = {"id": alert_id, "result": "conflict"}
+            continue
+
+        stats.alert_deltas(deltas, previous, sign=-1)
+        stats.alert_deltas(deltas, target)
+        data = {
+            "id": alert_id,
+            "inspection_id": row.inspection_id,
+            "status": target,
+            "previous_status": previous,
+            "response": row.response,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "version": row.version,
+        }
+        events.queue_event(db.session, "alert.updated", data)
+        results[alert_id] = {"result": "updated", **data}
+
+    stats.apply_deltas(db.session.connection(), deltas)
+    if updated:
+        cache.mark_changed(db.session, "alerts")
+    return results
+
+
+def transition_alerts(items, target, response=None):
+    """
+    Move many alerts to 'target' in one transaction.
+    'items' is a list of (alert_id, expected_version) pairs.
+
+    Returns a summary with one result per alert, in request order:
+    "updated", "conflict" (someone changed it first - reload and retry),
+    "invalid_transition" or "not_found".
+    """
+    # The same alert listed twice only counts once (the first entry wins)
+    first = {}
+    for alert_id, version in items:
+        first.setdefault(alert_id, version)
+    items = list(first.items())
+
+    results = {}
+    for start in range(0, len(items), BATCH_SIZE):
+        results.update(_transition_batch(items[start:start + BATCH_SIZE], target, response))
+    db.session.commit()
+
+    ordered = [results[alert_id] for alert_id, _ in items]
+
+    summary = Counter(r["result"] for r in ordered)
+    return {
+        "success": True,
+        "updated": summary["updated"],
+        "conflicts": summary["conflict"],
+        "invalid": summary["invalid_transition"],
+        "not_found": summary["not_found"],
+        "results": ordered,
+    }